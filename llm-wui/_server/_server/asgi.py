@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', '_server.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings
+
+if settings.PRELOAD_RAG:
+    from core.preload import preload
+
+    preload()
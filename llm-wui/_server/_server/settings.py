@@ -64,6 +64,33 @@ MIDDLEWARE = [
 if DEBUG:
     MIDDLEWARE.append("core.middleware.asset_proxy_middleware")
 
+# Request timing and sampled cProfile capture (see core/middleware.py and the
+# slow_requests view). Off unless PROFILING_ENABLED is set. A request is
+# profiled at PROFILING_SAMPLE_RATE or when a staff user sends PROFILING_HEADER;
+# profiles of requests taking PROFILING_SLOW_SECONDS or more are saved to
+# PROFILING_DIR, keeping the newest PROFILING_MAX_FILES.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))
+PROFILING_HEADER = os.getenv("PROFILING_HEADER", "X-Profile")
+PROFILING_SLOW_SECONDS = float(os.getenv("PROFILING_SLOW_SECONDS", "1"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", BASE_DIR / "profiles")
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "200"))
+# Requests kept in the rolling timing buffer, and functions listed per profile
+PROFILING_BUFFER_SIZE = int(os.getenv("PROFILING_BUFFER_SIZE", "1000"))
+PROFILING_TOP_FUNCTIONS = int(os.getenv("PROFILING_TOP_FUNCTIONS", "15"))
+
+if PROFILING_ENABLED:
+    # Inside the session and auth middleware, so it can tell staff requests apart
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index("django.contrib.auth.middleware.AuthenticationMiddleware") + 1,
+        "core.middleware.profiling_middleware",
+    )
+
+# Import the RAG stack (langchain, FAISS, ...) when the app starts instead of on
+# first use, see core/preload.py. entrypoint.sh turns it on with gunicorn
+# --preload so it's loaded once and shared by the workers.
+PRELOAD_RAG = os.getenv("PRELOAD_RAG", "").lower() in ("1", "true", "yes")
+
 ROOT_URLCONF = "_server.urls"
 
 TEMPLATES = [
@@ -91,7 +118,12 @@ WSGI_APPLICATION = "_server.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.getenv("DATABASE_PATH", BASE_DIR / "db.sqlite3"),
+        # Concurrent chats write messages (and the FTS triggers) at the same
+        # time. IMMEDIATE takes the write lock when a transaction starts, so
+        # writers wait up to `timeout` seconds for each other instead of
+        # failing with "database is locked" when a read upgrades to a write.
+        "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 20},
     }
 }
 
@@ -144,6 +176,131 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 LOGIN_URL = "registration/sign_in/"
 
+# Shared http client pools to Ollama and SearXNG (see core/clients.py).
+# UPSTREAM_TIMEOUT bounds the wait between streamed chunks, not the whole generation.
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "600"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "50"))
+
+# "chat" sends structured history to /api/chat so Ollama can reuse its prompt
+# cache across turns, "generate" sends one flat prompt to /api/generate.
+# OLLAMA_KEEP_ALIVE keeps the model (and its cache) loaded between turns.
+OLLAMA_API = os.getenv("OLLAMA_API", "chat")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Comma separated Ollama urls to spread generations over (see core/router.py).
+# Empty means every user talks to the ollama url in their settings.
+OLLAMA_BACKENDS = [
+    url.strip() for url in os.getenv("OLLAMA_BACKENDS", "").split(",") if url.strip()
+]
+# Seconds between /api/ps health checks of each backend
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "5"))
+# A backend with the model loaded is preferred over the least loaded backend
+# while it has at most this many more generations outstanding
+OLLAMA_AFFINITY_SLACK = int(os.getenv("OLLAMA_AFFINITY_SLACK", "2"))
+
+# Generation admission (see core/admission.py), per worker process. At most
+# GENERATION_CONCURRENCY generations run at once and GENERATION_PER_USER per
+# user; the rest wait in per-user queues that are served in turn. send_chat
+# answers 429 once a user has GENERATION_QUEUE_PER_USER waiting or
+# GENERATION_QUEUE_TOTAL are waiting overall, counting the ones still being
+# prepared (attachments, retrieval, web search).
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "8"))
+GENERATION_PER_USER = int(os.getenv("GENERATION_PER_USER", "2"))
+GENERATION_QUEUE_PER_USER = int(os.getenv("GENERATION_QUEUE_PER_USER", "4"))
+GENERATION_QUEUE_TOTAL = int(os.getenv("GENERATION_QUEUE_TOTAL", "256"))
+# Assumed generation length for wait estimates until real ones are measured
+GENERATION_DEFAULT_SECONDS = float(os.getenv("GENERATION_DEFAULT_SECONDS", "20"))
+# Seconds between queue position updates on a streamed send_chat
+GENERATION_QUEUE_UPDATE_INTERVAL = float(os.getenv("GENERATION_QUEUE_UPDATE_INTERVAL", "1"))
+
+# Per-stage timeouts (seconds) for preparing a chat prompt. A stage that times
+# out or fails is skipped and the prompt is built without it.
+STAGE_TIMEOUT_ATTACHMENTS = float(os.getenv("STAGE_TIMEOUT_ATTACHMENTS", "120"))
+STAGE_TIMEOUT_HISTORY = float(os.getenv("STAGE_TIMEOUT_HISTORY", "10"))
+STAGE_TIMEOUT_SEARCH = float(os.getenv("STAGE_TIMEOUT_SEARCH", "25"))
+
+# Attachment extraction (see core/extraction.py). PDFs longer than
+# PDF_PAGES_PER_TASK pages are extracted in parallel in PDF_WORKERS processes.
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(50 * 1024 * 1024)))
+# Threads indexing documents uploaded through upload_file in the background
+LIBRARY_INDEX_WORKERS = int(os.getenv("LIBRARY_INDEX_WORKERS", "2"))
+ATTACHMENT_PREVIEW_CHARS = int(os.getenv("ATTACHMENT_PREVIEW_CHARS", "8000"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "1000"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+PDF_PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT", "10"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 2)))
+
+# Candidates fetched from a user's library index before filtering to the
+# documents attached to the chat
+LIBRARY_FETCH_K = int(os.getenv("LIBRARY_FETCH_K", "2000"))
+# Library indexes kept loaded in memory for retrieval
+LIBRARY_INDEX_CACHE_SIZE = int(os.getenv("LIBRARY_INDEX_CACHE_SIZE", "16"))
+
+# get_chats returns the chat list in pages of CHAT_PAGE_SIZE, at most CHAT_PAGE_MAX
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+CHAT_PAGE_MAX = int(os.getenv("CHAT_PAGE_MAX", "200"))
+
+# load_chat returns the last MESSAGE_PAGE_SIZE messages of a chat, at most MESSAGE_PAGE_MAX
+MESSAGE_PAGE_SIZE = int(os.getenv("MESSAGE_PAGE_SIZE", "50"))
+MESSAGE_PAGE_MAX = int(os.getenv("MESSAGE_PAGE_MAX", "500"))
+
+# search_chats returns CHAT_SEARCH_LIMIT matching messages, at most CHAT_SEARCH_MAX
+CHAT_SEARCH_LIMIT = int(os.getenv("CHAT_SEARCH_LIMIT", "20"))
+CHAT_SEARCH_MAX = int(os.getenv("CHAT_SEARCH_MAX", "100"))
+
+# Each user's messages are embedded into a vector index for semantic_search.
+# It's exact until it holds MESSAGE_INDEX_ANN_THRESHOLD messages, then HNSW.
+MESSAGE_INDEX_BATCH_SIZE = int(os.getenv("MESSAGE_INDEX_BATCH_SIZE", "256"))
+MESSAGE_INDEX_ANN_THRESHOLD = int(os.getenv("MESSAGE_INDEX_ANN_THRESHOLD", "20000"))
+MESSAGE_INDEX_HNSW_M = int(os.getenv("MESSAGE_INDEX_HNSW_M", "32"))
+MESSAGE_INDEX_EF_SEARCH = int(os.getenv("MESSAGE_INDEX_EF_SEARCH", "64"))
+# Rebuild the index once this fraction of it is messages from deleted chats
+MESSAGE_INDEX_MAX_DELETED = float(os.getenv("MESSAGE_INDEX_MAX_DELETED", "0.25"))
+# Indexes kept loaded in memory for queries
+MESSAGE_INDEX_CACHE_SIZE = int(os.getenv("MESSAGE_INDEX_CACHE_SIZE", "16"))
+SEMANTIC_SEARCH_K = int(os.getenv("SEMANTIC_SEARCH_K", "10"))
+SEMANTIC_SEARCH_PREVIEW_CHARS = int(os.getenv("SEMANTIC_SEARCH_PREVIEW_CHARS", "300"))
+
+# Per-user settings (ollama and searxng urls) are cached in each process
+USER_SETTINGS_CACHE_TTL = float(os.getenv("USER_SETTINGS_CACHE_TTL", "30"))
+USER_SETTINGS_CACHE_SIZE = int(os.getenv("USER_SETTINGS_CACHE_SIZE", "10000"))
+
+# get_models serves each ollama server's model list from memory for
+# MODELS_CACHE_TTL seconds, then keeps serving it while refreshing in the
+# background, until it's MODELS_CACHE_MAX_STALE seconds old
+MODELS_CACHE_TTL = float(os.getenv("MODELS_CACHE_TTL", "60"))
+MODELS_CACHE_MAX_STALE = float(os.getenv("MODELS_CACHE_MAX_STALE", "3600"))
+
+# Web search results are cached per (query, searxng url, top_n)
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+
+# Content addressed cache of chunk embeddings (see core/embedding_cache.py)
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", BASE_DIR / "document_storage" / "embedding_cache.sqlite3"
+)
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Shared embedding scheduler (see core/embedding_scheduler.py). While chat
+# generations are streaming only EMBEDDING_BUSY_CONCURRENCY embed calls run.
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "2"))
+EMBEDDING_BUSY_CONCURRENCY = int(os.getenv("EMBEDDING_BUSY_CONCURRENCY", "1"))
+
+# Prometheus metrics at /metrics (see core/metrics.py). Scrapers authenticate
+# with "Authorization: Bearer METRICS_TOKEN"; without a token only staff can
+# read them. With several worker processes set METRICS_DIR to a directory
+# they share (entrypoint.sh empties it on start), each writes its metrics
+# there every METRICS_FLUSH_INTERVAL seconds and /metrics adds them up.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Label combinations kept per metric, the rest are counted under "other"
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "1000"))
+
 # CORS configuration
 # In development (DEBUG=True) allow all origins for convenience. In production,
 # set CORS_ALLOWED_ORIGINS in your .env to a comma-separated list.
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', '_server.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings
+
+if settings.PRELOAD_RAG:
+    from core.preload import preload
+
+    preload()
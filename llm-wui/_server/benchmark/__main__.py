@@ -0,0 +1,102 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+
+# Run from _server so the app's packages import like they do under manage.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark.runner import SCENARIOS, print_report, run
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description=(
+            "Benchmark the backend without GPUs: fake Ollama and SearXNG servers "
+            "stand in for the upstreams, a throwaway database is seeded and the "
+            "app is run under uvicorn. Run from the _server directory."
+        ),
+    )
+    workload = parser.add_argument_group("workload")
+    workload.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        type=lambda value: [name for name in value.split(",") if name],
+        help=f"Comma separated, run in order (default: {','.join(SCENARIOS)})",
+    )
+    workload.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    workload.add_argument("--concurrency", type=int, default=8, help="Requests in flight")
+    workload.add_argument(
+        "--users",
+        type=int,
+        default=None,
+        help="Users the requests are spread over (default: the concurrency, so "
+        "the per-user generation limits don't queue them)",
+    )
+    workload.add_argument("--chats", type=int, default=50, help="Chats per user")
+    workload.add_argument("--history", type=int, default=20, help="Messages per chat")
+    workload.add_argument("--message-chars", type=int, default=400, help="Length of each seeded message")
+    workload.add_argument(
+        "--attachment-kb", type=int, default=0, help="Size of a text file attached to each send_chat"
+    )
+    workload.add_argument("--web-search", action="store_true", help="Search the web on each send_chat")
+    workload.add_argument("--no-stream", action="store_true", help="Send send_chat without streaming")
+    workload.add_argument("--page-size", type=int, default=50, help="get_chats/load_chat limit")
+    workload.add_argument("--timeout", type=float, default=300, help="Per request timeout in seconds")
+    workload.add_argument("--seed", type=int, default=0, help="Random seed for generated text")
+
+    upstream = parser.add_argument_group("fake upstreams")
+    upstream.add_argument("--tokens-per-second", type=float, default=50, help="Generation speed")
+    upstream.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    upstream.add_argument("--tokens", type=int, default=128, help="Tokens per response")
+    upstream.add_argument("--embed-seconds", type=float, default=0.0, help="Latency of each embed call")
+    upstream.add_argument("--search-latency", type=float, default=0.1, help="Latency of each search")
+    upstream.add_argument(
+        "--backends",
+        type=int,
+        default=0,
+        help="Start this many fake Ollama servers and route over them with OLLAMA_BACKENDS",
+    )
+
+    server = parser.add_argument_group("server")
+    server.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+
+    output = parser.add_argument_group("output")
+    output.add_argument(
+        "--output",
+        default=None,
+        help="Where to save the JSON results (default: benchmark-<time>.json)",
+    )
+    output.add_argument("--compare", default=None, help="Earlier results to show the change against")
+
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.users is None:
+        args.users = args.concurrency
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+
+    report = run(args)
+
+    output = args.output or f"benchmark-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report, previous)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_MODELS = ["bench-model:latest"]
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def start(self) -> str:
+        """
+        Serve in a background thread
+
+        Returns:
+            str: The server url
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def handle_error(self, request, client_address):
+        # The app closing a connection early (a stopped generation) isn't an error
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, data, status: int = 200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_found(self):
+        self.send_json({"error": "not found"}, status=404)
+
+
+class FakeOllamaHandler(_Handler):
+    """
+    Stands in for Ollama: streams /api/generate and /api/chat at
+    server.tokens_per_second after server.ttft seconds, and answers
+    /api/tags, /api/ps and /api/embed(dings)
+    """
+
+    def do_GET(self):
+        if self.path.startswith("/api/tags"):
+            return self.send_json(
+                {
+                    "models": [
+                        {
+                            "name": name,
+                            "size": 4_000_000_000,
+                            "modified_at": "2024-01-01T00:00:00Z",
+                            "details": {
+                                "family": "llama",
+                                "parameter_size": "8B",
+                                "quantization_level": "Q4_K_M",
+                            },
+                        }
+                        for name in FAKE_MODELS
+                    ]
+                }
+            )
+        if self.path.startswith("/api/ps"):
+            return self.send_json({"models": [{"name": name} for name in FAKE_MODELS]})
+        if self.path in ("/", "/api/version"):
+            return self.send_json({"version": "0.0.0-benchmark"})
+        self.not_found()
+
+    def do_POST(self):
+        body = self.read_json()
+        if self.path in ("/api/generate", "/api/chat"):
+            return self.stream_generation(body)
+        if self.path == "/api/embed":
+            texts = body.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            time.sleep(self.server.embed_seconds)
+            return self.send_json({"embeddings": [self.server.embed(t) for t in texts]})
+        if self.path == "/api/embeddings":
+            time.sleep(self.server.embed_seconds)
+            return self.send_json({"embedding": self.server.embed(body.get("prompt", ""))})
+        self.not_found()
+
+    def stream_generation(self, body: dict):
+        server = self.server
+        chat = self.path == "/api/chat"
+        if chat:
+            prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+        else:
+            prompt = body.get("prompt", "")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(data: dict):
+            line = (json.dumps(data) + "\n").encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+
+        started = time.perf_counter()
+        try:
+            time.sleep(server.ttft)
+            eval_started = time.perf_counter()
+            for i in range(server.tokens):
+                token = f"token{i} "
+                if chat:
+                    write({"message": {"role": "assistant", "content": token}, "done": False})
+                else:
+                    write({"response": token, "done": False})
+                # Sleep until the token's due time so write overhead doesn't slow the rate
+                due = eval_started + (i + 1) / server.tokens_per_second
+                time.sleep(max(0.0, due - time.perf_counter()))
+
+            finished = time.perf_counter()
+            final = {
+                "done": True,
+                "total_duration": int((finished - started) * 1e9),
+                "load_duration": 0,
+                # Roughly four characters per token
+                "prompt_eval_count": len(prompt) // 4,
+                "prompt_eval_duration": int(server.ttft * 1e9),
+                "eval_count": server.tokens,
+                "eval_duration": int((finished - eval_started) * 1e9),
+            }
+            if chat:
+                final["message"] = {"role": "assistant", "content": ""}
+            else:
+                final["response"] = ""
+            write(final)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The app stopped the generation
+            self.close_connection = True
+
+
+class FakeOllama(FakeServer):
+    def __init__(
+        self,
+        tokens_per_second: float = 50,
+        ttft: float = 0.2,
+        tokens: int = 128,
+        embed_seconds: float = 0.0,
+        dimension: int = 768,
+        port: int = 0,
+    ):
+        super().__init__(("127.0.0.1", port), FakeOllamaHandler)
+        self.tokens_per_second = tokens_per_second
+        self.ttft = ttft
+        self.tokens = tokens
+        self.embed_seconds = embed_seconds
+        self.dimension = dimension
+
+    def embed(self, text: str) -> list:
+        # Deterministic, so the same text always gets the same vector
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [
+            (digest[i % len(digest)] - 127.5) / 127.5 for i in range(self.dimension)
+        ]
+
+
+class FakeSearxngHandler(_Handler):
+    """
+    Stands in for SearXNG's /search?format=json
+    """
+
+    def do_GET(self):
+        if not self.path.startswith("/search"):
+            return self.not_found()
+        time.sleep(self.server.latency)
+        self.send_json(
+            {
+                "results": [
+                    {
+                        "title": f"Result {i}",
+                        "url": f"https://example.com/{i}",
+                        "content": "Lorem ipsum dolor sit amet. " * 8,
+                        "engine": "benchmark",
+                    }
+                    for i in range(self.server.results)
+                ]
+            }
+        )
+
+
+class FakeSearxng(FakeServer):
+    def __init__(self, latency: float = 0.1, results: int = 10, port: int = 0):
+        super().__init__(("127.0.0.1", port), FakeSearxngHandler)
+        self.latency = latency
+        self.results = results
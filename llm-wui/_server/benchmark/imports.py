@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Run from _server so the app's packages import like they do under manage.py
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from core.preload import RAG_MODULES
+
+MARKER = "benchmark-stage:"
+
+# Runs in a fresh interpreter under -X importtime; prints each stage's import
+# time and RSS to stdout, and a marker before its imports to stderr
+PROBE = """
+import json, sys, time
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def stage(name, load):
+    sys.stderr.write("{marker}" + name + "\\n")
+    sys.stderr.flush()
+    started = time.perf_counter()
+    load()
+    print(json.dumps({{"stage": name, "seconds": time.perf_counter() - started, "rss_mb": rss_mb()}}), flush=True)
+
+print(json.dumps({{"stage": "interpreter", "seconds": 0.0, "rss_mb": rss_mb()}}), flush=True)
+
+def setup():
+    import django
+    django.setup()
+
+stage("django.setup", setup)
+for name in {stages!r}:
+    # An import statement, import_module() throws off importtime's nesting
+    stage(name, lambda: exec("import " + name))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    Split -X importtime output by stage
+
+    Returns:
+        dict: Stage name to [(cumulative_us, self_us, module)] of the modules
+            the stage's own module (or the stage, if it isn't a module)
+            imported directly, not the ones they imported in turn
+    """
+    stages = {}
+    current = None
+    for line in stderr.splitlines():
+        if line.startswith(MARKER):
+            current = stages.setdefault(line[len(MARKER) :], [])
+            continue
+        if current is None or not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        # Nested imports are indented two spaces under the module importing them
+        name = fields[2][1:]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        current.append((depth, int(fields[1]), int(fields[0]), name.strip()))
+
+    for stage, rows in stages.items():
+        depth = 1 if (0, stage) in {(row[0], row[3]) for row in rows} else 0
+        stages[stage] = [row[1:] for row in rows if row[0] == depth]
+    return stages
+
+
+def import_report(stages: list, env: dict = None) -> dict:
+    """
+    Import the app's modules one after the other in a fresh interpreter
+
+    Args:
+        stages (list): Modules to import after django.setup(), in order
+        env (dict): Environment of the interpreter
+
+    Returns:
+        dict: {"stages": [{"stage", "seconds", "rss_mb", "modules"}]}
+    """
+    env = {**os.environ, **(env or {})}
+    env.setdefault("DJANGO_SETTINGS_MODULE", "_server.settings")
+    # Time the imports themselves, not the preload they'd trigger
+    env.pop("PRELOAD_RAG", None)
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(marker=MARKER, stages=list(stages))],
+        cwd=SERVER_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import failed:\n{result.stderr[-4000:]}")
+
+    modules = parse_importtime(result.stderr)
+    report = []
+    for line in result.stdout.splitlines():
+        if not line.startswith("{"):
+            continue
+        row = json.loads(line)
+        row["modules"] = sorted(modules.get(row["stage"], []), reverse=True)
+        report.append(row)
+    return {"stages": report}
+
+
+def print_import_report(report: dict, top: int):
+    print(f"{'stage':<28}{'seconds':>10}{'rss MB':>10}{'+MB':>8}")
+    previous = None
+    for row in report["stages"]:
+        grown = row["rss_mb"] - previous if previous is not None else 0.0
+        previous = row["rss_mb"]
+        print(f"{row['stage']:<28}{row['seconds']:>10.3f}{row['rss_mb']:>10.1f}{grown:>8.1f}")
+
+    print()
+    print(f"Slowest imports per stage (cumulative, top {top}):")
+    for row in report["stages"]:
+        if not row["modules"]:
+            continue
+        print(f"  {row['stage']}")
+        for cumulative, own, module in row["modules"][:top]:
+            print(f"    {cumulative / 1e6:>8.3f}s  {module}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark.imports",
+        description=(
+            "Report how long importing the app takes and how much memory it "
+            "adds: django.setup(), core.views, then each module of the RAG "
+            "stack core.views loads on first use. Run from the _server directory."
+        ),
+    )
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports listed per stage")
+    parser.add_argument("--output", default=None, help="Also save the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = import_report(("core.views",) + RAG_MODULES)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print_import_report(report, args.top)
+
+
+if __name__ == "__main__":
+    main()
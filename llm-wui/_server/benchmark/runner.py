@@ -0,0 +1,503 @@
+import asyncio
+import base64
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+from benchmark.fake_servers import FakeOllama, FakeSearxng
+
+SCENARIOS = ("send_chat", "get_chats", "load_chat")
+
+CSRF_TOKEN = "b" * 32
+
+WORDS = (
+    "model token latency throughput server request stream memory index vector "
+    "chunk prompt answer document search result context window cache queue"
+).split()
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    Linearly interpolated percentile
+
+    Args:
+        values (list): Sorted values
+        q (float): 0 to 100
+
+    Returns:
+        float: The percentile, None without values
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(seconds: list) -> dict:
+    """
+    Returns:
+        dict: {"p50", "p95", "p99", "mean", "max"} in milliseconds
+    """
+    values = sorted(s * 1000 for s in seconds)
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    return {
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "mean": round(sum(values) / len(values), 2),
+        "max": round(values[-1], 2),
+    }
+
+
+def random_text(size: int, rng: random.Random) -> str:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_tree(pid: int) -> list:
+    """
+    A process and its descendants (uvicorn --workers forks children), Linux only
+    """
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def peak_rss_mb(pid: int) -> float:
+    """
+    Sum of the peak resident set size (VmHWM) of the server processes
+
+    Returns:
+        float: Megabytes, None where /proc isn't available
+    """
+    total = 0
+    found = False
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1])
+                        found = True
+        except OSError:
+            continue
+    return round(total / 1024, 1) if found else None
+
+
+def reset_peak_rss(pid: int):
+    # Writing 5 to clear_refs resets VmHWM, so each scenario gets its own peak
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed(run_id: str, args, ollama_url: str, search_url: str) -> list:
+    """
+    Create the benchmark users, each with args.chats chats of args.history messages
+
+    Returns:
+        list: [{"user", "cookies", "chat_ids", "next_ordinal"}]
+    """
+    from django.contrib.auth.models import User
+    from django.test import Client
+    from core.models import Chats, Message, Settings
+
+    rng = random.Random(args.seed)
+    today = datetime.date.today()
+    users = []
+    for i in range(args.users):
+        user = User.objects.create_user(f"benchmark-{run_id}-{i}", password=run_id)
+        Settings.objects.create(user=user, ollama_url=ollama_url, search_url=search_url)
+
+        chats = Chats.objects.bulk_create(
+            [
+                Chats(
+                    user=user,
+                    chat_id=chat_id,
+                    time_stamp=today - datetime.timedelta(days=chat_id),
+                    title=f"Benchmark chat {chat_id}",
+                )
+                for chat_id in range(1, args.chats + 1)
+            ]
+        )
+        messages = []
+        for chat in chats:
+            for ordinal in range(args.history):
+                messages.append(
+                    Message(
+                        chat=chat,
+                        ordinal=ordinal,
+                        role="user" if ordinal % 2 == 0 else "assistant",
+                        content=random_text(args.message_chars, rng),
+                    )
+                )
+            if len(messages) >= 5000:
+                Message.objects.bulk_create(messages)
+                messages = []
+        Message.objects.bulk_create(messages)
+
+        client = Client()
+        client.force_login(user)
+        users.append(
+            {
+                "user": user,
+                "cookies": {
+                    "sessionid": client.cookies["sessionid"].value,
+                    "csrftoken": CSRF_TOKEN,
+                },
+                "chat_ids": [chat.chat_id for chat in chats],
+                "next_ordinal": {chat.chat_id: args.history for chat in chats},
+            }
+        )
+    return users
+
+
+def start_server(args, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "_server.asgi:application",
+        "--host",
+        "127.0.0.1",
+        "--port",
+        str(port),
+        "--log-level",
+        "warning",
+    ]
+    if args.workers > 1:
+        command += ["--workers", str(args.workers)]
+    return subprocess.Popen(command, env=os.environ.copy())
+
+
+def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The server exited during startup")
+        try:
+            httpx.get(f"{base_url}/registration/sign_in/", timeout=2)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError("The server didn't start in time")
+
+
+class Scenario:
+    """
+    Sends one kind of request at a fixed concurrency and records latencies
+    """
+
+    def __init__(self, name: str, args, users: list, clients: list, attachment: str):
+        self.name = name
+        self.args = args
+        self.users = users
+        self.clients = clients
+        self.attachment = attachment
+        self.latencies = []
+        self.ttfts = []
+        self.errors = 0
+        self.error_samples = []
+        self._next = 0
+
+    async def run(self) -> float:
+        """
+        Returns:
+            float: Wall time in seconds
+        """
+        started = time.perf_counter()
+        await asyncio.gather(*[self.worker() for _ in range(self.args.concurrency)])
+        return time.perf_counter() - started
+
+    async def worker(self):
+        while self._next < self.args.requests:
+            i = self._next
+            self._next += 1
+            user_index = i % len(self.users)
+            started = time.perf_counter()
+            try:
+                ok, ttft, detail = await getattr(self, self.name)(
+                    i, self.users[user_index], self.clients[user_index], started
+                )
+            except httpx.HTTPError as e:
+                ok, ttft, detail = False, None, repr(e)
+            if ok:
+                self.latencies.append(time.perf_counter() - started)
+                if ttft is not None:
+                    self.ttfts.append(ttft)
+            else:
+                self.errors += 1
+                if len(self.error_samples) < 5:
+                    self.error_samples.append(detail)
+
+    async def send_chat(self, i: int, user: dict, client: httpx.AsyncClient, started: float):
+        chat_id = user["chat_ids"][i // len(self.users) % len(user["chat_ids"])]
+        counter = user["next_ordinal"][chat_id]
+        user["next_ordinal"][chat_id] += 2
+
+        attachments = []
+        if self.attachment:
+            attachments.append(
+                {"name": f"benchmark-{i}.txt", "extension": "txt", "file": self.attachment}
+            )
+        body = {
+            "chat_id": chat_id,
+            "counter": counter,
+            "search_web": self.args.web_search,
+            "model_name": "bench-model:latest",
+            # Unique so web search and embedding caches don't answer for the server
+            "message": {"content": f"Benchmark question {i}", "attachments": attachments},
+            "stream": not self.args.no_stream,
+        }
+
+        if self.args.no_stream:
+            response = await client.post("/send_chat", json=body)
+            data = response.json() if response.status_code == 200 else {}
+            ok = response.status_code == 200 and data.get("response") not in (
+                None,
+                "Error getting response",
+            )
+            return ok, None, f"{response.status_code} {response.text[:200]}"
+
+        ttft = None
+        async with client.stream("POST", "/send_chat", json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return False, None, f"{response.status_code} {response.text[:200]}"
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    return False, None, data["error"]
+                if ttft is None and data.get("response") and not data.get("done"):
+                    ttft = time.perf_counter() - started
+                if data.get("done"):
+                    return True, ttft, None
+        return False, None, "Stream ended without a done line"
+
+    async def get_chats(self, i: int, user: dict, client: httpx.AsyncClient, started: float):
+        response = await client.get("/get_chats", params={"limit": self.args.page_size})
+        ok = response.status_code == 200 and isinstance(response.json()["response"], dict)
+        return ok, None, f"{response.status_code} {response.text[:200]}"
+
+    async def load_chat(self, i: int, user: dict, client: httpx.AsyncClient, started: float):
+        chat_id = user["chat_ids"][i // len(self.users) % len(user["chat_ids"])]
+        response = await client.post(
+            "/load_chat", json={"chat_id": chat_id, "limit": self.args.page_size}
+        )
+        ok = response.status_code == 200 and isinstance(response.json()["response"], dict)
+        return ok, None, f"{response.status_code} {response.text[:200]}"
+
+
+async def run_scenarios(args, base_url: str, users: list, server_pid: int) -> dict:
+    attachment = ""
+    if args.attachment_kb:
+        text = random_text(args.attachment_kb * 1024, random.Random(args.seed + 1))
+        attachment = base64.b64encode(text.encode()).decode()
+
+    headers = {"X-CSRFToken": CSRF_TOKEN, "Referer": base_url + "/"}
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.concurrency + 10)
+    clients = [
+        httpx.AsyncClient(
+            base_url=base_url,
+            cookies=user["cookies"],
+            headers=headers,
+            timeout=timeout,
+            limits=limits,
+        )
+        for user in users
+    ]
+
+    results = {}
+    try:
+        for name in args.scenarios:
+            print(f"Running {name}: {args.requests} requests at concurrency {args.concurrency}")
+            reset_peak_rss(server_pid)
+            scenario = Scenario(name, args, users, clients, attachment)
+            wall = await scenario.run()
+            results[name] = {
+                "requests": args.requests,
+                "succeeded": len(scenario.latencies),
+                "errors": scenario.errors,
+                "error_samples": scenario.error_samples,
+                "seconds": round(wall, 3),
+                "requests_per_second": round(len(scenario.latencies) / wall, 2) if wall else None,
+                "latency_ms": summarize(scenario.latencies),
+                "peak_rss_mb": peak_rss_mb(server_pid),
+            }
+            if scenario.ttfts:
+                results[name]["time_to_first_token_ms"] = summarize(scenario.ttfts)
+    finally:
+        await asyncio.gather(*[client.aclose() for client in clients])
+    return results
+
+
+def print_report(report: dict, previous: dict = None):
+    header = f"{'scenario':<10} {'ok':>6} {'err':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rss MB':>8}"
+    print(header)
+    for name, result in report["scenarios"].items():
+        latency = result["latency_ms"]
+        print(
+            f"{name:<10} {result['succeeded']:>6} {result['errors']:>5} "
+            f"{_cell(result['requests_per_second'])} {_cell(latency['p50'])} "
+            f"{_cell(latency['p95'])} {_cell(latency['p99'])} {_cell(result['peak_rss_mb'], 8)}"
+        )
+        if "time_to_first_token_ms" in result:
+            ttft = result["time_to_first_token_ms"]
+            print(f"{'  ttft':<34} {_cell(ttft['p50'])} {_cell(ttft['p95'])} {_cell(ttft['p99'])}")
+        for sample in result["error_samples"]:
+            print(f"  error: {sample}")
+
+        before = (previous or {}).get("scenarios", {}).get(name)
+        if before:
+            print(
+                f"{'  change':<24}"
+                f"{_change(before['requests_per_second'], result['requests_per_second'])} "
+                f"{_change(before['latency_ms']['p50'], latency['p50'])} "
+                f"{_change(before['latency_ms']['p95'], latency['p95'])} "
+                f"{_change(before['latency_ms']['p99'], latency['p99'])} "
+                f"{_change(before['peak_rss_mb'], result['peak_rss_mb'], 8)}"
+            )
+
+
+def _cell(value, width: int = 9) -> str:
+    return f"{'-' if value is None else value:>{width}}"
+
+
+def _change(before, after, width: int = 9) -> str:
+    if not before or after is None:
+        return f"{'-':>{width}}"
+    return f"{(after - before) / before * 100:>+{width - 1}.1f}%"
+
+
+def run(args) -> dict:
+    """
+    Run the benchmark: start the fake upstreams, seed a throwaway database,
+    start the app under uvicorn and drive the scenarios against it
+
+    Args:
+        args (argparse.Namespace): Parsed command line, see benchmark/__main__.py
+
+    Returns:
+        dict: The report
+    """
+    run_id = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    work_dir = tempfile.mkdtemp(prefix="llm-wui-benchmark-")
+
+    # With --backends the app routes generations over that many fake servers
+    ollamas = [
+        FakeOllama(
+            tokens_per_second=args.tokens_per_second,
+            ttft=args.ttft,
+            tokens=args.tokens,
+            embed_seconds=args.embed_seconds,
+        )
+        for _ in range(max(args.backends, 1))
+    ]
+    searxng = FakeSearxng(latency=args.search_latency)
+    ollama_urls = [ollama.start() for ollama in ollamas]
+    ollama_url = ollama_urls[0]
+    search_url = searxng.start()
+
+    # The app and this process share the throwaway database
+    os.environ.update(
+        {
+            "DJANGO_SETTINGS_MODULE": "_server.settings",
+            "DATABASE_PATH": os.path.join(work_dir, "db.sqlite3"),
+            "EMBEDDING_CACHE_PATH": os.path.join(work_dir, "embedding_cache.sqlite3"),
+            "METRICS_DIR": "",
+            # Embeddings go to OLLAMA_HOST
+            "OLLAMA_HOST": ollama_url,
+        }
+    )
+    if args.backends:
+        os.environ["OLLAMA_BACKENDS"] = ",".join(ollama_urls)
+
+    import django
+
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+    print(f"Seeding {args.users} users with {args.chats} chats of {args.history} messages")
+    users = seed(run_id, args, ollama_url, search_url)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(args, port)
+    try:
+        wait_until_ready(base_url, server)
+        scenarios = asyncio.run(run_scenarios(args, base_url, users, server.pid))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        for ollama in ollamas:
+            ollama.shutdown()
+        searxng.shutdown()
+        for user in users:
+            shutil.rmtree(
+                os.path.join(settings.BASE_DIR, f"document_storage/f{user['user']}"),
+                ignore_errors=True,
+            )
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "started_at": run_id,
+        "git_commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "scenarios": scenarios,
+    }
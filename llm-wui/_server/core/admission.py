@@ -0,0 +1,335 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from django.conf import settings
+
+
+class QueueFull(Exception):
+    """Raised when a generation can't be queued because the queues are full"""
+
+
+class Ticket:
+    """
+    A user's place in the generation queue. Release it when the generation
+    ends, whether or not it was admitted.
+    """
+
+    def __init__(self, controller, user_id, loop):
+        self.controller = controller
+        self.user_id = user_id
+        self.loop = loop
+        self.future = loop.create_future()
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.released = False
+
+    @property
+    def admitted(self) -> bool:
+        return self.admitted_at is not None
+
+    async def wait(self, timeout: float = None, stop: asyncio.Event = None) -> bool:
+        """
+        Wait to be admitted
+
+        Args:
+            timeout (float, optional): Give up waiting after this many seconds. Defaults to None.
+            stop (asyncio.Event, optional): Give up waiting when it's set. Defaults to None.
+
+        Returns:
+            bool: Whether the ticket was admitted
+        """
+        waiters = {self.future}
+        if stop is not None:
+            stopped = asyncio.ensure_future(stop.wait())
+            waiters.add(stopped)
+        try:
+            # Unlike wait_for, leaves the future alone when giving up
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if stop is not None:
+                stopped.cancel()
+        return self.future.done()
+
+    def status(self) -> dict:
+        """
+        Returns:
+            dict: {"position", "estimated_wait"} while queued
+        """
+        return self.controller.status(self)
+
+    def release(self):
+        self.controller.release(self)
+
+
+class Preparation:
+    """
+    A generation being prepared (attachments, retrieval, web search) before
+    it's queued. It counts against the queue limits until the block using it
+    ends and the work it holds on to (see hold_until) is done, so requests
+    can't pile up work before reaching the queue.
+    """
+
+    def __init__(self, controller, user_id):
+        self.controller = controller
+        self.user_id = user_id
+        # The block plus each unfinished hold_until future
+        self._holds = 1
+        self._lock = threading.Lock()
+
+    def hold_until(self, future):
+        """
+        Keep counting the preparation after the block ends until a future is
+        done, for work that goes on when the request stops waiting for it
+        (a thread past its stage timeout)
+
+        Args:
+            future (Future): asyncio or concurrent.futures future
+        """
+        with self._lock:
+            self._holds += 1
+        future.add_done_callback(lambda future: self._release())
+
+    def _release(self):
+        with self._lock:
+            self._holds -= 1
+            done = self._holds == 0
+        if done:
+            self.controller.end_preparation(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._release()
+
+
+class AdmissionController:
+    """
+    Admits at most `concurrency` generations at once and at most `per_user`
+    per user. Waiting generations are queued per user and users take turns
+    (round robin), so one user's backlog can't hold everyone else up.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        per_user: int,
+        queue_per_user: int,
+        queue_total: int,
+        default_duration: float,
+    ):
+        self.concurrency = concurrency
+        self.per_user = per_user
+        self.queue_per_user = queue_per_user
+        self.queue_total = queue_total
+
+        self._lock = threading.Lock()
+        self._running = 0
+        self._running_by_user = {}
+        # {user id: deque of tickets}, in the order users get their next turn
+        self._queues = OrderedDict()
+        self._queued = 0
+        # Generations being prepared, {user id: count} and in total
+        self._preparing_by_user = {}
+        self._preparing = 0
+        # Moving average of how long an admitted generation runs for
+        self._duration = default_duration
+
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+
+    def enqueue(self, user_id) -> Ticket:
+        """
+        Queue a generation, admitting it straight away if there's capacity
+
+        Args:
+            user_id (int): The user starting the generation
+
+        Raises:
+            QueueFull: The user's queue or the total queue is full
+
+        Returns:
+            Ticket: The ticket to wait on and release
+        """
+        ticket = Ticket(self, user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._reject_if_full(user_id)
+            self._queues.setdefault(user_id, deque()).append(ticket)
+            self._queued += 1
+            self._dispatch()
+        return ticket
+
+    def prepare(self, user_id) -> Preparation:
+        """
+        Reserve a place for a generation while it's prepared, rejecting it
+        before any work is done if it couldn't be queued now. Enqueue it after
+        the preparation ends.
+
+        Args:
+            user_id (int): The user
+
+        Raises:
+            QueueFull: The user's queue or the total queue is full
+
+        Returns:
+            Preparation: Context manager holding the place
+        """
+        with self._lock:
+            self._reject_if_full(user_id)
+            self._preparing_by_user[user_id] = self._preparing_by_user.get(user_id, 0) + 1
+            self._preparing += 1
+        return Preparation(self, user_id)
+
+    def end_preparation(self, preparation: Preparation):
+        with self._lock:
+            self._preparing -= 1
+            count = self._preparing_by_user.get(preparation.user_id, 0) - 1
+            if count > 0:
+                self._preparing_by_user[preparation.user_id] = count
+            else:
+                self._preparing_by_user.pop(preparation.user_id, None)
+
+    def _reject_if_full(self, user_id):
+        # Called with the lock held. Generations being prepared count as queued.
+        waiting = len(self._queues.get(user_id, ())) + self._preparing_by_user.get(user_id, 0)
+        if waiting >= self.queue_per_user or self._queued + self._preparing >= self.queue_total:
+            self.rejected += 1
+            raise QueueFull()
+
+    def _dispatch(self):
+        # Called with the lock held. Hands free slots to users in turn.
+        while self._running < self.concurrency and self._queued:
+            for user_id, queue in self._queues.items():
+                if self._running_by_user.get(user_id, 0) < self.per_user:
+                    break
+            else:
+                return
+
+            ticket = queue.popleft()
+            self._queued -= 1
+            # Their turn is used, so they go to the back
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+
+            self._running += 1
+            self._running_by_user[user_id] = self._running_by_user.get(user_id, 0) + 1
+            ticket.admitted_at = time.monotonic()
+            self.admitted += 1
+            self.total_wait += ticket.admitted_at - ticket.enqueued_at
+            try:
+                ticket.loop.call_soon_threadsafe(_admit, ticket.future)
+            except RuntimeError:
+                # The waiting request's event loop is gone, give the slot back
+                ticket.released = True
+                self._finish(ticket)
+
+    def _finish(self, ticket: Ticket):
+        self._running -= 1
+        count = self._running_by_user.get(ticket.user_id, 0) - 1
+        if count > 0:
+            self._running_by_user[ticket.user_id] = count
+        else:
+            self._running_by_user.pop(ticket.user_id, None)
+
+    def release(self, ticket: Ticket):
+        """
+        End a generation, or leave the queue if it was never admitted.
+        Releasing twice does nothing.
+
+        Args:
+            ticket (Ticket): The ticket
+        """
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+
+            if ticket.admitted:
+                duration = time.monotonic() - ticket.admitted_at
+                self._duration = 0.8 * self._duration + 0.2 * duration
+                self._finish(ticket)
+            else:
+                queue = self._queues.get(ticket.user_id)
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+                    self._queued -= 1
+                    if not queue:
+                        del self._queues[ticket.user_id]
+            self._dispatch()
+
+    def status(self, ticket: Ticket) -> dict:
+        """
+        Where a queued ticket stands
+
+        Args:
+            ticket (Ticket): The ticket
+
+        Returns:
+            dict: {"position": 1 when it's next in line, "estimated_wait": seconds}
+        """
+        with self._lock:
+            if ticket.admitted or ticket.released:
+                return {"position": 0, "estimated_wait": 0.0}
+
+            queue = self._queues.get(ticket.user_id, ())
+            place = list(queue).index(ticket) if ticket in queue else 0
+            # Round robin: every other user gets up to place + 1 turns first
+            ahead = place
+            for user_id, other in self._queues.items():
+                if user_id != ticket.user_id:
+                    ahead += min(len(other), place + 1)
+
+            rounds = math.ceil((ahead + 1) / max(self.concurrency, 1))
+            return {
+                "position": ahead + 1,
+                "estimated_wait": round(rounds * self._duration, 1),
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": self._queued,
+                "preparing": self._preparing,
+                "users_queued": len(self._queues),
+                "concurrency": self.concurrency,
+                "per_user": self.per_user,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "mean_wait": self.total_wait / self.admitted if self.admitted else 0.0,
+                "mean_generation": self._duration,
+            }
+
+
+def _admit(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    """
+    Get the process wide admission controller
+
+    Returns:
+        AdmissionController: Configured from the GENERATION_* settings
+    """
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(
+                concurrency=settings.GENERATION_CONCURRENCY,
+                per_user=settings.GENERATION_PER_USER,
+                queue_per_user=settings.GENERATION_QUEUE_PER_USER,
+                queue_total=settings.GENERATION_QUEUE_TOTAL,
+                default_duration=settings.GENERATION_DEFAULT_SECONDS,
+            )
+        return _controller
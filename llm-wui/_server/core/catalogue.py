@@ -0,0 +1,108 @@
+import asyncio
+import time
+import httpx
+from django.conf import settings
+from core.clients import get_client
+from core.metrics import label_upstream, upstream_error
+
+# {ollama url: (fetched at, models)}
+_catalogues = {}
+# {(event loop, ollama url): task} for fetches in progress
+_refreshing = {}
+
+
+def model_details(model: dict) -> dict:
+    """
+    Pick out the fields the UI shows from an /api/tags entry
+
+    Args:
+        model (dict): A model from /api/tags
+
+    Returns:
+        dict: {"name", "size", "family", "parameter_size", "quantization_level", "modified_at"}
+    """
+    details = model.get("details") or {}
+    return {
+        "name": model["name"],
+        "size": model.get("size"),
+        "family": details.get("family"),
+        "parameter_size": details.get("parameter_size"),
+        "quantization_level": details.get("quantization_level"),
+        "modified_at": model.get("modified_at"),
+    }
+
+
+async def fetch_catalogue(ollama_url: str) -> list:
+    """
+    Fetch the installed models from ollama and cache them
+
+    Args:
+        ollama_url (str): ollama url
+
+    Returns:
+        list: model_details of every model
+    """
+    client = get_client(ollama_url)
+    try:
+        response = await client.get("/api/tags")
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        upstream_error("ollama", label_upstream(ollama_url), e)
+        raise
+    models = [model_details(model) for model in response.json()["models"]]
+    _catalogues[ollama_url] = (time.monotonic(), models)
+    return models
+
+
+def refresh_catalogue(ollama_url: str) -> asyncio.Future:
+    """
+    Start fetching the catalogue, or join the fetch already in progress
+
+    Args:
+        ollama_url (str): ollama url
+
+    Returns:
+        asyncio.Future: Resolves to the fetched models
+    """
+    # Tasks belong to the loop that created them, so only coalesce within a loop
+    key = (asyncio.get_running_loop(), ollama_url)
+    task = _refreshing.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch_catalogue(ollama_url))
+        _refreshing[key] = task
+        task.add_done_callback(lambda _: _refreshing.pop(key, None))
+    return task
+
+
+def _log_refresh_error(task: asyncio.Future):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Error refreshing models: {task.exception()}")
+
+
+async def get_catalogue(ollama_url: str, refresh: bool = False) -> list:
+    """
+    Get the models installed on an ollama server. Within MODELS_CACHE_TTL the
+    cached list is returned as is; after that, up to MODELS_CACHE_MAX_STALE,
+    it's still returned straight away while a background fetch updates it.
+
+    Args:
+        ollama_url (str): ollama url
+        refresh (bool, optional): Wait for a fresh list. Defaults to False.
+
+    Returns:
+        list: model_details of every model
+    """
+    ollama_url = ollama_url.rstrip("/")
+    cached = _catalogues.get(ollama_url)
+
+    if cached is not None and not refresh:
+        age = time.monotonic() - cached[0]
+        if age < settings.MODELS_CACHE_TTL:
+            return cached[1]
+        if age < settings.MODELS_CACHE_MAX_STALE:
+            task = refresh_catalogue(ollama_url)
+            task.add_done_callback(_log_refresh_error)
+            return cached[1]
+
+    # Shielded so one caller going away doesn't cancel the fetch for the others
+    return await asyncio.shield(refresh_catalogue(ollama_url))
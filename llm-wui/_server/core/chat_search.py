@@ -0,0 +1,98 @@
+import re
+from django.db import connection
+
+SEARCH_SQL = """
+    SELECT
+        core_chats.chat_id,
+        core_chats.title,
+        core_message.ordinal,
+        core_message.role,
+        snippet(core_message_fts, 0, '[', ']', '...', %s),
+        bm25(core_message_fts) AS rank
+    FROM core_message_fts
+    JOIN core_message ON core_message.id = core_message_fts.rowid
+    JOIN core_chats ON core_chats.id = core_message.chat_id
+    WHERE core_message_fts MATCH %s AND core_chats.user_id = %s
+    ORDER BY rank
+    LIMIT %s
+"""
+
+# Words kept around each match in a snippet
+SNIPPET_TOKENS = 12
+
+
+def match_expression(query: str) -> str:
+    """
+    Turn what the user typed into an FTS5 query. Every word has to appear,
+    and the last one can be a prefix so results show up while typing.
+
+    Args:
+        query (str): The user's search
+
+    Returns:
+        str: An FTS5 MATCH expression, empty if the query has no words
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_messages(user, query: str, limit: int) -> list:
+    """
+    Full text search over a user's messages, best match first
+
+    Args:
+        user (User): The user
+        query (str): The user's search
+        limit (int): Most messages to return
+
+    Returns:
+        list: [{"chat_id", "title", "message_id", "role", "snippet", "score"}]
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+
+    with connection.cursor() as cursor:
+        cursor.execute(SEARCH_SQL, [SNIPPET_TOKENS, expression, user.id, limit])
+        rows = cursor.fetchall()
+
+    # bm25 is lower for better matches, flip it so a higher score is better
+    return [
+        {
+            "chat_id": chat_id,
+            "title": title,
+            "message_id": ordinal,
+            "role": role,
+            "snippet": snippet,
+            "score": -rank,
+        }
+        for chat_id, title, ordinal, role, snippet, rank in rows
+    ]
+
+
+def group_by_chat(hits: list) -> list:
+    """
+    Rank chats by their best matching message
+
+    Args:
+        hits (list): search_messages results, best first
+
+    Returns:
+        list: [{"chat_id", "title", "score", "hits"}]
+    """
+    chats = {}
+    for hit in hits:
+        chat = chats.get(hit["chat_id"])
+        if chat is None:
+            chat = chats[hit["chat_id"]] = {
+                "chat_id": hit["chat_id"],
+                "title": hit["title"],
+                "score": hit["score"],
+                "hits": 0,
+            }
+        chat["hits"] += 1
+    return list(chats.values())
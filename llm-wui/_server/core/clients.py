@@ -0,0 +1,39 @@
+import asyncio
+import weakref
+import httpx
+from django.conf import settings
+
+# One keep-alive pool per upstream base url, per event loop. httpx async clients
+# are bound to the loop they were first used on, so a loop (e.g. the one
+# async_to_sync creates under runserver) never reuses another loop's client.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client(base_url: str) -> httpx.AsyncClient:
+    """
+    Get the shared async http client for an upstream
+
+    Args:
+        base_url (str): The upstream url (ollama or searxng)
+
+    Returns:
+        httpx.AsyncClient: A pooled client with keep-alive connections
+    """
+    loop = asyncio.get_running_loop()
+    loop_clients = _clients.setdefault(loop, {})
+    base_url = base_url.rstrip("/")
+
+    client = loop_clients.get(base_url)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(
+                settings.UPSTREAM_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT
+            ),
+            limits=httpx.Limits(
+                max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE,
+            ),
+        )
+        loop_clients[base_url] = client
+    return client
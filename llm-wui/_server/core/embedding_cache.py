@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+import xxhash
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """
+    Content addressed store of embedding vectors.
+
+    Vectors are keyed by a hash of the model name and the chunk text and kept
+    as float32 blobs in a sqlite file. Once the stored vectors exceed max_bytes
+    the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._total_bytes = self._stored_bytes()
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        """
+        Build the cache key for a chunk
+
+        Args:
+            model (str): The embedding model name
+            text (str): The chunk text
+
+        Returns:
+            str: Hex digest of the model and text
+        """
+        return xxhash.xxh3_128_hexdigest(f"{model}\0{text}".encode("utf-8"))
+
+    def _stored_bytes(self) -> int:
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        return row[0]
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Look up vectors by key
+
+        Args:
+            keys (list): Cache keys
+
+        Returns:
+            dict: {key: vector} for the keys that were cached
+        """
+        if not keys:
+            return {}
+
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # Stay under sqlite's bound parameter limit
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+
+        return found
+
+    def put_many(self, items: dict):
+        """
+        Store vectors, evicting the least recently used ones if over max_bytes
+
+        Args:
+            items (dict): {key: vector}
+        """
+        if not items:
+            return
+
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((key, blob, len(blob), now))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._total_bytes += sum(row[2] for row in rows)
+
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Other worker processes share the file, so recount before evicting
+        self._total_bytes = self._stored_bytes()
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+
+            evicted = []
+            for key, size in rows:
+                if self._total_bytes <= target:
+                    break
+                evicted.append((key,))
+                self._total_bytes -= size
+
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+            self._conn.commit()
+            self.evictions += len(evicted)
+
+    def stats(self) -> dict:
+        """
+        Get cache statistics
+
+        Returns:
+            dict: {"hits", "misses", "hit_rate", "evictions", "entries", "bytes", "max_bytes"}
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": self._stored_bytes(),
+                "max_bytes": self.max_bytes,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends cache misses to the underlying model
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [EmbeddingCache.key(self.model, text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            cached.update(computed)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        # Queries are rarely repeated, keep them out of the cache
+        return self.embeddings.embed_query(text)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Get the process wide embedding cache
+
+    Returns:
+        EmbeddingCache: The cache at settings.EMBEDDING_CACHE_PATH
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(
+                str(settings.EMBEDDING_CACHE_PATH), settings.EMBEDDING_CACHE_MAX_BYTES
+            )
+        return _cache
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+from core.generations import active_generations
+
+
+class _Job:
+    def __init__(self, texts: list):
+        self.results = [None] * len(texts)
+        self.remaining = len(texts)
+        self.future = Future()
+
+
+class EmbeddingScheduler:
+    """
+    Process wide queue that merges chunks from concurrent requests into
+    batched embed calls, with at most `concurrency` calls in flight.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int,
+        concurrency: int,
+        busy_concurrency: int,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.busy_concurrency = min(busy_concurrency, concurrency)
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._running = 0
+
+        self.submitted_chunks = 0
+        self.batches = 0
+        self.batched_chunks = 0
+        self.max_batch_size = 0
+        self.errors = 0
+        self.total_wait = 0.0
+
+        for i in range(concurrency):
+            threading.Thread(
+                target=self._worker, name=f"embedding-worker-{i}", daemon=True
+            ).start()
+
+    def embed(self, texts: list) -> list:
+        """
+        Queue texts for embedding and wait for their vectors
+
+        Args:
+            texts (list): Chunk texts
+
+        Returns:
+            list: One vector per text
+        """
+        if not texts:
+            return []
+
+        job = _Job(texts)
+        now = time.monotonic()
+        with self._condition:
+            for i, text in enumerate(texts):
+                self._queue.append((job, i, text, now))
+            self.submitted_chunks += len(texts)
+            self._condition.notify_all()
+
+        return job.future.result()
+
+    def _allowed_concurrency(self) -> int:
+        if active_generations() > 0:
+            return self.busy_concurrency
+        return self.concurrency
+
+    def _next_batch(self) -> list:
+        with self._condition:
+            while not self._queue or self._running >= self._allowed_concurrency():
+                # Re-check periodically so slots reopen when generations finish
+                self._condition.wait(timeout=0.5)
+
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                item = self._queue.popleft()
+                if not item[0].future.done():
+                    batch.append(item)
+            if batch:
+                self._running += 1
+            return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            try:
+                vectors = self.embeddings.embed_documents([item[2] for item in batch])
+            except Exception as e:
+                vectors = None
+                error = e
+
+            with self._condition:
+                self._running -= 1
+                self.batches += 1
+                self.batched_chunks += len(batch)
+                self.max_batch_size = max(self.max_batch_size, len(batch))
+                self.total_wait += sum(started - item[3] for item in batch)
+                if vectors is None:
+                    self.errors += 1
+                self._condition.notify_all()
+
+            for i, (job, index, text, queued) in enumerate(batch):
+                if job.future.done():
+                    continue
+                if vectors is None:
+                    job.future.set_exception(error)
+                    continue
+                job.results[index] = vectors[i]
+                job.remaining -= 1
+                if job.remaining == 0:
+                    job.future.set_result(job.results)
+
+    def stats(self) -> dict:
+        """
+        Get scheduler statistics
+
+        Returns:
+            dict: queue depth, in flight calls and batch size metrics
+        """
+        with self._condition:
+            return {
+                "queue_depth": len(self._queue),
+                "in_flight": self._running,
+                "concurrency": self._allowed_concurrency(),
+                "active_generations": active_generations(),
+                "submitted_chunks": self.submitted_chunks,
+                "batches": self.batches,
+                "mean_batch_size": (
+                    self.batched_chunks / self.batches if self.batches else 0.0
+                ),
+                "max_batch_size": self.max_batch_size,
+                "mean_queue_wait": (
+                    self.total_wait / self.batched_chunks if self.batched_chunks else 0.0
+                ),
+                "errors": self.errors,
+            }
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that sends document chunks through the shared scheduler.
+    Queries are interactive and go straight to the model.
+    """
+
+    def __init__(self, embeddings: Embeddings, scheduler: EmbeddingScheduler):
+        self.embeddings = embeddings
+        self.scheduler = scheduler
+
+    def embed_documents(self, texts: list) -> list:
+        return self.scheduler.embed(texts)
+
+    def embed_query(self, text: str) -> list:
+        return self.embeddings.embed_query(text)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_embedding_scheduler(model: str, factory) -> EmbeddingScheduler:
+    """
+    Get the process wide scheduler for an embedding model
+
+    Args:
+        model (str): The embedding model name
+        factory (callable): Builds the underlying Embeddings on first use
+
+    Returns:
+        EmbeddingScheduler: The shared scheduler for the model
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(model)
+        if scheduler is None:
+            scheduler = EmbeddingScheduler(
+                factory(),
+                batch_size=settings.EMBEDDING_BATCH_SIZE,
+                concurrency=settings.EMBEDDING_CONCURRENCY,
+                busy_concurrency=settings.EMBEDDING_BUSY_CONCURRENCY,
+            )
+            _schedulers[model] = scheduler
+        return scheduler
+
+
+def scheduler_stats() -> dict:
+    """
+    Get statistics for every embedding scheduler
+
+    Returns:
+        dict: {model: stats}
+    """
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    return {model: scheduler.stats() for model, scheduler in schedulers.items()}
@@ -0,0 +1,288 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from PyPDF2 import PdfReader
+
+TEXT_EXTENSIONS = [
+    ".txt",
+    ".py",
+    ".csv",
+    ".json",
+    ".md",
+    ".cpp",
+    ".json",
+    ".js",
+    ".jsx",
+    ".tsx",
+    ".html",
+    ".css",
+]
+
+# Text files are streamed in blocks of this many characters
+TEXT_BLOCK_SIZE = 64 * 1024
+
+
+class ExtractionError(Exception):
+    """Raised when a file can't be read or is over the configured limits"""
+
+
+def _extract_pdf_pages(file_path: str, start: int, end: int) -> list:
+    # Runs in a pool process, so it only touches PyPDF2
+    reader = PdfReader(file_path)
+    pages = []
+    for number in range(start, end):
+        started = time.perf_counter()
+        text = reader.pages[number].extract_text() or ""
+        pages.append((number, text, time.perf_counter() - started))
+    return pages
+
+
+def _report_pid(pids):
+    # Pool initializer, tells the server which processes are the pool's
+    pids.put(os.getpid())
+
+
+_pool = None
+# {pool: SimpleQueue of its worker pids}
+_pool_pids = {}
+_pool_lock = threading.Lock()
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """
+    Get the process pool pdf pages are extracted in
+
+    Returns:
+        ProcessPoolExecutor: Pool of settings.PDF_WORKERS processes
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, since the server process has threads running (embedding scheduler, asgi)
+            context = multiprocessing.get_context("spawn")
+            pids = context.SimpleQueue()
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.PDF_WORKERS,
+                mp_context=context,
+                initializer=_report_pid,
+                initargs=(pids,),
+            )
+            _pool_pids[_pool] = pids
+        return _pool
+
+
+def _reset_pdf_pool(broken: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+        _pool_pids.pop(broken, None)
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _terminate_pdf_pool(pool: ProcessPoolExecutor):
+    # cancel() can't stop a running task, so a worker stuck on a page would
+    # hold its slot for good. Kill the pool's processes instead; the other
+    # tasks running in it fail with BrokenProcessPool and are retried in a
+    # fresh pool.
+    with _pool_lock:
+        queue = _pool_pids.get(pool)
+    pids = set()
+    while queue is not None and not queue.empty():
+        pids.add(queue.get())
+    _reset_pdf_pool(pool)
+    # Only children, a pid of a worker that already exited may be reused
+    for process in multiprocessing.active_children():
+        if process.pid in pids:
+            process.terminate()
+
+
+def iter_pdf_pages(file_path: str, timings: list = None):
+    """
+    Extract a pdf page by page. Documents longer than PDF_PAGES_PER_TASK are
+    split into page ranges extracted in parallel in the process pool; pages
+    are yielded in order as soon as their range is done, with a bounded number
+    of ranges in flight.
+
+    Args:
+        file_path (str): file path
+        timings (list, optional): Filled with (page number, seconds) per page
+
+    Yields:
+        str: The text of each page
+    """
+    page_count = len(PdfReader(file_path).pages)
+    if page_count > settings.PDF_MAX_PAGES:
+        print(
+            f"{os.path.basename(file_path)} has {page_count} pages, "
+            f"only extracting the first {settings.PDF_MAX_PAGES}"
+        )
+        page_count = settings.PDF_MAX_PAGES
+
+    per_task = settings.PDF_PAGES_PER_TASK
+    ranges = [
+        (start, min(start + per_task, page_count))
+        for start in range(0, page_count, per_task)
+    ]
+
+    if len(ranges) <= 1:
+        for number, text, seconds in _extract_pdf_pages(file_path, 0, page_count):
+            if timings is not None:
+                timings.append((number, seconds))
+            yield text
+        return
+
+    pool = None
+    pending = deque()
+    max_in_flight = settings.PDF_WORKERS * 2
+
+    try:
+        for start, end in ranges:
+            # The pool is replaced when a range times out
+            pool = get_pdf_pool()
+            pending.append(
+                (start, end, pool, pool.submit(_extract_pdf_pages, file_path, start, end))
+            )
+            while len(pending) >= max_in_flight:
+                yield from _collect_pages(file_path, pending.popleft(), timings)
+
+        while pending:
+            yield from _collect_pages(file_path, pending.popleft(), timings)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool next time
+        _reset_pdf_pool(pool)
+        raise
+    finally:
+        # Ranges submitted ahead that won't be read, e.g. the caller stopped
+        # at max_chars
+        for start, end, task_pool, future in pending:
+            future.cancel()
+
+
+def _collect_pages(file_path: str, task, timings):
+    start, end, pool, future = task
+    try:
+        pages = _range_result(future, pool, start, end)
+    except BrokenProcessPool:
+        # The pool was killed after another range timed out, or a worker
+        # died; try once more in a fresh pool
+        _reset_pdf_pool(pool)
+        pool = get_pdf_pool()
+        future = pool.submit(_extract_pdf_pages, file_path, start, end)
+        pages = _range_result(future, pool, start, end)
+    if pages is None:
+        return
+
+    for number, text, seconds in pages:
+        if timings is not None:
+            timings.append((number, seconds))
+        yield text
+
+
+def _range_result(future, pool: ProcessPoolExecutor, start: int, end: int):
+    # The range's pages, None if they're skipped
+    try:
+        return future.result(timeout=settings.PDF_PAGE_TIMEOUT * (end - start))
+    except TimeoutError:
+        print(f"Timed out extracting pages {start + 1}-{end}, skipping them")
+        _terminate_pdf_pool(pool)
+        return None
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        print(f"Error extracting pages {start + 1}-{end}: {e}")
+        return None
+
+
+def iter_text_blocks(file_path: str):
+    """
+    Read a text file in blocks
+
+    Args:
+        file_path (str): file path
+
+    Yields:
+        str: Consecutive blocks of the file
+    """
+    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            block = f.read(TEXT_BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+
+
+def iter_file_text(file_path: str, timings: list = None):
+    """
+    Stream readable text from a file based on its type.
+
+    Args:
+        file_path (str): file path
+        timings (list, optional): Filled with (page number, seconds) per pdf page
+
+    Raises:
+        ExtractionError: The file is too large, unsupported or unreadable
+
+    Yields:
+        str: Pages of a pdf, blocks of a text file
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+
+    size = os.path.getsize(file_path)
+    if size > settings.ATTACHMENT_MAX_BYTES:
+        raise ExtractionError(
+            f"File is {size} bytes, the limit is {settings.ATTACHMENT_MAX_BYTES}"
+        )
+
+    try:
+        if extension in TEXT_EXTENSIONS:
+            yield from iter_text_blocks(file_path)
+        elif extension == ".pdf":
+            started = time.perf_counter()
+            page_timings = [] if timings is None else timings
+            for page in iter_pdf_pages(file_path, page_timings):
+                yield page + "\n"
+            if page_timings:
+                slowest = max(page_timings, key=lambda timing: timing[1])
+                print(
+                    f"Extracted {len(page_timings)} pages from "
+                    f"{os.path.basename(file_path)} in {time.perf_counter() - started:.2f}s "
+                    f"(slowest page {slowest[0] + 1}: {slowest[1]:.2f}s)"
+                )
+        else:
+            raise ExtractionError(f"Unsupported file type: {extension}")
+    except ExtractionError:
+        raise
+    except Exception as e:
+        raise ExtractionError(f"Error reading file: {e}") from e
+
+
+def extract_text_from_file(file_path: str, max_chars: int = None) -> str:
+    """
+    Extract readable text from a file based on its type.
+
+    Args:
+        file_path (str): file path
+        max_chars (int, optional): Stop reading once this much text is extracted. Defaults to None.
+
+    Returns:
+        str: contents of the file
+    """
+    parts = []
+    length = 0
+    try:
+        for part in iter_file_text(file_path):
+            parts.append(part)
+            length += len(part)
+            if max_chars is not None and length >= max_chars:
+                break
+    except ExtractionError as e:
+        return f"[{e}]"
+
+    text = "".join(parts)
+    return text if max_chars is None else text[:max_chars]
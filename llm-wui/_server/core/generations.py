@@ -0,0 +1,105 @@
+import asyncio
+import re
+import threading
+import uuid
+from contextlib import contextmanager
+
+GENERATION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class Generation:
+    """
+    A running send_chat generation that can be stopped by id
+    """
+
+    def __init__(self, generation_id: str, user_id):
+        self.id = generation_id
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        # Set by stop_generation; waiting in the queue and streaming from
+        # Ollama check it and wind down
+        self.stop = asyncio.Event()
+
+    @property
+    def stopped(self) -> bool:
+        return self.stop.is_set()
+
+
+# {generation id: Generation} for this process
+_generations = {}
+_generations_lock = threading.Lock()
+
+
+def start_generation(user_id, generation_id: str = None) -> Generation:
+    """
+    Register the generation running in the current task
+
+    Args:
+        user_id (int): The user the generation is for
+        generation_id (str, optional): Id picked by the client. Defaults to a new one.
+
+    Returns:
+        Generation: The registered generation
+    """
+    if not isinstance(generation_id, str) or not GENERATION_ID_PATTERN.match(generation_id):
+        generation_id = uuid.uuid4().hex
+    generation = Generation(generation_id, user_id)
+    with _generations_lock:
+        _generations[generation.id] = generation
+    return generation
+
+
+def finish_generation(generation: Generation):
+    with _generations_lock:
+        if _generations.get(generation.id) is generation:
+            del _generations[generation.id]
+
+
+def cancel_generation(user_id, generation_id: str) -> bool:
+    """
+    Stop a user's generation. It leaves the queue, or closes the upstream
+    stream to Ollama at the next fragment, and finishes with what it has.
+
+    Args:
+        user_id (int): The user asking
+        generation_id (str): The generation to stop
+
+    Returns:
+        bool: False if the generation isn't running in this process
+    """
+    with _generations_lock:
+        generation = _generations.get(generation_id)
+    if generation is None or generation.user_id != user_id:
+        return False
+
+    try:
+        # Events aren't thread-safe, set it on the generation's loop
+        generation.loop.call_soon_threadsafe(generation.stop.set)
+    except RuntimeError:
+        return False
+    return True
+
+
+# Generations currently streaming from Ollama. While any are running the
+# embedding scheduler drops to EMBEDDING_BUSY_CONCURRENCY so chat stays responsive.
+_active_generations = 0
+_active_lock = threading.Lock()
+
+
+@contextmanager
+def track_generation():
+    """
+    Mark an interactive generation as running for the duration of the block
+    """
+    global _active_generations
+    with _active_lock:
+        _active_generations += 1
+    try:
+        yield
+    finally:
+        with _active_lock:
+            _active_generations -= 1
+
+
+def active_generations() -> int:
+    return _active_generations
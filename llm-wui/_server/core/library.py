@@ -0,0 +1,112 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from core.models import Document
+from core.rag import (
+    file_hash,
+    index_library_document,
+    remove_library_document,
+)
+from core.uploads import resolve_upload, upload_root
+
+# Uploads are indexed off the request path
+_executor = ThreadPoolExecutor(
+    max_workers=settings.LIBRARY_INDEX_WORKERS, thread_name_prefix="library-index"
+)
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def save_document(user, handle: str, name: str) -> Document:
+    """
+    Add an upload to the user's document library without indexing it.
+    Uploading a file with the same name as an existing document replaces that
+    document, so only the chunks that changed are embedded again.
+
+    Args:
+        user (User): The user that uploaded the file
+        handle (str): The upload handle
+        name (str): The file name
+
+    Returns:
+        Document: The new or updated document
+    """
+    file_path = resolve_upload(user, handle)
+
+    document = Document.objects.filter(user=user, name=name).first()
+    if document is None:
+        document = Document(user=user, name=name)
+    elif document.handle != handle:
+        shutil.rmtree(os.path.join(upload_root(user), document.handle), ignore_errors=True)
+
+    document.handle = handle
+    document.size = os.path.getsize(file_path)
+    document.save()
+    return document
+
+
+def index_document(user, document: Document):
+    """
+    Make sure a document's current file is in the library index
+
+    Args:
+        user (User): The user the document belongs to
+        document (Document): The document
+    """
+    file_path = resolve_upload(user, document.handle)
+    if file_path is None:
+        return
+
+    index_library_document(user, document.id, file_path)
+
+    content_hash = file_hash(file_path)
+    if document.content_hash != content_hash:
+        document.content_hash = content_hash
+        document.save(update_fields=["content_hash"])
+
+
+def schedule_document_indexing(user, document: Document):
+    """
+    Index a document in the background. send_chat indexes attached documents
+    itself, so a chat sent before this finishes waits for the index instead
+    of missing it.
+
+    Args:
+        user (User): The user the document belongs to
+        document (Document): The document
+    """
+    with _pending_lock:
+        if document.id in _pending:
+            return
+        _pending.add(document.id)
+    _executor.submit(_run_indexing, user, document.id)
+
+
+def _run_indexing(user, document_id: int):
+    with _pending_lock:
+        _pending.discard(document_id)
+    try:
+        # Reloaded, it may have been replaced or deleted while queued
+        document = Document.objects.filter(user=user, id=document_id).first()
+        if document is not None:
+            index_document(user, document)
+    except Exception as e:
+        print(f"Error indexing document: {e}")
+    finally:
+        close_old_connections()
+
+
+def remove_document(user, document: Document):
+    """
+    Remove a document from the library, its index and disk
+
+    Args:
+        user (User): The user the document belongs to
+        document (Document): The document
+    """
+    remove_library_document(user, document.id)
+    shutil.rmtree(os.path.join(upload_root(user), document.handle), ignore_errors=True)
+    document.delete()
@@ -0,0 +1,290 @@
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+from core.models import Message
+from core.rag import EMBEDDING_MODEL, get_embeddings, index_lock
+from core.ttl_cache import TTLCache
+
+INDEX_NAME = "index.faiss"
+MANIFEST_NAME = "manifest.json"
+
+# Only the start of long messages is embedded
+MAX_MESSAGE_CHARS = 2000
+
+# Indexes read for queries, {index dir: (manifest mtime, index, kind)}
+_loaded = TTLCache(settings.MESSAGE_INDEX_CACHE_SIZE, ttl=3600)
+
+# Indexing runs off the request path, one user at a time
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="message-index")
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def message_index_dir(user) -> str:
+    """
+    Get the directory the vector index of a user's messages is saved in
+
+    Args:
+        user (User): The user
+
+    Returns:
+        str: document_storage/f{user}/index/messages
+    """
+    return os.path.join(
+        settings.BASE_DIR, f"document_storage/f{user}", "index", "messages"
+    )
+
+
+def _read_manifest(index_dir: str) -> dict:
+    try:
+        with open(os.path.join(index_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"model": EMBEDDING_MODEL, "last_message_id": 0, "kind": "flat"}
+
+
+def _save(index_dir: str, index, manifest: dict):
+    # Called with the index locked. Temp files are unique so a worker that
+    # died mid-save can't leave one behind for the next to trip over.
+    fd, temp_path = tempfile.mkstemp(dir=index_dir, prefix=".index-")
+    os.close(fd)
+    faiss.write_index(index, temp_path)
+    os.replace(temp_path, os.path.join(index_dir, INDEX_NAME))
+
+    fd, temp_path = tempfile.mkstemp(dir=index_dir, prefix=".manifest-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, os.path.join(index_dir, MANIFEST_NAME))
+
+
+def _load(index_dir: str):
+    try:
+        return faiss.read_index(os.path.join(index_dir, INDEX_NAME))
+    except RuntimeError:
+        return None
+
+
+def _normalize(vectors) -> np.ndarray:
+    # Unit vectors, so inner product is cosine similarity
+    array = np.asarray(vectors, dtype="float32")
+    faiss.normalize_L2(array)
+    return array
+
+
+def _new_index(dimension: int, kind: str):
+    if kind == "hnsw":
+        inner = faiss.IndexHNSWFlat(
+            dimension, settings.MESSAGE_INDEX_HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+    else:
+        inner = faiss.IndexFlatIP(dimension)
+    return faiss.IndexIDMap2(inner)
+
+
+def _rebuild(index, kind: str, keep_ids=None):
+    """
+    Copy an index's vectors into a new index of the given kind
+
+    Args:
+        index (faiss.IndexIDMap2): The current index
+        kind (str): "flat" or "hnsw"
+        keep_ids (set, optional): Only copy these message ids. Defaults to None.
+
+    Returns:
+        faiss.IndexIDMap2: The new index
+    """
+    ids = faiss.vector_to_array(index.id_map)
+    vectors = index.index.reconstruct_n(0, index.ntotal)
+    if keep_ids is not None:
+        mask = np.isin(ids, np.fromiter(keep_ids, dtype="int64"))
+        ids, vectors = ids[mask], vectors[mask]
+
+    rebuilt = _new_index(index.d, kind)
+    if len(ids):
+        rebuilt.add_with_ids(vectors, ids)
+    return rebuilt
+
+
+def index_new_messages(user) -> int:
+    """
+    Embed the user's messages saved since the last run and add them to their
+    index. The index is exact (flat) until it holds MESSAGE_INDEX_ANN_THRESHOLD
+    messages, then it's rebuilt as an HNSW graph for approximate search.
+
+    Args:
+        user (User): The user
+
+    Returns:
+        int: The number of messages added
+    """
+    index_dir = message_index_dir(user)
+    embeddings = get_embeddings()
+    added = 0
+
+    with index_lock(index_dir):
+        manifest = _read_manifest(index_dir)
+        index = _load(index_dir) if manifest["last_message_id"] else None
+
+        while True:
+            batch = list(
+                Message.objects.filter(
+                    chat__user=user, id__gt=manifest["last_message_id"]
+                )
+                .order_by("id")
+                .values_list("id", "content")[: settings.MESSAGE_INDEX_BATCH_SIZE]
+            )
+            if not batch:
+                break
+
+            batch_ids = [message_id for message_id, content in batch if content.strip()]
+            texts = [content[:MAX_MESSAGE_CHARS] for message_id, content in batch if content.strip()]
+            if texts:
+                vectors = _normalize(embeddings.embed_documents(texts))
+                if index is None:
+                    index = _new_index(vectors.shape[1], manifest["kind"])
+                index.add_with_ids(vectors, np.asarray(batch_ids, dtype="int64"))
+                added += len(texts)
+
+            manifest["last_message_id"] = batch[-1][0]
+
+            if manifest["kind"] == "flat" and index is not None and (
+                index.ntotal >= settings.MESSAGE_INDEX_ANN_THRESHOLD
+            ):
+                index = _rebuild(index, "hnsw")
+                manifest["kind"] = "hnsw"
+
+            # Saved per batch so a restart picks up where this left off
+            if index is not None:
+                _save(index_dir, index, manifest)
+
+        if index is not None and index.ntotal:
+            index = _drop_deleted(user, index_dir, index, manifest)
+
+    return added
+
+
+def _drop_deleted(user, index_dir: str, index, manifest: dict):
+    # Messages of deleted chats stay in the index (HNSW can't remove vectors)
+    # and are skipped by queries; rebuild once they're a large part of it
+    live = Message.objects.filter(
+        chat__user=user, id__lte=manifest["last_message_id"]
+    ).count()
+    if index.ntotal - live <= index.ntotal * settings.MESSAGE_INDEX_MAX_DELETED:
+        return index
+
+    keep_ids = set(
+        Message.objects.filter(
+            chat__user=user, id__lte=manifest["last_message_id"]
+        ).values_list("id", flat=True)
+    )
+    index = _rebuild(index, manifest["kind"], keep_ids)
+    _save(index_dir, index, manifest)
+    return index
+
+
+def schedule_message_indexing(user):
+    """
+    Index the user's new messages in the background. Calls made while the
+    user is already queued are merged into that run.
+
+    Args:
+        user (User): The user
+    """
+    with _pending_lock:
+        if user.id in _pending:
+            return
+        _pending.add(user.id)
+    _executor.submit(_run_indexing, user)
+
+
+def _run_indexing(user):
+    with _pending_lock:
+        # Messages saved from here on need another run
+        _pending.discard(user.id)
+    try:
+        index_new_messages(user)
+    except Exception as e:
+        print(f"Error indexing messages: {e}")
+    finally:
+        close_old_connections()
+
+
+def _query_index(index_dir: str) -> tuple:
+    # (index, kind) of the saved index, reloaded when the manifest changes
+    manifest_path = os.path.join(index_dir, MANIFEST_NAME)
+    try:
+        mtime = os.path.getmtime(manifest_path)
+    except OSError:
+        return None, None
+
+    cached = _loaded.get(index_dir)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2]
+
+    with index_lock(index_dir, shared=True):
+        manifest = _read_manifest(index_dir)
+        index = _load(index_dir)
+    if index is not None:
+        _loaded.set(index_dir, (mtime, index, manifest["kind"]))
+    return index, manifest["kind"]
+
+
+def search_similar_messages(user, query: str, k: int) -> list:
+    """
+    Find the user's messages closest in meaning to a query
+
+    Args:
+        user (User): The user
+        query (str): What to look for
+        k (int): Most messages to return
+
+    Returns:
+        list: [{"chat_id", "title", "message_id", "role", "content", "score"}], best first
+    """
+    # Catch up on anything not indexed yet (e.g. history from before indexing)
+    schedule_message_indexing(user)
+
+    index, kind = _query_index(message_index_dir(user))
+    if index is None or not index.ntotal or not query.strip():
+        return []
+
+    params = None
+    if kind == "hnsw":
+        params = faiss.SearchParametersHNSW(
+            efSearch=max(settings.MESSAGE_INDEX_EF_SEARCH, k * 2)
+        )
+
+    vector = _normalize([get_embeddings().embed_query(query)])
+    # Extra candidates in case some belong to deleted chats
+    scores, ids = index.search(vector, k * 2, params=params)
+
+    candidates = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+    messages = Message.objects.filter(
+        chat__user=user, id__in=[i for i, s in candidates]
+    ).select_related("chat")
+    by_id = {message.id: message for message in messages}
+
+    results = []
+    for message_id, score in candidates:
+        message = by_id.pop(message_id, None)
+        if message is None:
+            continue
+        results.append(
+            {
+                "chat_id": message.chat.chat_id,
+                "title": message.chat.title,
+                "message_id": message.ordinal,
+                "role": message.role,
+                "content": message.content[: settings.SEMANTIC_SEARCH_PREVIEW_CHARS],
+                "score": score,
+            }
+        )
+        if len(results) == k:
+            break
+    return results
@@ -0,0 +1,381 @@
+import bisect
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+
+# Seconds, from a cached lookup to a long generation
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300
+)
+THROUGHPUT_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+# Label value series past settings.METRICS_MAX_SERIES are folded into
+OVERFLOW = "other"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, registry, name: str, documentation: str, labels: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        # Called with the lock held. Unknown labels are ignored, missing ones empty.
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        if key not in self._series and len(self._series) >= settings.METRICS_MAX_SERIES:
+            key = (OVERFLOW,) * len(self.labels)
+        return key
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "type": self.type,
+                "help": self.documentation,
+                "labels": self.labels,
+                "series": {key: self._copy(value) for key, value in self._series.items()},
+            }
+
+
+class Counter(_Metric):
+    """
+    A count that only goes up, e.g. upstream errors
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+        _start_flusher()
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Histogram(_Metric):
+    """
+    Observations counted into buckets, e.g. stage latencies
+    """
+
+    type = "histogram"
+
+    def __init__(self, registry, name, documentation, labels, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, documentation, labels)
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # [count per bucket (the last is +Inf), sum]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+        _start_flusher()
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe how long the block takes, in seconds
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1]]
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot["buckets"] = self.buckets
+        return snapshot
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: _Metric):
+        self.metrics.append(metric)
+
+    def snapshot(self) -> dict:
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    REGISTRY,
+    "llm_wui_stage_seconds",
+    "Time spent in each stage of send_chat",
+    ("stage", "model", "upstream"),
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    REGISTRY,
+    "llm_wui_time_to_first_token_seconds",
+    "Time from sending a generation to Ollama to its first fragment",
+    ("model", "upstream"),
+)
+GENERATION_SECONDS = Histogram(
+    REGISTRY,
+    "llm_wui_generation_seconds",
+    "Time from sending a generation to Ollama to its last fragment",
+    ("model", "upstream"),
+)
+TOKENS_PER_SECOND = Histogram(
+    REGISTRY,
+    "llm_wui_tokens_per_second",
+    "Generation speed reported by Ollama (eval_count / eval_duration)",
+    ("model", "upstream"),
+    THROUGHPUT_BUCKETS,
+)
+PROMPT_TOKENS_PER_SECOND = Histogram(
+    REGISTRY,
+    "llm_wui_prompt_tokens_per_second",
+    "Prompt processing speed reported by Ollama (prompt_eval_count / prompt_eval_duration)",
+    ("model", "upstream"),
+    (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+)
+UPSTREAM_ERRORS = Counter(
+    REGISTRY,
+    "llm_wui_upstream_errors_total",
+    "Failed requests to Ollama and SearXNG",
+    ("service", "upstream", "error"),
+)
+
+# Model and upstream of the send_chat a stage runs for. Contextvars follow
+# the request into asyncio tasks and sync_to_async threads.
+_stage_labels = contextvars.ContextVar("stage_labels", default={})
+
+
+@contextmanager
+def stage_labels(**labels):
+    """
+    Label the stages observed in the block, e.g. with the model and upstream
+    """
+    token = _stage_labels.set({**_stage_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _stage_labels.reset(token)
+
+
+def observe_stage(stage: str, seconds: float, **labels):
+    STAGE_SECONDS.observe(seconds, stage=stage, **{**_stage_labels.get(), **labels})
+
+
+@contextmanager
+def time_stage(stage: str, **labels):
+    """
+    Observe how long the block takes as a send_chat stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, **labels)
+
+
+class Stopwatch:
+    """
+    Adds up the time spent producing an iterator's items, for stages that
+    run interleaved (extraction feeds chunking feeds embedding)
+    """
+
+    def __init__(self):
+        self.elapsed = 0.0
+
+    def iterate(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.elapsed += time.perf_counter() - start
+            yield item
+
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+def upstream_error(service: str, upstream: str, error: Exception):
+    """
+    Count a failed upstream request
+
+    Args:
+        service (str): "ollama" or "searxng"
+        upstream (str): The upstream url
+        error (Exception): The error, counted by class or HTTP status
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    kind = f"http_{status}" if status is not None else type(error).__name__
+    UPSTREAM_ERRORS.inc(service=service, upstream=upstream, error=kind)
+
+
+def label_upstream(url: str) -> str:
+    return (url or "").rstrip("/")
+
+
+# With several worker processes each one writes its metrics to
+# settings.METRICS_DIR and /metrics adds them all up
+_process_file = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _after_fork():
+    # gunicorn --preload forks the workers after importing this module, give
+    # each its own file and flusher
+    global _process_file, _flusher, _flusher_lock
+    _process_file = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+    _flusher = None
+    _flusher_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None or not settings.METRICS_DIR:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+            _flusher.start()
+
+
+def _flush_loop():
+    while True:
+        try:
+            flush()
+        except Exception as e:
+            print(f"Error writing metrics: {e}")
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+
+
+def flush():
+    """
+    Write this process's metrics to settings.METRICS_DIR
+    """
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.METRICS_DIR, _process_file)
+    snapshot = {
+        name: {**metric, "series": [[list(k), v] for k, v in metric["series"].items()]}
+        for name, metric in REGISTRY.snapshot().items()
+    }
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    os.replace(path + ".tmp", path)
+
+
+def _other_processes() -> list:
+    if not settings.METRICS_DIR:
+        return []
+    snapshots = []
+    try:
+        names = os.listdir(settings.METRICS_DIR)
+    except OSError:
+        return []
+    for name in names:
+        if not name.endswith(".json") or name == _process_file:
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name), "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric in snapshot.values():
+            metric["series"] = {tuple(k): v for k, v in metric["series"]}
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def _merge(total: dict, snapshot: dict):
+    for name, metric in snapshot.items():
+        merged = total.get(name)
+        if merged is None or merged["type"] != metric["type"]:
+            continue
+        for key, value in metric["series"].items():
+            current = merged["series"].get(key)
+            if metric["type"] == "counter":
+                merged["series"][key] = (current or 0) + value
+            elif current is None:
+                merged["series"][key] = [list(value[0]), value[1]]
+            elif len(current[0]) == len(value[0]):
+                current[0] = [a + b for a, b in zip(current[0], value[0])]
+                current[1] += value[1]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render() -> str:
+    """
+    Get the metrics of every worker process in the Prometheus text format
+
+    Returns:
+        str: Text exposition format 0.0.4
+    """
+    total = REGISTRY.snapshot()
+    for snapshot in _other_processes():
+        _merge(total, snapshot)
+
+    lines = []
+    for name, metric in total.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric["series"].items()):
+            if metric["type"] == "counter":
+                lines.append(f"{name}{_labels(metric['labels'], key)} {_number(value)}")
+                continue
+            counts, total_seconds = value
+            cumulative = 0
+            for bound, count in zip((*metric["buckets"], math.inf), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(
+                    f"{name}_bucket{_labels(metric['labels'], key, le)} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_labels(metric['labels'], key)} {_number(total_seconds)}")
+            lines.append(f"{name}_count{_labels(metric['labels'], key)} {cumulative}")
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,20 @@
 import requests
 import os
+import cProfile
+import contextvars
+import functools
+import io
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
 from django.http import StreamingHttpResponse
+from django.utils.decorators import sync_and_async_middleware
 
 def asset_proxy_middleware(next):
     def middleware(request):
@@ -20,4 +34,294 @@ def asset_proxy_middleware(next):
         # call next middleware
         return next(request)
 
-    return middleware
\ No newline at end of file
+    return middleware
+
+
+# Timings of the latest requests, newest last
+_timings = deque(maxlen=settings.PROFILING_BUFFER_SIZE)
+_timings_lock = threading.Lock()
+# One request is profiled at a time, requests picked while it's busy aren't
+_profiler_lock = threading.Lock()
+# Python 3.12+ profiles every thread through sys.monitoring. Before that a
+# profiler only sees the thread that enabled it, so the threads a profiled
+# request runs code in (sync views, sync_to_async) enable their own, see
+# profile_thread
+_PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+# The profiled request's profilers, None outside one
+_request_profiles = contextvars.ContextVar("request_profiles", default=None)
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """
+    Time every request into a rolling buffer, and profile a sample of them
+    (settings.PROFILING_SAMPLE_RATE, or staff requests sending the
+    settings.PROFILING_HEADER header) with cProfile. Profiles of requests
+    slower than settings.PROFILING_SLOW_SECONDS are saved to
+    settings.PROFILING_DIR as pstats files. See the slow_requests view.
+
+    Timings include streaming the response; the profile only covers producing
+    it (the view), and under ASGI it also sees whatever else ran on the event
+    loop meanwhile.
+    """
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            started = time.perf_counter()
+            profiler = None
+            if _sampled() or await _tagged_by_staff(request):
+                profiler = _start_profiler()
+            token = _request_profiles.set([profiler] if profiler else None)
+            try:
+                response = await get_response(request)
+            finally:
+                profiles = _stop_profiler(profiler)
+                _request_profiles.reset(token)
+            return _finish(request, response, started, profiles)
+
+        if not _PROFILES_ALL_THREADS:
+
+            async def process_view(request, view_func, view_args, view_kwargs):
+                # Django runs sync views in a sync_to_async thread the event
+                # loop's profiler doesn't see, run them the same way but
+                # profiled
+                if _request_profiles.get() is None or iscoroutinefunction(view_func):
+                    return None
+                return await sync_to_async(profile_thread(view_func), thread_sensitive=True)(
+                    request, *view_args, **view_kwargs
+                )
+
+            middleware.process_view = process_view
+
+        markcoroutinefunction(middleware)
+        return middleware
+
+    def middleware(request):
+        started = time.perf_counter()
+        profiler = None
+        if _sampled() or _tagged_by_staff_sync(request):
+            profiler = _start_profiler()
+        token = _request_profiles.set([profiler] if profiler else None)
+        try:
+            response = get_response(request)
+        finally:
+            profiles = _stop_profiler(profiler)
+            _request_profiles.reset(token)
+        return _finish(request, response, started, profiles)
+
+    return middleware
+
+
+def profile_thread(func):
+    """
+    Include a function run in another thread (sync_to_async) in the profile
+    of the request it runs for. Python 3.12+ profiles every thread already.
+
+    Args:
+        func (callable): The function
+
+    Returns:
+        callable: The function, profiled while a profiled request calls it
+    """
+    if _PROFILES_ALL_THREADS:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiles = _request_profiles.get()
+        if profiles is None:
+            return func(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiling tool is active in this thread
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            profiles.append(profiler)
+
+    return wrapper
+
+
+def _sampled() -> bool:
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def _tagged_by_staff_sync(request) -> bool:
+    if settings.PROFILING_HEADER not in request.headers:
+        return False
+    return request.user.is_staff
+
+
+async def _tagged_by_staff(request) -> bool:
+    # Anyone could send the header, so it only counts for staff
+    if settings.PROFILING_HEADER not in request.headers:
+        return False
+    return (await request.auser()).is_staff
+
+
+def _start_profiler():
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiling tool (a debugger, coverage) is active
+        _profiler_lock.release()
+        return None
+    return profiler
+
+
+def _stop_profiler(profiler) -> list:
+    if profiler is None:
+        return None
+    profiler.disable()
+    _profiler_lock.release()
+    # With the ones profile_thread added
+    return list(_request_profiles.get())
+
+
+def _finish(request, response, started: float, profiles: list):
+    record = {
+        "method": request.method,
+        "path": request.path,
+        "status": response.status_code,
+        "started": time.time() - (time.perf_counter() - started),
+        # Until the view returned the response, before any streaming
+        "response_seconds": time.perf_counter() - started,
+        "seconds": None,
+        "profiled": profiles is not None,
+        "profile_file": None,
+        "top_functions": [],
+    }
+
+    if not response.streaming:
+        _record(record, started, profiles)
+        return response
+
+    content = response.streaming_content
+    if response.is_async:
+
+        async def timed():
+            try:
+                async for part in content:
+                    yield part
+            finally:
+                _record(record, started, profiles)
+
+    else:
+
+        def timed():
+            try:
+                yield from content
+            finally:
+                _record(record, started, profiles)
+
+    response.streaming_content = timed()
+    return response
+
+
+def _record(record: dict, started: float, profiles: list):
+    record["seconds"] = time.perf_counter() - started
+    if profiles is not None and record["seconds"] >= settings.PROFILING_SLOW_SECONDS:
+        try:
+            stats = pstats.Stats(*profiles, stream=io.StringIO())
+            record["top_functions"] = top_functions(stats, settings.PROFILING_TOP_FUNCTIONS)
+            record["profile_file"] = _save_profile(stats, record)
+        except Exception as e:
+            print(f"Error saving profile: {e}")
+    with _timings_lock:
+        _timings.append(record)
+
+
+def _save_profile(stats: pstats.Stats, record: dict) -> str:
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", record["path"]).strip("_") or "root"
+    name = "{}-{}-{}-{}ms.pstats".format(
+        time.strftime("%Y%m%d-%H%M%S", time.localtime(record["started"])),
+        record["method"],
+        slug[:60],
+        int(record["seconds"] * 1000),
+    )
+    path = os.path.join(settings.PROFILING_DIR, name)
+    stats.dump_stats(path)
+
+    # Keep the newest PROFILING_MAX_FILES
+    files = sorted(
+        (f for f in os.listdir(settings.PROFILING_DIR) if f.endswith(".pstats")),
+        reverse=True,
+    )
+    for old in files[settings.PROFILING_MAX_FILES :]:
+        try:
+            os.remove(os.path.join(settings.PROFILING_DIR, old))
+        except OSError:
+            pass
+    return name
+
+
+def _short_path(filename: str) -> str:
+    # Relative to the longest sys.path entry it's under, like an import path
+    best = ""
+    for entry in sys.path:
+        if entry and filename.startswith(entry.rstrip(os.sep) + os.sep) and len(entry) > len(best):
+            best = entry
+    return os.path.relpath(filename, best) if best else filename
+
+
+def top_functions(stats: pstats.Stats, limit: int) -> list:
+    """
+    The functions a profile spent the most time in, not counting the time
+    spent in functions they called
+
+    Args:
+        stats (pstats.Stats): The profile
+        limit (int): Most functions to return
+
+    Returns:
+        list: [{"function", "calls", "own_seconds", "cumulative_seconds"}]
+    """
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+    return [
+        {
+            "function": f"{_short_path(filename)}:{line}({name})",
+            "calls": calls,
+            "own_seconds": round(own, 6),
+            "cumulative_seconds": round(cumulative, 6),
+        }
+        for (filename, line, name), (primitive, calls, own, cumulative, callers) in rows[:limit]
+    ]
+
+
+def slowest_requests(limit: int) -> list:
+    """
+    Get the slowest of the requests in the timing buffer
+
+    Args:
+        limit (int): Most requests to return
+
+    Returns:
+        list: Request records, slowest first
+    """
+    with _timings_lock:
+        finished = [record for record in _timings if record["seconds"] is not None]
+    finished.sort(key=lambda record: record["seconds"], reverse=True)
+    return finished[:limit]
+
+
+def timing_summary() -> dict:
+    """
+    Returns:
+        dict: {"requests", "profiled", "mean_seconds"} over the timing buffer
+    """
+    with _timings_lock:
+        seconds = [record["seconds"] for record in _timings if record["seconds"] is not None]
+        profiled = sum(1 for record in _timings if record["profiled"])
+    return {
+        "requests": len(seconds),
+        "profiled": profiled,
+        "mean_seconds": sum(seconds) / len(seconds) if seconds else 0.0,
+    }
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_settings_style'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ordinal', models.IntegerField()),
+                ('role', models.CharField(max_length=20)),
+                ('content', models.TextField()),
+                ('attachments', models.JSONField(default=list)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='core.chats')),
+            ],
+            options={
+                'ordering': ['ordinal'],
+                'indexes': [models.Index(fields=['chat', 'ordinal'], name='core_messag_chat_id_8a9d49_idx')],
+            },
+        ),
+    ]
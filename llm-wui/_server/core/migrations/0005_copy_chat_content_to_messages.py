@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:23
+
+from django.db import migrations
+
+
+def copy_content_to_messages(apps, schema_editor):
+    Chats = apps.get_model("core", "Chats")
+    Message = apps.get_model("core", "Message")
+
+    for chat in Chats.objects.iterator():
+        messages = (chat.content or {}).get("messages", [])
+        if not isinstance(messages, list):
+            continue
+
+        rows = []
+        for position, message in enumerate(messages):
+            ordinal = message.get("id", position)
+            if not isinstance(ordinal, int):
+                ordinal = position
+            rows.append(
+                Message(
+                    chat=chat,
+                    ordinal=ordinal,
+                    role=message.get("role", "user"),
+                    content=message.get("content") or "",
+                    attachments=message.get("attachments") or [],
+                )
+            )
+        Message.objects.bulk_create(rows, batch_size=500)
+
+
+def copy_messages_to_content(apps, schema_editor):
+    Chats = apps.get_model("core", "Chats")
+    Message = apps.get_model("core", "Message")
+
+    for chat in Chats.objects.iterator():
+        messages = []
+        for message in Message.objects.filter(chat=chat).order_by("ordinal", "id"):
+            entry = {"id": message.ordinal, "role": message.role, "content": message.content}
+            if message.role == "user":
+                entry["attachments"] = message.attachments
+            messages.append(entry)
+        chat.content = {"messages": messages}
+        chat.save(update_fields=["content"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_message'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_content_to_messages, copy_messages_to_content),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:23
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_copy_chat_content_to_messages'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='chats',
+            name='content',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_remove_chats_content'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Document',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('handle', models.CharField(max_length=32, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('content_hash', models.CharField(blank=True, default='', max_length=32)),
+                ('time_stamp', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chats',
+            name='documents',
+            field=models.ManyToManyField(blank=True, related_name='chats', to='core.document'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_document_library'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chats',
+            index=models.Index(fields=['user', 'time_stamp'], name='core_chats_user_id_db92b7_idx'),
+        ),
+    ]
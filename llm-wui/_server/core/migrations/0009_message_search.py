@@ -0,0 +1,53 @@
+from django.db import migrations
+
+# External content FTS5 index over core_message.content. The triggers keep it
+# in step with every insert, update and delete of a message, so send_chat's
+# bulk_create indexes the new messages in the same transaction.
+CREATE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE core_message_fts USING fts5(
+        content,
+        content='core_message',
+        content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER core_message_fts_insert AFTER INSERT ON core_message BEGIN
+        INSERT INTO core_message_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER core_message_fts_delete AFTER DELETE ON core_message BEGIN
+        INSERT INTO core_message_fts(core_message_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER core_message_fts_update AFTER UPDATE OF content ON core_message BEGIN
+        INSERT INTO core_message_fts(core_message_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO core_message_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    # Index the messages that already exist
+    "INSERT INTO core_message_fts(core_message_fts) VALUES ('rebuild')",
+]
+
+DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS core_message_fts_update",
+    "DROP TRIGGER IF EXISTS core_message_fts_delete",
+    "DROP TRIGGER IF EXISTS core_message_fts_insert",
+    "DROP TABLE IF EXISTS core_message_fts",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_chats_user_time_stamp'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEX, DROP_INDEX),
+    ]
@@ -4,10 +4,35 @@ from django.contrib.auth.models import User
 
 class Chats(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    content = models.JSONField("Chats", default=dict)
     chat_id = models.IntegerField()
     time_stamp = models.DateField()
     title = models.CharField(max_length=50)
+    documents = models.ManyToManyField("Document", blank=True, related_name="chats")
+
+    class Meta:
+        # get_chats pages through a user's chats newest first
+        indexes = [models.Index(fields=["user", "time_stamp"])]
+
+
+class Message(models.Model):
+    chat = models.ForeignKey(Chats, on_delete=models.CASCADE, related_name="messages")
+    ordinal = models.IntegerField()
+    role = models.CharField(max_length=20)
+    content = models.TextField()
+    attachments = models.JSONField(default=list)
+
+    class Meta:
+        ordering = ["ordinal"]
+        indexes = [models.Index(fields=["chat", "ordinal"])]
+
+
+class Document(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    handle = models.CharField(max_length=32, unique=True)
+    size = models.BigIntegerField(default=0)
+    content_hash = models.CharField(max_length=32, blank=True, default="")
+    time_stamp = models.DateTimeField(auto_now=True)
 
 
 class Settings(models.Model):
@@ -0,0 +1,29 @@
+import importlib
+import time
+
+# The modules core.views imports where they're used rather than at the top,
+# slowest first. Together they pull in langchain, FAISS, numpy and PyPDF2.
+RAG_MODULES = (
+    "core.rag",
+    "core.message_index",
+    "core.library",
+    "core.extraction",
+    "core.embedding_cache",
+    "core.embedding_scheduler",
+)
+
+
+def preload():
+    """
+    Import the RAG stack and the url conf up front, so the first upload or
+    chat with attachments doesn't pay for it. With gunicorn --preload this
+    runs once in the master and the workers share the loaded modules.
+    """
+    from django.urls import get_resolver
+
+    started = time.perf_counter()
+    for name in RAG_MODULES:
+        importlib.import_module(name)
+    # Imports every view module
+    get_resolver().url_patterns
+    print(f"Preloaded the RAG stack in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,412 @@
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+import xxhash
+from django.conf import settings
+from langchain_ollama import OllamaEmbeddings
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from core.embedding_cache import CachedEmbeddings, get_embedding_cache
+from core.embedding_scheduler import ScheduledEmbeddings, get_embedding_scheduler
+from core.extraction import iter_file_text
+from core.metrics import Stopwatch, observe_stage
+from core.ttl_cache import TTLCache
+
+EMBEDDING_MODEL = "embeddinggemma:300m"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# Chunks are embedded and added to the index this many at a time
+EMBED_BATCH_SIZE = 256
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = ".lock"
+EMPTY_ENTRY = {"hash": None, "chunks": {}}
+# Times a document is embedded again when its entry changed while it was
+INDEX_ATTEMPTS = 3
+
+# Library indexes loaded for retrieval, {index dir: (manifest version, FAISS)}.
+# Shared between requests, so only ever read from.
+_loaded_libraries = TTLCache(settings.LIBRARY_INDEX_CACHE_SIZE, ttl=3600)
+
+
+@contextmanager
+def index_lock(index_dir: str, shared: bool = False):
+    """
+    Lock an index against changes from other threads and worker processes
+    (flock on a file in the index directory)
+
+    Args:
+        index_dir (str): The index directory, created if needed
+        shared (bool, optional): Only reading, other readers may hold it too. Defaults to False.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    # Each acquisition opens its own file, flock doesn't nest within one
+    with open(os.path.join(index_dir, LOCK_NAME), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_embeddings() -> CachedEmbeddings:
+    """
+    Get the embedding model, backed by the shared embedding cache and scheduler
+
+    Returns:
+        CachedEmbeddings: Embeddings that skip the model for cached chunks and
+        batch the rest with other requests' chunks
+    """
+    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+    scheduler = get_embedding_scheduler(
+        EMBEDDING_MODEL, lambda: OllamaEmbeddings(model=EMBEDDING_MODEL)
+    )
+    return CachedEmbeddings(
+        ScheduledEmbeddings(embeddings, scheduler),
+        EMBEDDING_MODEL,
+        get_embedding_cache(),
+    )
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Hash a file's contents
+
+    Args:
+        file_path (str): file path
+
+    Returns:
+        str: Hex digest identifying the document content
+    """
+    digest = xxhash.xxh3_64()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_chunks(parts):
+    """
+    Split streamed text into chunks without holding the whole document
+
+    Args:
+        parts (iterable): Pages or blocks of a document
+
+    Yields:
+        str: Chunks of at most CHUNK_SIZE characters
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+    )
+    buffer = ""
+    for part in parts:
+        buffer += part
+        if len(buffer) >= CHUNK_SIZE * 16:
+            chunks = splitter.split_text(buffer)
+            # Carry the last chunk so text running over a page boundary stays together
+            yield from chunks[:-1]
+            buffer = chunks[-1] if chunks else ""
+    if buffer.strip():
+        yield from splitter.split_text(buffer)
+
+
+def library_index_dir(user) -> str:
+    """
+    Get the directory the vector index of a user's document library is saved in
+
+    Args:
+        user (User): The user
+
+    Returns:
+        str: document_storage/f{user}/index/library
+    """
+    return os.path.join(
+        settings.BASE_DIR, f"document_storage/f{user}", "index", "library"
+    )
+
+
+def _read_manifest(index_dir: str) -> dict:
+    try:
+        with open(os.path.join(index_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"model": EMBEDDING_MODEL, "documents": {}}
+
+
+def _write_manifest(index_dir: str, manifest: dict):
+    fd, temp_path = tempfile.mkstemp(dir=index_dir, prefix=".manifest-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, os.path.join(index_dir, MANIFEST_NAME))
+
+
+def _load_index(index_dir: str, embeddings):
+    if not os.path.exists(os.path.join(index_dir, "index.faiss")):
+        return None
+    # The pickled docstore was written by index_chat_documents, not user input
+    return FAISS.load_local(
+        index_dir, embeddings, allow_dangerous_deserialization=True
+    )
+
+
+def _manifest_version(index_dir: str):
+    # Changes whenever the manifest is replaced, which every index change ends with
+    try:
+        stat = os.stat(os.path.join(index_dir, MANIFEST_NAME))
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_ino)
+
+
+def _cached_library_index(index_dir: str):
+    """
+    Get a library index for reading, loaded from disk only when it changed
+
+    Args:
+        index_dir (str): The library index directory
+
+    Returns:
+        FAISS: The index, None if there isn't one
+    """
+    version = _manifest_version(index_dir)
+    if version is None:
+        return None
+    cached = _loaded_libraries.get(index_dir)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with index_lock(index_dir, shared=True):
+        version = _manifest_version(index_dir)
+        vector_store = _load_index(index_dir, get_embeddings())
+    if vector_store is not None:
+        _loaded_libraries.set(index_dir, (version, vector_store))
+    return vector_store
+
+
+def _save_index(vector_store, index_dir: str):
+    # Save next to the live files, then swap them in so readers never see a
+    # half-written file. Called with the index locked.
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(index_dir), prefix=".save-")
+    try:
+        vector_store.save_local(temp_dir)
+        for name in ("index.faiss", "index.pkl"):
+            os.replace(os.path.join(temp_dir, name), os.path.join(index_dir, name))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def index_library_document(user, document_id: int, file_path: str) -> int:
+    """
+    Bring a document's chunks in the user's library index up to date with its
+    file. Unchanged files are skipped; for a changed file only chunks whose
+    text is new are embedded and chunks that disappeared are deleted.
+
+    The manifest records, per document, the file hash and the index ids of
+    each chunk keyed by a hash of the chunk text. The file is extracted and
+    embedded without the index locked, so retrieval isn't held up; if the
+    document's entry changed meanwhile the work is redone against it.
+
+    Args:
+        user (User): The user the library belongs to
+        document_id (int): The Document id
+        file_path (str): The document's file
+
+    Raises:
+        ExtractionError: The file can't be read
+
+    Returns:
+        int: Number of chunks that were embedded
+    """
+    index_dir = library_index_dir(user)
+    key = str(document_id)
+    digest = file_hash(file_path)
+    embeddings = get_embeddings()
+
+    for _ in range(INDEX_ATTEMPTS):
+        entry = _read_manifest(index_dir)["documents"].get(key, EMPTY_ENTRY)
+        if entry["hash"] == digest:
+            return 0
+
+        chunks, reused, new_chunks = _embed_document(
+            file_path, entry, _index_ids(_cached_library_index(index_dir)), embeddings
+        )
+
+        with index_lock(index_dir):
+            manifest = _read_manifest(index_dir)
+            current = manifest["documents"].get(key, EMPTY_ENTRY)
+            if current["hash"] == digest:
+                # Another worker indexed this version meanwhile
+                return 0
+            if current != entry:
+                continue
+
+            vector_store = _load_index(index_dir, embeddings)
+            if not reused <= _index_ids(vector_store):
+                # The index lost chunks the manifest lists
+                _loaded_libraries.delete(index_dir)
+                continue
+
+            if new_chunks:
+                vector_store = _add_chunks(vector_store, embeddings, new_chunks, document_id)
+
+            removed = [
+                chunk_id
+                for ids in entry["chunks"].values()
+                for chunk_id in ids
+                if chunk_id not in reused
+            ]
+            if removed and vector_store is not None:
+                _delete_chunks(vector_store, removed)
+
+            if vector_store is not None:
+                _save_index(vector_store, index_dir)
+
+            manifest["documents"][key] = {"hash": digest, "chunks": chunks}
+            _write_manifest(index_dir, manifest)
+            return len(new_chunks)
+
+    raise RuntimeError(f"Library index kept changing, gave up indexing document {document_id}")
+
+
+def _embed_document(file_path: str, entry: dict, present: set, embeddings) -> tuple:
+    """
+    Chunk a file and embed the chunks its manifest entry doesn't have yet
+
+    Args:
+        file_path (str): The document's file
+        entry (dict): The document's manifest entry
+        present (set): Chunk ids in the index; listed ones that aren't are embedded again
+        embeddings (Embeddings): The embedding model
+
+    Returns:
+        tuple: (chunks for the manifest, set of reused ids, [(id, text, vector)] to add)
+    """
+    # Ids of the previous version's chunks, to reuse for unchanged text
+    previous = {
+        chunk: [chunk_id for chunk_id in ids if chunk_id in present]
+        for chunk, ids in entry["chunks"].items()
+    }
+    chunks = {}
+    reused = set()
+    new_chunks = []
+    batch = []
+
+    # Extraction feeds chunking feeds embedding, so time each part separately
+    extraction = Stopwatch()
+    chunking = Stopwatch()
+    embedding = Stopwatch()
+    parts = extraction.iterate(iter_file_text(file_path))
+
+    def embed(batch):
+        with embedding.measure():
+            vectors = embeddings.embed_documents([text for chunk_id, text in batch])
+        new_chunks.extend(
+            (chunk_id, text, vector) for (chunk_id, text), vector in zip(batch, vectors)
+        )
+
+    for text in chunking.iterate(iter_chunks(parts)):
+        chunk = xxhash.xxh3_64_hexdigest(text.encode("utf-8"))
+        if previous.get(chunk):
+            chunk_id = previous[chunk].pop()
+            reused.add(chunk_id)
+        else:
+            chunk_id = uuid.uuid4().hex
+            batch.append((chunk_id, text))
+        chunks.setdefault(chunk, []).append(chunk_id)
+
+        if len(batch) >= EMBED_BATCH_SIZE:
+            embed(batch)
+            batch = []
+
+    if batch:
+        embed(batch)
+
+    observe_stage("extraction", extraction.elapsed)
+    observe_stage("chunking", chunking.elapsed - extraction.elapsed)
+    observe_stage("embedding", embedding.elapsed)
+    return chunks, reused, new_chunks
+
+
+def _add_chunks(vector_store, embeddings, new_chunks: list, document_id: int):
+    ids = [chunk_id for chunk_id, text, vector in new_chunks]
+    text_embeddings = [(text, vector) for chunk_id, text, vector in new_chunks]
+    metadatas = [{"document": document_id} for _ in new_chunks]
+    if vector_store is None:
+        return FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+    vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    return vector_store
+
+
+def _index_ids(vector_store) -> set:
+    if vector_store is None:
+        return set()
+    return set(vector_store.index_to_docstore_id.values())
+
+
+def _delete_chunks(vector_store, ids: list):
+    # FAISS.delete raises if any id isn't in the index, skip the ones that
+    # aren't instead of failing the whole update
+    present = _index_ids(vector_store)
+    ids = [chunk_id for chunk_id in ids if chunk_id in present]
+    if ids:
+        vector_store.delete(ids)
+
+
+def remove_library_document(user, document_id: int):
+    """
+    Delete a document's chunks from the user's library index
+
+    Args:
+        user (User): The user the library belongs to
+        document_id (int): The Document id
+    """
+    index_dir = library_index_dir(user)
+
+    with index_lock(index_dir):
+        manifest = _read_manifest(index_dir)
+        entry = manifest["documents"].pop(str(document_id), None)
+        if entry is None:
+            return
+
+        ids = [chunk_id for ids in entry["chunks"].values() for chunk_id in ids]
+        vector_store = _load_index(index_dir, get_embeddings())
+        if vector_store is not None and ids:
+            _delete_chunks(vector_store, ids)
+            _save_index(vector_store, index_dir)
+        _write_manifest(index_dir, manifest)
+
+
+def retrieve_library_chunks(user, document_ids: list, query: str, k: int = 5) -> list:
+    """
+    Retrieve the chunks of some of a user's documents most relevant to a query
+
+    Args:
+        user (User): The user the library belongs to
+        document_ids (list): Ids of the Documents to search
+        query (str): The user's message
+        k (int, optional): The amount of chunks to return. Defaults to 5.
+
+    Returns:
+        list: Chunk texts, empty if none of the documents are indexed
+    """
+    if not document_ids:
+        return []
+
+    index_dir = library_index_dir(user)
+
+    vector_store = _cached_library_index(index_dir)
+    if vector_store is None:
+        return []
+
+    # The index holds the whole library, so look past the top k before filtering
+    results = vector_store.similarity_search(
+        query,
+        k=k,
+        filter={"document": {"$in": list(document_ids)}},
+        fetch_k=min(vector_store.index.ntotal, settings.LIBRARY_FETCH_K),
+    )
+    return [doc.page_content for doc in results]
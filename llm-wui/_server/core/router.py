@@ -0,0 +1,190 @@
+import threading
+import time
+import httpx
+from django.conf import settings
+
+
+class Backend:
+    """
+    One Ollama server of the pool and what the router knows about it
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.outstanding = 0
+        self.loaded_models = set()
+        self.failures = 0
+        self.last_checked = None
+        self.last_error = None
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "loaded_models": sorted(self.loaded_models),
+            "failures": self.failures,
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+        }
+
+
+class OllamaRouter:
+    """
+    Spreads generations over a pool of Ollama servers. A background thread
+    polls each server's /api/ps for health and the models it has loaded.
+    Generations go to the healthy server with the fewest outstanding, unless
+    one that already has the model loaded is within OLLAMA_AFFINITY_SLACK of it.
+    """
+
+    def __init__(self, urls: list, interval: float):
+        self.backends = [Backend(url.rstrip("/")) for url in urls]
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._checker = None
+
+    def start(self):
+        """
+        Start the health check thread, once
+        """
+        with self._lock:
+            if self._checker is None:
+                self._checker = threading.Thread(
+                    target=self._check_loop, name="ollama-health", daemon=True
+                )
+                self._checker.start()
+
+    def _check_loop(self):
+        with httpx.Client(timeout=settings.OLLAMA_HEALTH_TIMEOUT) as client:
+            while True:
+                for backend in self.backends:
+                    self.check(backend, client)
+                time.sleep(self.interval)
+
+    def check(self, backend: Backend, client: httpx.Client):
+        """
+        Refresh a backend's health and loaded models from /api/ps
+
+        Args:
+            backend (Backend): The backend
+            client (httpx.Client): Client to make the request with
+        """
+        try:
+            response = client.get(f"{backend.url}/api/ps")
+            response.raise_for_status()
+            loaded = {model["name"] for model in response.json().get("models", [])}
+        except Exception as e:
+            with self._lock:
+                backend.healthy = False
+                backend.last_error = str(e)
+                backend.last_checked = time.time()
+            return
+
+        with self._lock:
+            backend.healthy = True
+            backend.loaded_models = loaded
+            backend.last_checked = time.time()
+
+    def acquire(self, model: str, exclude: set = ()) -> Backend:
+        """
+        Pick a backend for a generation and count it as outstanding there.
+        Every acquire has to be followed by a release.
+
+        Args:
+            model (str): The model to generate with
+            exclude (set, optional): Urls not to use, e.g. ones that already failed
+
+        Returns:
+            Backend: The chosen backend, or None if every backend is excluded
+        """
+        with self._lock:
+            candidates = [b for b in self.backends if b.url not in exclude]
+            healthy = [b for b in candidates if b.healthy]
+            # With nothing healthy, trying a server beats failing outright
+            candidates = healthy or candidates
+            if not candidates:
+                return None
+
+            least = min(b.outstanding for b in candidates)
+            warm = [b for b in candidates if model in b.loaded_models]
+            if warm and min(b.outstanding for b in warm) <= least + settings.OLLAMA_AFFINITY_SLACK:
+                candidates = warm
+            backend = min(candidates, key=lambda b: b.outstanding)
+
+            backend.outstanding += 1
+            # Ollama loads the model there to serve this, so route its peers there too
+            backend.loaded_models.add(model)
+            return backend
+
+    def release(self, backend: Backend):
+        with self._lock:
+            backend.outstanding -= 1
+
+    def report_failure(self, backend: Backend, model: str, error: Exception):
+        """
+        Record a failed generation. Connection errors and server errors take
+        the backend out of rotation until its next successful health check;
+        a 404 means it doesn't have the model.
+
+        Args:
+            backend (Backend): The backend that failed
+            model (str): The model that was requested
+            error (Exception): The error
+        """
+        with self._lock:
+            backend.failures += 1
+            backend.last_error = str(error)
+            if (
+                isinstance(error, httpx.HTTPStatusError)
+                and error.response.status_code == 404
+            ):
+                backend.loaded_models.discard(model)
+            else:
+                backend.healthy = False
+
+    def stats(self) -> list:
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a generation that failed this way can be sent to another backend
+
+    Args:
+        error (Exception): The error
+
+    Returns:
+        bool: True for connection errors, 404 (model missing) and 5xx responses
+    """
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 404 or status >= 500
+    return False
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """
+    Get the process wide router for settings.OLLAMA_BACKENDS
+
+    Returns:
+        OllamaRouter: The router, or None when no pool is configured and each
+        user's own ollama url is used
+    """
+    global _router
+    if not settings.OLLAMA_BACKENDS:
+        return None
+    with _router_lock:
+        if _router is None:
+            _router = OllamaRouter(
+                settings.OLLAMA_BACKENDS, settings.OLLAMA_HEALTH_INTERVAL
+            )
+            _router.start()
+        return _router
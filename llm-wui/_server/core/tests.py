@@ -1,3 +1,243 @@
-from django.test import TestCase
+import asyncio
+import datetime
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from core.admission import AdmissionController, QueueFull
+from core.models import Chats, Message
 
-# Create your tests here.
+
+def make_controller(**kwargs) -> AdmissionController:
+    options = {
+        "concurrency": 1,
+        "per_user": 1,
+        "queue_per_user": 4,
+        "queue_total": 16,
+        "default_duration": 10.0,
+    }
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+async def settle():
+    # Admissions are handed to the waiting loop with call_soon_threadsafe
+    await asyncio.sleep(0)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def test_users_take_turns(self):
+        async def scenario():
+            controller = make_controller()
+            running = controller.enqueue("a")
+            queued = [
+                ("a", controller.enqueue("a")),
+                ("a", controller.enqueue("a")),
+                ("b", controller.enqueue("b")),
+                ("c", controller.enqueue("c")),
+            ]
+
+            order = []
+            current = running
+            while True:
+                current.release()
+                await settle()
+                admitted = [(user, t) for user, t in queued if t.admitted and not t.released]
+                if not admitted:
+                    break
+                user, current = admitted[0]
+                order.append(user)
+            return order
+
+        # a's second and third generations wait for b and c to get a turn
+        self.assertEqual(asyncio.run(scenario()), ["a", "b", "c", "a"])
+
+    def test_release_before_admission_leaves_the_queue(self):
+        async def scenario():
+            controller = make_controller()
+            running = controller.enqueue("a")
+            given_up = controller.enqueue("b")
+            waiting = controller.enqueue("c")
+
+            given_up.release()
+            self.assertEqual(controller.stats()["queued"], 1)
+
+            running.release()
+            await settle()
+            self.assertFalse(given_up.admitted)
+            self.assertTrue(await waiting.wait(0))
+
+            # Releasing twice doesn't free a second slot
+            given_up.release()
+            waiting.release()
+            waiting.release()
+            self.assertEqual(controller.stats()["running"], 0)
+
+        asyncio.run(scenario())
+
+    def test_status_positions(self):
+        async def scenario():
+            controller = make_controller(concurrency=2)
+            controller.enqueue("a")
+            controller.enqueue("b")
+            a2 = controller.enqueue("a")
+            a3 = controller.enqueue("a")
+            b2 = controller.enqueue("b")
+
+            # a2 and b2 are each first in their user's queue, a3 comes after both
+            self.assertEqual(a2.status()["position"], 2)
+            self.assertEqual(b2.status()["position"], 2)
+            self.assertEqual(a3.status(), {"position": 3, "estimated_wait": 20.0})
+
+        asyncio.run(scenario())
+
+    def test_admitted_status(self):
+        async def scenario():
+            controller = make_controller()
+            ticket = controller.enqueue("a")
+            self.assertTrue(await ticket.wait(0))
+            self.assertEqual(ticket.status(), {"position": 0, "estimated_wait": 0.0})
+
+        asyncio.run(scenario())
+
+    def test_preparation_held_until_its_work_is_done(self):
+        async def scenario():
+            controller = make_controller()
+            work = asyncio.get_running_loop().create_future()
+            with controller.prepare("a") as preparation:
+                preparation.hold_until(work)
+            self.assertEqual(controller.stats()["preparing"], 1)
+
+            work.set_result(None)
+            await settle()
+            self.assertEqual(controller.stats()["preparing"], 0)
+
+        asyncio.run(scenario())
+
+    def test_wait_gives_up_when_stopped(self):
+        async def scenario():
+            controller = make_controller()
+            controller.enqueue("a")
+            queued = controller.enqueue("a")
+            stop = asyncio.Event()
+            asyncio.get_running_loop().call_later(0.01, stop.set)
+            self.assertFalse(await queued.wait(stop=stop))
+            # Still queued, releasing takes it out
+            self.assertEqual(controller.stats()["queued"], 1)
+            queued.release()
+            self.assertEqual(controller.stats()["queued"], 0)
+
+        asyncio.run(scenario())
+
+    def test_preparing_counts_against_the_user_queue(self):
+        async def scenario():
+            controller = make_controller(queue_per_user=2)
+            with controller.prepare("a"), controller.prepare("a"):
+                with self.assertRaises(QueueFull):
+                    controller.prepare("a")
+                # Other users aren't affected
+                controller.prepare("b").__exit__(None, None, None)
+            self.assertEqual(controller.stats()["preparing"], 0)
+
+            # One running and one queued
+            controller.enqueue("a")
+            controller.enqueue("a")
+            with controller.prepare("a"):
+                with self.assertRaises(QueueFull):
+                    controller.enqueue("a")
+
+        asyncio.run(scenario())
+
+
+class MessageMigrationTests(TransactionTestCase):
+    before = [("core", "0004_message")]
+    after = [("core", "0009_message_search")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        # A fresh loader, the executor's graph is stale after migrating
+        return MigrationExecutor(connection).loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes("core"))
+
+    def test_messages_round_trip(self):
+        messages = [
+            {"id": 0, "role": "user", "content": "hi", "attachments": [{"name": "a.txt"}]},
+            {"id": 1, "role": "assistant", "content": "hello"},
+            {"id": 2, "role": "user", "content": "", "attachments": []},
+        ]
+
+        apps = self.migrate(self.before)
+        user = apps.get_model("auth", "User").objects.create(username="a@b.c")
+        apps.get_model("core", "Chats").objects.create(
+            user=user,
+            chat_id=1,
+            time_stamp=datetime.date(2026, 1, 1),
+            title="chat",
+            content={"messages": messages},
+        )
+
+        apps = self.migrate(self.after)
+        rows = apps.get_model("core", "Message").objects.order_by("ordinal")
+        self.assertEqual(
+            [(m.ordinal, m.role, m.content, m.attachments) for m in rows],
+            [(0, "user", "hi", [{"name": "a.txt"}]), (1, "assistant", "hello", []), (2, "user", "", [])],
+        )
+
+        apps = self.migrate(self.before)
+        chat = apps.get_model("core", "Chats").objects.get(chat_id=1)
+        self.assertEqual(chat.content, {"messages": messages})
+
+
+class ChatPagingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("a@b.c", password="x")
+        self.client.force_login(self.user)
+
+    def add_chat(self, chat_id, day):
+        return Chats.objects.create(
+            user=self.user, chat_id=chat_id, time_stamp=datetime.date(2026, 1, day), title=str(chat_id)
+        )
+
+    def get_chats(self, **params):
+        return self.client.get("/get_chats", params).json()["response"]
+
+    def test_cursor_pages_through_tied_timestamps(self):
+        # Five chats on the same day between two other days, so pages end mid-tie
+        self.add_chat(1, 1)
+        for chat_id in range(2, 7):
+            self.add_chat(chat_id, 2)
+        self.add_chat(7, 3)
+
+        seen = []
+        page = self.get_chats(limit=2)
+        while True:
+            seen += [chat["chat_id"] for chat in page["user_chats"]]
+            if page["next_cursor"] is None:
+                break
+            page = self.get_chats(limit=2, cursor=page["next_cursor"])
+
+        # Newest day first, ties newest row first, none skipped or repeated
+        self.assertEqual(seen, [7, 6, 5, 4, 3, 2, 1])
+
+    def test_get_chats_page_size_at_least_one(self):
+        self.add_chat(1, 1)
+        self.add_chat(2, 2)
+        for limit in (0, -3):
+            page = self.get_chats(limit=limit)
+            self.assertEqual([chat["chat_id"] for chat in page["user_chats"]], [2])
+            self.assertIsNotNone(page["next_cursor"])
+
+    def test_load_chat_page_size_at_least_one(self):
+        chat = self.add_chat(1, 1)
+        for ordinal in range(3):
+            Message.objects.create(chat=chat, ordinal=ordinal, role="user", content=str(ordinal))
+
+        for limit in (0, -3):
+            page = self.client.post(
+                "/load_chat", {"chat_id": 1, "limit": limit}, content_type="application/json"
+            ).json()["response"]
+            self.assertEqual([m["id"] for m in page["content"]["messages"]], [2])
+            self.assertEqual(page["next_cursor"], 2)
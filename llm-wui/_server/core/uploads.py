@@ -0,0 +1,120 @@
+import os
+import re
+import shutil
+import uuid
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.utils.text import get_valid_filename
+
+HANDLE_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def upload_root(user) -> str:
+    """
+    Get the directory a user's uploads are stored in
+
+    Args:
+        user (User): The user
+
+    Returns:
+        str: document_storage/f{user}/uploads
+    """
+    return os.path.join(settings.BASE_DIR, f"document_storage/f{user}", "uploads")
+
+
+def resolve_upload(user, handle: str):
+    """
+    Find the file an upload handle refers to
+
+    Args:
+        user (User): The user that uploaded the file
+        handle (str): The handle returned by upload_file
+
+    Returns:
+        str: The file path, or None if the handle is unknown
+    """
+    if not isinstance(handle, str) or not HANDLE_PATTERN.match(handle):
+        return None
+
+    directory = os.path.join(upload_root(user), handle)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return None
+    return os.path.join(directory, names[0]) if names else None
+
+
+def save_upload(user, name: str, data: bytes) -> str:
+    """
+    Store file contents received some other way than upload_file
+
+    Args:
+        user (User): The user the file belongs to
+        name (str): The file name
+        data (bytes): The file contents
+
+    Returns:
+        str: The new upload handle
+    """
+    handle = uuid.uuid4().hex
+    directory = os.path.join(upload_root(user), handle)
+    os.makedirs(directory, exist_ok=True)
+
+    name = get_valid_filename(os.path.basename(name or "")) or "upload"
+    with open(os.path.join(directory, name), "wb") as f:
+        f.write(data)
+    return handle
+
+
+class AttachmentUploadHandler(FileUploadHandler):
+    """
+    Streams each uploaded file straight to document_storage/f{user}/uploads/{handle}/
+    in the chunks the multipart parser reads, stopping once it exceeds max_bytes.
+    """
+
+    def __init__(self, request, max_bytes: int):
+        super().__init__(request)
+        self.max_bytes = max_bytes
+        self.too_large = False
+        self.destination = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.handle = uuid.uuid4().hex
+        self.directory = os.path.join(upload_root(self.request.user), self.handle)
+        os.makedirs(self.directory, exist_ok=True)
+
+        name = get_valid_filename(os.path.basename(self.file_name or "")) or "upload"
+        self.path = os.path.join(self.directory, name)
+        self.destination = open(self.path, "wb")
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_bytes:
+            self.too_large = True
+            self._discard()
+            raise StopUpload(connection_reset=True)
+        self.destination.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.destination.close()
+        self.destination = None
+        uploaded = UploadedFile(
+            name=os.path.basename(self.path),
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+        )
+        uploaded.handle = self.handle
+        return uploaded
+
+    def upload_interrupted(self):
+        self._discard()
+
+    def _discard(self):
+        if self.destination is not None:
+            self.destination.close()
+            self.destination = None
+            shutil.rmtree(self.directory, ignore_errors=True)
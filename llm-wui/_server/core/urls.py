@@ -4,10 +4,20 @@ from . import views
 urlpatterns = [
     path("", view=views.index, name="index"),
     path("send_chat", view=views.send_chat, name="send_chat"),
+    path("stop_generation", view=views.stop_generation, name="stop_generation"),
+    path("upload_file", view=views.upload_file, name="upload_file"),
+    path("search_chats", view=views.search_chats, name="search_chats"),
+    path("semantic_search", view=views.semantic_search, name="semantic_search"),
+    path("get_documents", view=views.get_documents, name="get_documents"),
+    path("delete_document", view=views.delete_document, name="delete_document"),
     path("delete_chat", view=views.delete_chat, name="delete_chat"),
     path("get_chats", view=views.get_chats, name="get_chats"),
     path("load_chat", view=views.load_chat, name="load_chat"),
     path("get_models", view=views.get_models, name="get_models"),
     path("update_settings", view=views.update_settings, name="update_settings"),
     path("load_settings", view=views.load_settings, name="load_settings"),
+    path("embedding_stats", view=views.embedding_stats, name="embedding_stats"),
+    path("backend_stats", view=views.backend_stats, name="backend_stats"),
+    path("metrics", view=views.prometheus_metrics, name="metrics"),
+    path("slow_requests", view=views.slow_requests, name="slow_requests"),
 ]
@@ -0,0 +1,87 @@
+from django.conf import settings
+from core.models import Settings
+from core.ttl_cache import TTLCache
+
+DEFAULT_SETTINGS = {
+    "ollama_url": "http://127.0.0.1:11434",
+    "search_url": "",
+    "style": "light",
+}
+
+# {user id: {"ollama_url", "search_url", "style"}}. Entries are dropped on
+# update_settings; the ttl bounds how long other worker processes can serve
+# settings that were changed through a different worker.
+settings_cache = TTLCache(settings.USER_SETTINGS_CACHE_SIZE, settings.USER_SETTINGS_CACHE_TTL)
+
+
+def settings_to_dict(user_settings: Settings) -> dict:
+    return {
+        "ollama_url": user_settings.ollama_url,
+        "search_url": user_settings.search_url,
+        "style": user_settings.style,
+    }
+
+
+def get_user_settings(user) -> dict:
+    """
+    Get a user's settings, creating the defaults on first use
+
+    Args:
+        user (User): The user
+
+    Returns:
+        dict: {"ollama_url", "search_url", "style"}
+    """
+    cached = settings_cache.get(user.id)
+    if cached is not None:
+        return cached
+
+    user_settings, created = Settings.objects.get_or_create(
+        user=user, defaults=DEFAULT_SETTINGS
+    )
+    cached = settings_to_dict(user_settings)
+    settings_cache.set(user.id, cached)
+    return cached
+
+
+async def aget_user_settings(user) -> dict:
+    """
+    Async version of get_user_settings
+    """
+    cached = settings_cache.get(user.id)
+    if cached is not None:
+        return cached
+
+    user_settings, created = await Settings.objects.aget_or_create(
+        user=user, defaults=DEFAULT_SETTINGS
+    )
+    cached = settings_to_dict(user_settings)
+    settings_cache.set(user.id, cached)
+    return cached
+
+
+def save_user_settings(user, ollama_url: str, search_url: str, style: str) -> dict:
+    """
+    Store a user's settings and refresh the cached copy
+
+    Args:
+        user (User): The user
+        ollama_url (str): ollama url
+        search_url (str): searxng url
+        style (str): "light" or "dark"
+
+    Returns:
+        dict: {"ollama_url", "search_url", "style"}
+    """
+    settings_cache.delete(user.id)
+    user_settings, created = Settings.objects.update_or_create(
+        user=user,
+        defaults={
+            "ollama_url": ollama_url,
+            "search_url": search_url,
+            "style": style,
+        },
+    )
+    cached = settings_to_dict(user_settings)
+    settings_cache.set(user.id, cached)
+    return cached
@@ -2,97 +2,88 @@ from django.shortcuts import render
 from django.conf import settings
 import json
 import datetime
+import hmac
+import time
 import os
-import requests
-from django.http import JsonResponse
+import asyncio
+import httpx
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
-from core.models import Chats, Settings
-from langchain_ollama import OllamaEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from PyPDF2 import PdfReader
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from core.models import Chats, Document, Message
+from core.clients import get_client
+from core.catalogue import get_catalogue
+from core.router import get_router, is_retryable
+from core.admission import QueueFull, get_admission
+from core.generations import (
+    cancel_generation,
+    finish_generation,
+    start_generation,
+    track_generation,
+)
+from core.chat_search import group_by_chat, search_messages
+from core.user_settings import aget_user_settings, get_user_settings, save_user_settings
+from core.ttl_cache import TTLCache
+from core.uploads import AttachmentUploadHandler, resolve_upload, save_upload
+from core import metrics
+from core.middleware import profile_thread, slowest_requests, timing_summary
 import base64
 
-MANIFEST = {}
-if not settings.DEBUG:
-    # Prefer the collected STATIC_ROOT/manifest.json (where the Docker build copies files).
-    manifest_path = os.path.join(settings.STATIC_ROOT, "manifest.json")
-    # Fallback to the old location if present in the source tree.
-    if not os.path.exists(manifest_path):
-        manifest_path = os.path.join(
-            settings.BASE_DIR, "core", "static", "manifest.json"
-        )
-        # Vite may write `manifest.json` either at the root of the build folder
-        # or under a `.vite/` subfolder. Check multiple candidate locations so
-        # the server can find the manifest regardless of how Vite was configured.
-        candidates = [
-            os.path.join(settings.STATIC_ROOT, "manifest.json"),
-            os.path.join(settings.STATIC_ROOT, ".vite", "manifest.json"),
-            os.path.join(settings.STATIC_ROOT, "core", "manifest.json"),
-            os.path.join(settings.STATIC_ROOT, "core", ".vite", "manifest.json"),
-            os.path.join(settings.BASE_DIR, "core", "static", "manifest.json"),
-            os.path.join(
-                settings.BASE_DIR, "core", "static", "core", ".vite", "manifest.json"
-            ),
-        ]
+# The RAG stack (core.rag, core.library, core.message_index, core.extraction
+# and the embedding cache and scheduler) pulls in langchain, FAISS, numpy and
+# PyPDF2. It's imported where it's used so workers boot and serve e.g.
+# get_chats without it; set PRELOAD_RAG to load it up front instead (see
+# core/preload.py).
 
-        manifest_path = None
-        for candidate in candidates:
-            if candidate and os.path.exists(candidate):
-                manifest_path = candidate
-                break
 
-        if manifest_path:
+def load_manifest() -> dict:
+    """
+    Read Vite's build manifest
+
+    Returns:
+        dict: The manifest, empty if there's none or it can't be read
+    """
+    # The collected STATIC_ROOT (where the Docker build copies files) comes
+    # first, then the source tree. Vite may write manifest.json at the root of
+    # the build folder or under .vite/, depending on how it's configured.
+    candidates = [
+        os.path.join(settings.STATIC_ROOT, "manifest.json"),
+        os.path.join(settings.STATIC_ROOT, ".vite", "manifest.json"),
+        os.path.join(settings.STATIC_ROOT, "core", "manifest.json"),
+        os.path.join(settings.STATIC_ROOT, "core", ".vite", "manifest.json"),
+        os.path.join(settings.BASE_DIR, "core", "static", "manifest.json"),
+        os.path.join(settings.BASE_DIR, "core", "static", "core", ".vite", "manifest.json"),
+    ]
+    for candidate in candidates:
+        if os.path.exists(candidate):
             try:
-                with open(manifest_path, "r", encoding="utf-8") as f:
-                    MANIFEST = json.load(f)
+                with open(candidate, "r", encoding="utf-8") as f:
+                    return json.load(f)
             except Exception:
-                MANIFEST = {}
-        else:
-            MANIFEST = {}
+                return {}
+    return {}
 
-    try:
-        with open(manifest_path, "r", encoding="utf-8") as f:
-            MANIFEST = json.load(f)
-    except Exception:
-        MANIFEST = {}
 
+MANIFEST = {} if settings.DEBUG else load_manifest()
 
-def extract_text_from_file(file_path: str) -> str:
-    """
-    Extract readable text from a file based on its type.
+search_cache = TTLCache(settings.SEARCH_CACHE_SIZE, settings.SEARCH_CACHE_TTL)
+_search_inflight = {}
 
-    Args:
-        file_path (str): file path
+SYSTEM_PROMPT = "You are a helpful assistant and your response should be in the format of markdown."
 
-    Returns:
-        str: contents of the file
-    """
-    extension = os.path.splitext(file_path)[1].lower()
-    try:
-        if extension in [
-            ".txt",
-            ".py",
-            ".csv",
-            ".json",
-            ".md",
-            ".cpp",
-            ".json",
-            ".js",
-            ".jsx",
-            ".tsx",
-            ".html",
-            ".css",
-        ]:
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                return f.read()
-        elif extension == ".pdf":
-            reader = PdfReader(file_path)
-            return "\n".join(page.extract_text() or "" for page in reader.pages)
-        else:
-            return f"[Unsupported file type: {extension}]"
-    except Exception as e:
-        return f"[Error reading file: {e}]"
+# Timing and token counts from Ollama's final streamed object
+OLLAMA_STATS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
 
 
 @login_required
@@ -125,6 +116,123 @@ def index(req):
     return render(req, "core/index.html", context)
 
 
+@login_required
+@csrf_exempt
+async def upload_file(req):
+    """
+    Upload an attachment as multipart form data (field "file"). The file is
+    streamed to disk as it's received and added to the user's document
+    library, and send_chat refers to it by handle. It's indexed in the
+    background, the response doesn't wait for extraction and embedding.
+
+    Args:
+        req (http_request): The user request
+
+    Returns:
+        JsonResponse: {"response": either {"handle", "document_id", "name", "size"}, "File too large" or "Error"}
+    """
+    if req.method == "POST":
+        # Upload handlers have to be set before anything reads the body, which
+        # CsrfViewMiddleware does, so csrf is checked in _upload_file instead
+        try:
+            content_length = int(req.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            content_length = 0
+        # Leave room for the multipart boundaries and headers
+        if content_length > settings.ATTACHMENT_MAX_BYTES + 64 * 1024:
+            return JsonResponse({"response": "File too large"}, status=413)
+
+        handler = AttachmentUploadHandler(req, settings.ATTACHMENT_MAX_BYTES)
+        req.upload_handlers = [handler]
+        # Parsing writes the file to disk, keep it off the event loop and the
+        # thread the other sync views share
+        return await sync_to_async(profile_thread(_upload_file), thread_sensitive=False)(req, handler)
+
+
+@csrf_protect
+def _upload_file(req, handler):
+    uploaded = req.FILES.get("file")
+    if handler.too_large:
+        return JsonResponse({"response": "File too large"}, status=413)
+    if uploaded is None:
+        return JsonResponse({"response": "Error"})
+
+    from core.library import save_document, schedule_document_indexing
+
+    try:
+        document = save_document(req.user, uploaded.handle, uploaded.name)
+        schedule_document_indexing(req.user, document)
+    except Exception as e:
+        print(f"Error adding upload: {e}")
+        document = None
+    finally:
+        close_old_connections()
+
+    return JsonResponse(
+        {
+            "response": {
+                "handle": uploaded.handle,
+                "document_id": document.id if document else None,
+                "name": uploaded.name,
+                "size": uploaded.size,
+            }
+        }
+    )
+
+
+@login_required
+def get_documents(req):
+    """
+    Get the user's document library
+
+    Args:
+        req (backend request): user request
+
+    Returns:
+        JsonResponse: {"response": {"documents": [{"document_id", "name", "size", "time_stamp"}]}}
+    """
+    if req.method == "GET":
+        documents = Document.objects.filter(user=req.user).order_by("-time_stamp")
+        return JsonResponse(
+            {
+                "response": {
+                    "documents": [
+                        {
+                            "document_id": document.id,
+                            "name": document.name,
+                            "size": document.size,
+                            "time_stamp": document.time_stamp,
+                        }
+                        for document in documents
+                    ]
+                }
+            }
+        )
+
+
+@login_required
+def delete_document(req):
+    """
+    Delete a document from the user's library
+
+    Args:
+        req (http_request): The user request
+
+    Returns:
+        JsonResponse: Json response of either "Success" or "Failed"
+    """
+    if req.method == "DELETE":
+        from core.library import remove_document
+
+        try:
+            body = json.loads(req.body)
+            document = Document.objects.get(user=req.user, id=body["document_id"])
+            remove_document(req.user, document)
+            return JsonResponse({"response": "Success"})
+        except:
+            return JsonResponse({"response": "Failed"})
+
+
 @login_required
 def delete_chat(req):
     """ "
@@ -147,30 +255,39 @@ def delete_chat(req):
             return JsonResponse({"response": "Failed"})
 
 
-def generate_llm_prompt(req, current_chat_id: int, body: dict, web_url: str):
+async def load_history(user, current_chat_id: int) -> list:
     """
-    Generates the prompt for the LLM, incorporating previous chat messages
-    and the current user message.
+    Load the previous messages of a chat
 
     Args:
-        req (backend request): The user request
+        user (User): The user the chat belongs to
         current_chat_id (int): The current chat id
-        body (dict): The user's request content
-        web_url (str): The url to make a web search to
 
     Returns:
-        If search_result = None, JsonResponse: {"response", "Error getting response"}
-        json: {"mode": body["model_name"], "prompt", prompt}
+        list: [{"role", "content"}] in chat order
     """
+    return [
+        message
+        async for message in Message.objects.filter(
+            chat__chat_id=current_chat_id, chat__user=user
+        ).values("role", "content")
+    ]
 
-    previous_chats = None
-    try:
-        chat = Chats.objects.get(chat_id=current_chat_id, user=req.user)
-        previous_chats = chat.content["messages"]
-    except Chats.DoesNotExist:
-        previous_chats = []
 
-    prompt = "You are a helpful assistant and your response should be in the format of markdown.  Consider the following conversation history:\n"
+def generate_llm_prompt(previous_chats: list, body: dict, search_text: str = ""):
+    """
+    Generates the prompt for the LLM, incorporating previous chat messages
+    and the current user message.
+
+    Args:
+        previous_chats (list): The chat history from load_history
+        body (dict): The user's request content
+        search_text (str, optional): Formatted search results from search_prompt. Defaults to "".
+
+    Returns:
+        json: {"mode": body["model_name"], "prompt", prompt, "keep_alive": keep_alive}
+    """
+    prompt = SYSTEM_PROMPT + "  Consider the following conversation history:\n"
     for message in previous_chats:
         prompt += f"User: {message['content']}\n"
 
@@ -180,13 +297,85 @@ def generate_llm_prompt(req, current_chat_id: int, body: dict, web_url: str):
 
     prompt += "Assistant:\n"
 
-    if body["search_web"]:
-        search_result = web_search(web_url, body["message"]["content"])
-        print(search_result)
-        if search_result == None:
-            search_result = "No search results"
+    prompt += search_text
+
+    return {
+        "model": body["model_name"],
+        "prompt": prompt,
+        "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+    }
+
+
+def generate_llm_messages(previous_chats: list, body: dict, search_text: str = ""):
+    """
+    Generates the structured messages for Ollama's chat endpoint. The system
+    message and history come first and stay identical between turns, so Ollama
+    can reuse its prompt cache for them; per-turn context (search results,
+    retrieved chunks) only goes in the last user message.
+
+    Args:
+        previous_chats (list): The chat history from load_history
+        body (dict): The user's request content
+        search_text (str, optional): Formatted search results from search_prompt. Defaults to "".
+
+    Returns:
+        json: {"model": body["model_name"], "messages": messages, "keep_alive": keep_alive}
+    """
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+
+    for message in previous_chats:
+        messages.append({"role": message["role"], "content": message["content"]})
+
+    messages.append({"role": "user", "content": body["message"]["content"] + search_text})
+
+    return {
+        "model": body["model_name"],
+        "messages": messages,
+        "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+    }
+
+
+async def run_stage(name: str, awaitable, timeout: float, default):
+    """
+    Await one stage of prompt preparation, degrading to a default instead of
+    failing the whole request
+
+    Args:
+        name (str): The stage name, for logging
+        awaitable (awaitable): The stage
+        timeout (float): Seconds to wait before giving up on the stage
+        default: Returned if the stage times out or errors
 
-        prompt += f"""
+    Returns:
+        The stage's result or default
+    """
+    try:
+        with metrics.time_stage(name.lower().replace(" ", "_")):
+            return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        print(f"{name} timed out after {timeout}s")
+    except Exception as e:
+        print(f"{name} error: {e}")
+    return default
+
+
+async def search_prompt(web_url: str, query: str) -> str:
+    """
+    Search the web and format the results for the prompt
+
+    Args:
+        web_url (str): The url to make a web search to
+        query (str): The user's message
+
+    Returns:
+        str: The search results and instructions for citing them
+    """
+    search_result = await web_search(web_url, query)
+    print(search_result)
+    if search_result == None:
+        search_result = "No search results"
+
+    return f"""
         Here are the top search results (in JSON):
         {search_result}
 
@@ -196,235 +385,1074 @@ def generate_llm_prompt(req, current_chat_id: int, body: dict, web_url: str):
         If a statement is based on your own reasoning or general knowledge, note that clearly.
         """
 
-    return {"model": body["model_name"], "prompt": prompt}
 
+def append_to_prompt(payload: dict, text: str):
+    """
+    Append text to the prompt, or to the last user message in chat mode
 
-@login_required
-def send_chat(req):
-    if req.method == "POST":
-        body = json.loads(req.body)
-
-        current_chat_id = body["chat_id"]
+    Args:
+        payload (dict): The request payload
+        text (str): The text to append
+    """
+    if "messages" in payload:
+        payload["messages"][-1]["content"] += text
+    else:
+        payload["prompt"] += text
 
-        interaction_counter = body["counter"]
 
-        web_url = body["search_web_url"]
+def process_attachments(user, current_chat_id: int, user_message: dict):
+    """
+    Add the user's attachments to their document library, then retrieve the
+    chunks relevant to the message from every document attached to the chat.
+    Blocking (file io, pdf parsing, embedding), so run it off the event loop.
 
-        ollama_url = body["ollama_url"] + "/api/generate"
+    Attachments can be {"handle"} from upload_file, {"document_id"} for a
+    document already in the library, or a base64 {"file"}.
 
-        user_message = body["message"]
+    Args:
+        user (User): The user the attachments belong to
+        current_chat_id (int): The current chat id
+        user_message (dict): The user's message
 
-        file_directory = os.path.join(
-            settings.BASE_DIR, f"document_storage/f{req.user}"
-        )
-        os.makedirs(file_directory, exist_ok=True)
+    Returns:
+        tuple: (attachment_texts, retrieved_chunks, document_ids)
+    """
+    from core.extraction import extract_text_from_file
+    from core.library import index_document
+    from core.rag import retrieve_library_chunks
 
-        attachments = user_message.get("attachments", [])
+    attachments = user_message.get("attachments", [])
 
-        attachment_texts = []
+    documents = []
 
-        for i, attachment in enumerate(attachments):
-            file_data = attachment.get("file", "")
+    for i, attachment in enumerate(attachments):
+        try:
+            document = attachment_document(user, attachment, i)
+        except Exception as e:
+            print(f"Error adding attachment: {e}")
+            continue
+        if document is not None:
+            # Library documents can be attached by id alone
+            attachment.setdefault("name", document.name)
+            documents.append(document)
+
+    document_ids = [document.id for document in documents]
+
+    # Documents attached on earlier turns stay searchable without re-attaching
+    search_ids = set(document_ids)
+    search_ids.update(
+        Document.objects.filter(
+            chats__chat_id=current_chat_id, chats__user=user
+        ).values_list("id", flat=True)
+    )
+
+    if not search_ids:
+        return [], [], document_ids
+
+    retrieved_chunks = []
+
+    # A document that can't be indexed (unsupported, corrupt) is left out of
+    # retrieval, the others are still searched
+    for document in documents:
+        try:
+            index_document(user, document)
+        except Exception as e:
+            print(f"Error indexing {document.name}: {e}")
 
-            file_ext = attachment.get("extension", "")
+    try:
+        query = user_message.get("content", "")
 
-            file_name = attachment.get("name", f"attachment_{i}.{file_ext}")
+        with metrics.time_stage("retrieval"):
+            retrieved_chunks = retrieve_library_chunks(user, search_ids, query, k=5)
 
-            if not file_data:
+    except Exception as e:
+        print(f"Embedding or retrieval error: {e}")
+
+    # Without retrieval, fall back to the start of the first files
+    attachment_texts = []
+    if not retrieved_chunks:
+        for document in documents[:2]:
+            file_path = resolve_upload(user, document.handle)
+            if file_path is None:
                 continue
+            with metrics.time_stage("extraction"):
+                extracted_text = extract_text_from_file(
+                    file_path, max_chars=settings.ATTACHMENT_PREVIEW_CHARS
+                )
+            if extracted_text:
+                attachment_texts.append(extracted_text)
 
-            try:
-                file_bytes = base64.b64decode(file_data)
+    return attachment_texts, retrieved_chunks, document_ids
 
-            except Exception as e:
-                print(f"Error decoding file: {e}")
 
-                continue
+def attachment_document(user, attachment: dict, i: int):
+    """
+    Get the library document an attachment refers to, adding it if needed.
+    process_attachments indexes it.
 
-            temp_path = os.path.join(
-                file_directory,
-                f"{req.user}_{current_chat_id}_{interaction_counter}_{file_name}",
-            )
-            with open(temp_path, "wb") as f:
-                f.write(file_bytes)
+    Args:
+        user (User): The user the attachment belongs to
+        attachment (dict): The attachment from the user's message
+        i (int): The attachment's position, for naming unnamed files
 
-            extracted_text = extract_text_from_file(temp_path)
+    Returns:
+        Document: The document, or None if the attachment can't be used
+    """
+    from core.library import save_document
 
-            if extracted_text:
-                attachment_texts.append(extracted_text)
+    if attachment.get("document_id"):
+        return Document.objects.filter(
+            user=user, id=attachment["document_id"]
+        ).first()
 
-        retrieved_chunks = []
+    # Files sent through upload_file are already on disk and in the library
+    handle = attachment.get("handle")
+    if handle:
+        document = Document.objects.filter(user=user, handle=handle).first()
+        if document is None and resolve_upload(user, handle) is not None:
+            document = save_document(user, handle, attachment.get("name", handle))
+        if document is None:
+            print(f"Unknown upload handle: {handle}")
+        return document
 
-        if attachment_texts:
-            all_text = "\n\n".join(attachment_texts)
+    file_data = attachment.get("file", "")
 
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000, chunk_overlap=200
-            )
-            docs = splitter.create_documents([all_text])
+    file_ext = attachment.get("extension", "")
 
-            try:
-                embeddings = OllamaEmbeddings(model="embeddinggemma:300m")
+    file_name = attachment.get("name", f"attachment_{i}.{file_ext}")
+
+    if not file_data:
+        return None
+
+    try:
+        with metrics.time_stage("attachment_decode"):
+            file_bytes = base64.b64decode(file_data)
+            handle = save_upload(user, file_name, file_bytes)
+
+    except Exception as e:
+        print(f"Error decoding file: {e}")
 
-                vector_store = FAISS.from_documents(docs, embeddings)
+        return None
 
-                retriever = vector_store.as_retriever(search_kwargs={"k": 5})
+    return save_document(user, handle, file_name)
 
-                query = user_message.get("content", "")
 
-                results = retriever.invoke(query)
+@login_required
+async def send_chat(req):
+    if req.method == "POST":
+        body = json.loads(req.body)
+
+        user = await req.auser()
+
+        # Turn the request away before doing any work if it couldn't be
+        # queued. Until it's queued it counts as waiting, so requests can't
+        # pile up attachment, retrieval and search work past the queue limits.
+        try:
+            preparation = get_admission().prepare(user.id)
+        except QueueFull:
+            return JsonResponse({"response": "Too many requests"}, status=429)
 
-                retrieved_chunks = [doc.page_content for doc in results]
+        with preparation:
+            current_chat_id = body["chat_id"]
 
-            except Exception as e:
-                print(f"Embedding or retrieval error: {e}")
+            interaction_counter = body["counter"]
 
-        payload = generate_llm_prompt(req, current_chat_id, body, web_url)
+            # Upstreams come from the user's saved settings, not the request
+            user_settings = await aget_user_settings(user)
 
-        if retrieved_chunks:
-            payload[
-                "prompt"
-            ] += (
-                "\n\nThe following information was retrieved from uploaded documents:\n"
+            web_url = user_settings["search_url"]
+
+            ollama_url = user_settings["ollama_url"]
+
+            user_message = body["message"]
+
+            attachments = user_message.get("attachments", [])
+
+            labels = {"model": body["model_name"], "upstream": ollama_upstream(ollama_url)}
+
+            # The thread can't be stopped, so a timed out stage keeps it
+            # running. It stays counted in the queue limits until it's done.
+            attachments_task = asyncio.ensure_future(
+                sync_to_async(profile_thread(process_attachments), thread_sensitive=False)(
+                    user, current_chat_id, user_message
+                )
             )
+            preparation.hold_until(attachments_task)
+
+            # Attachments, history and web search are independent until the prompt
+            # is assembled, so run them together and wait for the slowest
+            stages = [
+                run_stage(
+                    "Attachments",
+                    asyncio.shield(attachments_task),
+                    settings.STAGE_TIMEOUT_ATTACHMENTS,
+                    ([], [], []),
+                ),
+                run_stage(
+                    "History",
+                    load_history(user, current_chat_id),
+                    settings.STAGE_TIMEOUT_HISTORY,
+                    [],
+                ),
+            ]
+            if body["search_web"]:
+                stages.append(
+                    run_stage(
+                        "Web search",
+                        search_prompt(web_url, user_message["content"]),
+                        settings.STAGE_TIMEOUT_SEARCH,
+                        "",
+                    )
+                )
+
+            with metrics.stage_labels(**labels):
+                results = await asyncio.gather(*stages)
+            (attachment_texts, retrieved_chunks, document_ids), previous_chats = results[:2]
+            search_text = results[2] if len(results) > 2 else ""
+
+            if settings.OLLAMA_API == "chat":
+                payload = generate_llm_messages(previous_chats, body, search_text)
+            else:
+                payload = generate_llm_prompt(previous_chats, body, search_text)
+
+            if retrieved_chunks:
+                append_to_prompt(
+                    payload,
+                    "\n\nThe following information was retrieved from uploaded documents:\n"
+                    + "\n---\n".join(retrieved_chunks),
+                )
+
+            elif attachment_texts:
+                append_to_prompt(
+                    payload,
+                    "\n\nThe user also uploaded the following files:\n"
+                    + "\n".join(attachment_texts[:2]),
+                )
+
+        if body.get("stream"):
+            response = StreamingHttpResponse(
+                stream_chat_response(
+                    user,
+                    ollama_url,
+                    payload,
+                    current_chat_id,
+                    interaction_counter,
+                    user_message,
+                    attachments,
+                    document_ids,
+                    body.get("generation_id"),
+                ),
+                content_type="application/x-ndjson",
+            )
+            # Keep proxies from buffering the stream
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"
+            return response
+
+        try:
+            ticket = get_admission().enqueue(user.id)
+        except QueueFull:
+            return JsonResponse({"response": "Too many requests"}, status=429)
+
+        generation = start_generation(user.id, body.get("generation_id"))
+        output = ""
+        stats = {}
+        try:
+            try:
+                # stop_generation ends either early, answer with what was generated
+                if await ticket.wait(stop=generation.stop):
+                    async for fragment in stream_ollama(
+                        ollama_url, payload, stats, generation.stop
+                    ):
+                        output += fragment
+            except asyncio.CancelledError:
+                # The client went away, keep what was generated
+                if output.strip():
+                    await asyncio.shield(
+                        save_chat_messages(
+                            user,
+                            current_chat_id,
+                            interaction_counter,
+                            user_message,
+                            attachments,
+                            document_ids,
+                            output.strip(),
+                        )
+                    )
+                raise
+            stopped = generation.stopped
+            # The slot is free once Ollama is done, saving doesn't need it, and
+            # the generation can't be stopped anymore
+            ticket.release()
+            finish_generation(generation)
+
+            output = output.strip()
+
+            # Nothing to keep when stopped before Ollama answered
+            if output:
+                with metrics.time_stage("db_save", **labels):
+                    await save_chat_messages(
+                        user,
+                        current_chat_id,
+                        interaction_counter,
+                        user_message,
+                        attachments,
+                        document_ids,
+                        output,
+                    )
+
+            return JsonResponse({"response": output, "stats": stats, "stopped": stopped})
+        except httpx.HTTPError as e:
+            print("Ollama error:", e)
+            return JsonResponse({"response": "Error getting response"})
+        finally:
+            ticket.release()
+            finish_generation(generation)
 
-            payload["prompt"] += "\n---\n".join(retrieved_chunks)
 
-        elif attachment_texts:
-            payload["prompt"] += "\n\nThe user also uploaded the following files:\n"
+@login_required
+def stop_generation(req):
+    """
+    Stop one of the user's generations. Ollama stops generating and the
+    output so far is saved and sent back as the end of the send_chat response.
 
-            payload["prompt"] += "\n".join(attachment_texts[:2])
+    Args:
+        req (http_request): The user request, body {"generation_id"}
 
+    Returns:
+        JsonResponse: Json response of either "Success" or "Failed". "Failed"
+        also when the generation runs in another worker process, closing the
+        send_chat request stops it there.
+    """
+    if req.method == "POST":
+        try:
+            body = json.loads(req.body)
+            if cancel_generation(req.user.id, body["generation_id"]):
+                return JsonResponse({"response": "Success"})
+            return JsonResponse({"response": "Failed"})
+        except:
+            return JsonResponse({"response": "Failed"})
+
+
+async def stream_ollama(
+    ollama_url: str, payload: dict, stats: dict = None, stop: asyncio.Event = None
+):
+    """
+    Stream response fragments from Ollama's NDJSON generate or chat endpoint.
+    When settings.OLLAMA_BACKENDS is set the request goes to a backend chosen
+    by the router (see core/router.py) instead of ollama_url, and moves on to
+    another backend if one fails before producing any output.
+
+    Args:
+        ollama_url (str): The ollama url
+        payload (dict): The request payload, {"model", "messages"} is sent to
+            /api/chat and {"model", "prompt"} to /api/generate
+        stats (dict, optional): Filled with the OLLAMA_STATS of the final object
+            (prompt_eval_count, prompt_eval_duration, ...)
+        stop (asyncio.Event, optional): When set, the upstream stream is closed
+            and iteration ends
+
+    Yields:
+        str: Each response fragment as it arrives
+    """
+    router = get_router()
+    if router is None:
+        async for fragment in stream_backend(ollama_url, payload, stats, stop):
+            yield fragment
+        return
+
+    tried = set()
+    while True:
+        backend = router.acquire(payload["model"], exclude=tried)
+        if backend is None:
+            raise httpx.ConnectError("No Ollama backend available")
+
+        started = False
         try:
-            output = ""
+            async for fragment in stream_backend(backend.url, payload, stats, stop):
+                started = True
+                yield fragment
+            return
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            if not is_retryable(e):
+                raise
+            router.report_failure(backend, payload["model"], e)
+            # Output already sent can't be taken back, so only fail over before it
+            if started:
+                raise
+            tried.add(backend.url)
+            print(f"Ollama backend {backend.url} failed ({e}), trying another")
+        finally:
+            router.release(backend)
+
+
+async def stream_backend(
+    ollama_url: str, payload: dict, stats: dict = None, stop: asyncio.Event = None
+):
+    """
+    Stream response fragments from one Ollama server
+
+    Args:
+        ollama_url (str): The ollama url
+        payload (dict): The request payload
+        stats (dict, optional): Filled with the OLLAMA_STATS of the final object
+        stop (asyncio.Event, optional): When set, the upstream stream is closed
+
+    Yields:
+        str: Each response fragment as it arrives
+    """
+    endpoint = "/api/chat" if "messages" in payload else "/api/generate"
+    labels = {"model": payload["model"], "upstream": metrics.label_upstream(ollama_url)}
 
-            with requests.post(ollama_url, json=payload, stream=True) as response:
+    client = get_client(ollama_url)
+    started = time.perf_counter()
+    first_fragment = True
+    try:
+        with track_generation():
+            async with client.stream("POST", endpoint, json=payload) as response:
                 response.raise_for_status()
 
-                for line in response.iter_lines():
+                async for line in response.aiter_lines():
+                    # Leaving the stream closes it, which stops Ollama generating
+                    if stop is not None and stop.is_set():
+                        break
                     if line:
-                        data = json.loads(line.decode("utf-8"))
-
-                        output += data.get("response", "")
+                        data = json.loads(line)
+
+                        if "message" in data:
+                            fragment = data["message"].get("content", "")
+                        else:
+                            fragment = data.get("response", "")
+                        if fragment:
+                            if first_fragment:
+                                first_fragment = False
+                                metrics.TIME_TO_FIRST_TOKEN.observe(
+                                    time.perf_counter() - started, **labels
+                                )
+                            yield fragment
 
                         if data.get("done"):
+                            metrics.GENERATION_SECONDS.observe(
+                                time.perf_counter() - started, **labels
+                            )
+                            observe_throughput(data, labels)
+                            if stats is not None:
+                                stats.update(
+                                    {key: data[key] for key in OLLAMA_STATS if key in data}
+                                )
                             break
+    except httpx.HTTPError as e:
+        metrics.upstream_error("ollama", labels["upstream"], e)
+        raise
+
+
+def observe_throughput(data: dict, labels: dict):
+    """
+    Record the tokens per second Ollama reports in its final object
+
+    Args:
+        data (dict): The final streamed object
+        labels (dict): {"model", "upstream"}
+    """
+    # Durations are in nanoseconds
+    if data.get("eval_count") and data.get("eval_duration"):
+        metrics.TOKENS_PER_SECOND.observe(
+            data["eval_count"] / (data["eval_duration"] / 1e9), **labels
+        )
+    if data.get("prompt_eval_count") and data.get("prompt_eval_duration"):
+        metrics.PROMPT_TOKENS_PER_SECOND.observe(
+            data["prompt_eval_count"] / (data["prompt_eval_duration"] / 1e9), **labels
+        )
+
+
+def ollama_upstream(ollama_url: str) -> str:
+    """
+    Get the upstream label for a generation's stages
+
+    Args:
+        ollama_url (str): The user's ollama url
+
+    Returns:
+        str: "pool" when settings.OLLAMA_BACKENDS is used, otherwise the url
+    """
+    if get_router() is not None:
+        return "pool"
+    return metrics.label_upstream(ollama_url)
+
+
+async def stream_chat_response(
+    user,
+    ollama_url: str,
+    payload: dict,
+    current_chat_id: int,
+    interaction_counter: int,
+    user_message: dict,
+    attachments: list,
+    document_ids: list,
+    generation_id: str = None,
+):
+    """
+    Forward Ollama fragments to the client as NDJSON and persist the final message
 
-                output = output.strip()
+    Each line is one of:
+        {"generation_id": id} first, for stop_generation
+        {"queued": true, "position": n, "estimated_wait": seconds}
+        {"response": fragment}
+        {"done": true, "response": full_output, "stats": ollama timing stats, "stopped": bool}
+        {"error": "Error getting response"}
 
-            current_chat, created = Chats.objects.get_or_create(
-                chat_id=current_chat_id,
-                user=req.user,
-                defaults={
-                    "content": {"messages": []},
-                    "time_stamp": datetime.datetime.now(),
-                    "title": user_message["content"],
-                },
+    If the client disconnects the upstream request is closed and whatever was
+    generated so far is saved.
+
+    Args:
+        user (User): The user the chat belongs to
+        ollama_url (str): The ollama url
+        payload (dict): The request payload
+        current_chat_id (int): The current chat id
+        interaction_counter (int): The id of the user message
+        user_message (dict): The user's message
+        attachments (list): The user's attachments
+        document_ids (list): Ids of the library documents attached
+        generation_id (str, optional): Id picked by the client for the generation
+
+    Yields:
+        str: NDJSON lines
+    """
+    output = ""
+    stats = {}
+    stopped = False
+    try:
+        ticket = get_admission().enqueue(user.id)
+    except QueueFull:
+        yield json.dumps({"error": "Too many requests"}) + "\n"
+        return
+
+    generation = start_generation(user.id, generation_id)
+    try:
+        yield json.dumps({"generation_id": generation.id}) + "\n"
+
+        # Tell the client where it is in the queue until it's admitted
+        interval = settings.GENERATION_QUEUE_UPDATE_INTERVAL
+        admitted = await ticket.wait(interval, generation.stop)
+        while not admitted and not generation.stopped:
+            yield json.dumps({"queued": True, **ticket.status()}) + "\n"
+            admitted = await ticket.wait(interval, generation.stop)
+
+        # stop_generation ends either early, the client is still listening for the rest
+        if admitted:
+            async for fragment in stream_ollama(ollama_url, payload, stats, generation.stop):
+                output += fragment
+                yield json.dumps({"response": fragment}) + "\n"
+        stopped = generation.stopped
+    except asyncio.CancelledError:
+        # The client went away, keep what it was sent
+        if output.strip():
+            await asyncio.shield(
+                save_chat_messages(
+                    user,
+                    current_chat_id,
+                    interaction_counter,
+                    user_message,
+                    attachments,
+                    document_ids,
+                    output.strip(),
+                )
             )
+        raise
+    except httpx.HTTPError as e:
+        print("Ollama error:", e)
+        yield json.dumps({"error": "Error getting response"}) + "\n"
+        return
+    finally:
+        ticket.release()
+        finish_generation(generation)
+
+    output = output.strip()
 
-            if "messages" not in current_chat.content or not isinstance(
-                current_chat.content["messages"], list
+    try:
+        # Nothing to keep when stopped before Ollama answered
+        if output:
+            with metrics.time_stage(
+                "db_save", model=payload["model"], upstream=ollama_upstream(ollama_url)
             ):
-                current_chat.content["messages"] = []
+                await save_chat_messages(
+                    user,
+                    current_chat_id,
+                    interaction_counter,
+                    user_message,
+                    attachments,
+                    document_ids,
+                    output,
+                )
+    except DatabaseError as e:
+        print(f"Error saving chat: {e}")
+        yield json.dumps({"error": "Error saving chat"}) + "\n"
+        return
 
-            current_chat.content["messages"].append(
-                {
-                    "id": interaction_counter,
-                    "role": "user",
-                    "content": user_message["content"],
-                    "attachments": [a["name"] for a in attachments],
-                }
-            )
-            current_chat.content["messages"].append(
-                {
-                    "id": interaction_counter + 1,
-                    "role": "assistant",
-                    "content": output,
-                }
-            )
-            current_chat.save()
+    yield json.dumps(
+        {"done": True, "response": output, "stats": stats, "stopped": stopped}
+    ) + "\n"
 
-            return JsonResponse({"response": output})
-        except requests.exceptions.RequestException as e:
-            print("Ollama error:", e)
-            return JsonResponse({"response": "Error getting response"})
+
+def schedule_message_indexing(user):
+    from core.message_index import schedule_message_indexing
+
+    schedule_message_indexing(user)
+
+
+def search_similar_messages(user, query: str, k: int) -> list:
+    from core.message_index import search_similar_messages
+
+    try:
+        return search_similar_messages(user, query, k)
+    finally:
+        close_old_connections()
+
+
+async def save_chat_messages(
+    user,
+    current_chat_id: int,
+    interaction_counter: int,
+    user_message: dict,
+    attachments: list,
+    document_ids: list,
+    output: str,
+):
+    """
+    Append the user message and the assistant response to a chat
+
+    Args:
+        user (User): The user the chat belongs to
+        current_chat_id (int): The current chat id
+        interaction_counter (int): The id of the user message
+        user_message (dict): The user's message
+        attachments (list): The user's attachments
+        document_ids (list): Ids of the library documents attached, linked to
+            the chat so later turns can search them
+        output (str): The assistant response
+    """
+    current_chat, created = await Chats.objects.aget_or_create(
+        chat_id=current_chat_id,
+        user=user,
+        defaults={
+            "time_stamp": datetime.datetime.now(),
+            "title": user_message["content"],
+        },
+    )
+
+    # Only the two new rows are written, regardless of chat length
+    await Message.objects.abulk_create(
+        [
+            Message(
+                chat=current_chat,
+                ordinal=interaction_counter,
+                role="user",
+                content=user_message["content"],
+                attachments=[a.get("name", "") for a in attachments],
+            ),
+            Message(
+                chat=current_chat,
+                ordinal=interaction_counter + 1,
+                role="assistant",
+                content=output,
+            ),
+        ]
+    )
+
+    if document_ids:
+        await current_chat.documents.aadd(*document_ids)
+
+    # Embed the new messages for semantic search, off the request path. The
+    # first call imports the RAG stack, which shouldn't block the event loop.
+    await sync_to_async(schedule_message_indexing, thread_sensitive=False)(user)
 
 
 @login_required
 def get_chats(req):
     """
-    Get users chat history
+    Get a page of the user's chat history, most recent first
+
+    Query params:
+        limit (int, optional): Chats per page. Defaults to settings.CHAT_PAGE_SIZE.
+        cursor (str, optional): next_cursor from the previous page
 
     Args:
         req (backend request: user request
 
     Returns:
         JsonResponse: {"response": either user_return or "Error"}
+            user_return is {"user_chats": [...], "next_cursor": str or None}
     """
     if req.method == "GET":
         try:
-            user_chats = Chats.objects.filter(user=req.user)
-            user_return = {"user_chats": []}
-            for chat in user_chats:
+            limit = max(
+                min(int(req.GET.get("limit", settings.CHAT_PAGE_SIZE)), settings.CHAT_PAGE_MAX),
+                1,
+            )
+            # Only the listing columns, newest first. id breaks ties between
+            # chats from the same day so the cursor is exact.
+            user_chats = (
+                Chats.objects.filter(user=req.user)
+                .order_by("-time_stamp", "-id")
+                .values("id", "chat_id", "time_stamp", "title")
+            )
+
+            cursor = req.GET.get("cursor")
+            if cursor:
+                time_stamp, last_id = decode_chat_cursor(cursor)
+                user_chats = user_chats.filter(
+                    Q(time_stamp__lt=time_stamp)
+                    | Q(time_stamp=time_stamp, id__lt=last_id)
+                )
+
+            # One extra row tells us whether there's another page
+            page = list(user_chats[: limit + 1])
+            next_cursor = None
+            if len(page) > limit:
+                page = page[:limit]
+                next_cursor = encode_chat_cursor(page[-1])
+
+            user_return = {"user_chats": [], "next_cursor": next_cursor}
+            for chat in page:
                 temp = {}
-                temp["chat_id"] = chat.chat_id
-                temp["time_stamp"] = chat.time_stamp
-                temp["title"] = chat.title
+                temp["chat_id"] = chat["chat_id"]
+                temp["time_stamp"] = chat["time_stamp"]
+                temp["title"] = chat["title"]
                 user_return["user_chats"].append(temp)
             return JsonResponse({"response": user_return})
         except:
-            return JsonResponse({"response": {"Error"}})
+            return JsonResponse({"response": "Error"})
+
+
+def encode_chat_cursor(chat: dict) -> str:
+    """
+    Build the get_chats cursor pointing after a chat
+
+    Args:
+        chat (dict): The last chat of a page, with "time_stamp" and "id"
+
+    Returns:
+        str: "{time_stamp}.{id}"
+    """
+    return f"{chat['time_stamp'].isoformat()}.{chat['id']}"
+
+
+def decode_chat_cursor(cursor: str) -> tuple:
+    """
+    Parse a get_chats cursor
+
+    Args:
+        cursor (str): The cursor from encode_chat_cursor
+
+    Returns:
+        tuple: (time_stamp, id)
+    """
+    time_stamp, last_id = cursor.split(".")
+    return datetime.date.fromisoformat(time_stamp), int(last_id)
+
+
+def message_to_dict(message: Message) -> dict:
+    """
+    Serialize a message in the format the client expects
+
+    Args:
+        message (Message): The message
+
+    Returns:
+        dict: {"id", "role", "content", "attachments"}
+    """
+    return {
+        "id": message.ordinal,
+        "role": message.role,
+        "content": message.content,
+        "attachments": message.attachments,
+    }
 
 
 @login_required
 def load_chat(req):
     """
-    Load a specific chat
+    Load a window of a specific chat. By default the last
+    settings.MESSAGE_PAGE_SIZE messages are returned, pass next_cursor back
+    as "before" to get the messages before them.
+
+    Body:
+        chat_id (int): The chat id
+        limit (int, optional): Most messages to return. Defaults to settings.MESSAGE_PAGE_SIZE.
+        before (int, optional): Only messages with an id below this
+        start, end (int, optional): Only messages with start <= id < end
 
     Args:
         req (backend request): user request
 
     Returns:
         JsonResponse: {"response": either user_return or "Error"}
+            user_return is {"content": {"messages": [...]}, "next_cursor": int or None}
     """
     if req.method == "POST":
         try:
             body = json.loads(req.body)
             chat_id = body["chat_id"]
+            limit = max(
+                min(int(body.get("limit", settings.MESSAGE_PAGE_SIZE)), settings.MESSAGE_PAGE_MAX),
+                1,
+            )
             chat = Chats.objects.get(user=req.user, chat_id=chat_id)
-            user_return = {"content": chat.content}
+
+            window = chat.messages.all()
+            if body.get("before") is not None:
+                window = window.filter(ordinal__lt=int(body["before"]))
+            if body.get("start") is not None:
+                window = window.filter(ordinal__gte=int(body["start"]))
+            if body.get("end") is not None:
+                window = window.filter(ordinal__lt=int(body["end"]))
+
+            next_cursor = None
+            if body.get("start") is not None:
+                page = list(window[:limit])
+                if page and chat.messages.filter(ordinal__lt=page[0].ordinal).exists():
+                    next_cursor = page[0].ordinal
+            else:
+                # The newest messages of the window, read backwards off the
+                # (chat, ordinal) index. One extra row tells us if there's more.
+                page = list(window.order_by("-ordinal")[: limit + 1])
+                page.reverse()
+                if len(page) > limit:
+                    page = page[1:]
+                    next_cursor = page[0].ordinal
+
+            messages = [message_to_dict(message) for message in page]
+            user_return = {"content": {"messages": messages}, "next_cursor": next_cursor}
             return JsonResponse({"response": user_return})
         except:
             return JsonResponse({"response": "Error"})
 
 
 @login_required
-def get_models(req):
+def search_chats(req):
+    """
+    Keyword search over the user's chat history (see core/chat_search.py)
+
+    Query params:
+        q (str): The search
+        limit (int, optional): Most messages to return. Defaults to settings.CHAT_SEARCH_LIMIT.
+
+    Args:
+        req (backend request): user request
+
+    Returns:
+        JsonResponse: {"response": either user_return or "Error"}
+            user_return is {"chats": [...], "messages": [...]}, both best match first
+    """
+    if req.method == "GET":
+        try:
+            limit = max(
+                min(int(req.GET.get("limit", settings.CHAT_SEARCH_LIMIT)), settings.CHAT_SEARCH_MAX),
+                1,
+            )
+            hits = search_messages(req.user, req.GET.get("q", ""), limit)
+            user_return = {"chats": group_by_chat(hits), "messages": hits}
+            return JsonResponse({"response": user_return})
+        except Exception as e:
+            print(f"Chat search error: {e}")
+            return JsonResponse({"response": "Error"})
+
+
+@login_required
+async def semantic_search(req):
     """
-    Get list of available models
+    Find messages in the user's chat history by meaning (see core/message_index.py)
+
+    Query params:
+        q (str): What to look for
+        k (int, optional): Most messages to return. Defaults to settings.SEMANTIC_SEARCH_K.
+
+    Args:
+        req (backend request): user request
+
+    Returns:
+        JsonResponse: {"response": either {"messages": [...]} or "Error"}
+    """
+    if req.method == "GET":
+        try:
+            k = max(
+                min(int(req.GET.get("k", settings.SEMANTIC_SEARCH_K)), settings.CHAT_SEARCH_MAX),
+                1,
+            )
+            user = await req.auser()
+            # Embedding the query is a round trip to Ollama, keep it off the
+            # event loop and the thread the sync views share
+            hits = await sync_to_async(
+                profile_thread(search_similar_messages), thread_sensitive=False
+            )(user, req.GET.get("q", ""), k)
+            return JsonResponse({"response": {"messages": hits}})
+        except Exception as e:
+            print(f"Semantic search error: {e}")
+            return JsonResponse({"response": "Error"})
+
+
+@login_required
+async def get_models(req):
+    """
+    Get list of available models, from the cached catalogue (see core/catalogue.py)
+
+    Body:
+        refresh (bool, optional): Skip the cache
 
     Args:
         req (backend request): user request
 
     Returns:
         JsonResponse: {"response": either result or "Error"}
+            result is [{"name", "size", "family", "parameter_size", "quantization_level", "modified_at"}]
     """
     if req.method == "POST":
         try:
             body = json.loads(req.body)
-            ollama_url = body["ollama_url"] + "/api/tags"
-            result = []
-            with requests.get(ollama_url) as response:
-                response.raise_for_status()
-                temp = response.json()
-                model_list = temp["models"]
-                for model in model_list:
-                    result.append(model["name"])
+            refresh = bool(body.get("refresh"))
+            router = get_router()
+            if router is None:
+                user_settings = await aget_user_settings(await req.auser())
+                result = await get_catalogue(user_settings["ollama_url"], refresh=refresh)
+            else:
+                result = await pool_catalogue(router, refresh)
             return JsonResponse({"response": result})
         except:
             return JsonResponse({"response": "Error"})
 
 
+async def pool_catalogue(router, refresh: bool) -> list:
+    """
+    Get the models available on any backend of the pool
+
+    Args:
+        router (OllamaRouter): The router
+        refresh (bool): Skip the cache
+
+    Returns:
+        list: model_details of every model, once per name
+    """
+    catalogues = await asyncio.gather(
+        *[get_catalogue(backend.url, refresh=refresh) for backend in router.backends],
+        return_exceptions=True,
+    )
+    models = {}
+    for catalogue in catalogues:
+        if isinstance(catalogue, Exception):
+            continue
+        for model in catalogue:
+            models.setdefault(model["name"], model)
+    if not models and catalogues:
+        raise httpx.ConnectError("No Ollama backend available")
+    return list(models.values())
+
+
+@staff_member_required
+def backend_stats(req):
+    """
+    Get the state of the Ollama backend pool and the generation queue
+
+    Args:
+        req (backend request): user request
+
+    Returns:
+        JsonResponse: {"response": {"backends": [{"url", "healthy", "outstanding", ...}], "admission": {...}}}
+    """
+    if req.method == "GET":
+        router = get_router()
+        return JsonResponse(
+            {
+                "response": {
+                    "backends": router.stats() if router else [],
+                    "admission": get_admission().stats(),
+                }
+            }
+        )
+
+
+@staff_member_required
+def embedding_stats(req):
+    """
+    Get embedding cache statistics
+
+    Args:
+        req (backend request): user request
+
+    Returns:
+        JsonResponse: {"response": {"cache": hit rate, size and eviction stats,
+                                    "scheduler": queue depth and batch stats per model}}
+    """
+    if req.method == "GET":
+        from core.embedding_cache import get_embedding_cache
+        from core.embedding_scheduler import scheduler_stats
+
+        return JsonResponse(
+            {
+                "response": {
+                    "cache": get_embedding_cache().stats(),
+                    "scheduler": scheduler_stats(),
+                }
+            }
+        )
+
+
+@staff_member_required
+def slow_requests(req):
+    """
+    Get the slowest recent requests and, for the profiled ones, the functions
+    they spent the most time in (see profiling_middleware in core/middleware.py)
+
+    Query params:
+        limit (int, optional): Most requests to return. Defaults to 20.
+
+    Args:
+        req (backend request): user request
+
+    Returns:
+        JsonResponse: {"response": {"enabled", "summary", "requests": [{"method", "path",
+            "status", "seconds", "response_seconds", "profile_file", "top_functions", ...}]}}
+    """
+    if req.method == "GET":
+        try:
+            limit = int(req.GET.get("limit", 20))
+        except ValueError:
+            limit = 20
+        return JsonResponse(
+            {
+                "response": {
+                    "enabled": settings.PROFILING_ENABLED,
+                    "summary": timing_summary(),
+                    "requests": slowest_requests(limit),
+                }
+            }
+        )
+
+
+def prometheus_metrics(req):
+    """
+    Get the send_chat stage latencies, generation speed and upstream error
+    counts in the Prometheus text format (see core/metrics.py)
+
+    Args:
+        req (backend request): Prometheus' scrape with "Authorization: Bearer
+            settings.METRICS_TOKEN", or a staff user
+
+    Returns:
+        HttpResponse: The metrics, or 403
+    """
+    if req.method == "GET":
+        authorization = req.headers.get("Authorization", "")
+        allowed = bool(settings.METRICS_TOKEN) and hmac.compare_digest(
+            authorization.encode(), f"Bearer {settings.METRICS_TOKEN}".encode()
+        )
+        if not allowed and not req.user.is_staff:
+            return HttpResponse("Forbidden", status=403)
+
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
+
 @login_required
 def update_settings(req):
     """
@@ -442,23 +1470,7 @@ def update_settings(req):
             ollama_url = body["ollama_url"]
             search_url = body["search_url"]
             style = body["style"]
-            user_settings, created = Settings.objects.get_or_create(
-                user=req.user,
-                defaults={
-                    "user": req.user,
-                    "ollama_url": ollama_url,
-                    "search_url": search_url,
-                    "style": "light",
-                },
-            )
-            if created:
-                pass
-            else:
-                user_settings.user = req.user
-                user_settings.ollama_url = ollama_url
-                user_settings.search_url = search_url
-                user_settings.style = style
-                user_settings.save()
+            save_user_settings(req.user, ollama_url, search_url, style)
             return JsonResponse({"response": "Successful"})
         except:
             return JsonResponse({"response": "Error"})
@@ -477,22 +1489,14 @@ def load_settings(req):
     """
     if req.method == "GET":
         try:
-            user_settings, created = Settings.objects.get_or_create(
-                user=req.user,
-                defaults={
-                    "user": req.user,
-                    "ollama_url": "http://127.0.0.1:11434",
-                    "search_url": "",
-                    "style": "light",
-                },
-            )
+            user_settings = get_user_settings(req.user)
 
             return JsonResponse(
                 {
                     "response": {
-                        "ollama_url": user_settings.ollama_url,
-                        "api_url": user_settings.search_url,
-                        "style": user_settings.style,
+                        "ollama_url": user_settings["ollama_url"],
+                        "api_url": user_settings["search_url"],
+                        "style": user_settings["style"],
                     }
                 }
             )
@@ -500,15 +1504,52 @@ def load_settings(req):
             return JsonResponse({"response", "Error"})
 
 
-def web_search(sear_xng_url: str, query: str, top_n: int = 5):
+async def web_search(sear_xng_url: str, query: str, top_n: int = 5):
     """
-    Web search
+    Web search. Results are cached by normalized query, searxng url and top_n,
+    and concurrent identical searches share one upstream request.
 
     Args:
         sear_xng_url (str): searxng url
         query (str): user's query
         top_n (int, optional): The amount of search results to return. Defaults to 5.
 
+    Returns:
+        json: search results
+        or
+        None
+    """
+    query = " ".join(query.split())
+    key = (query.lower(), sear_xng_url.rstrip("/"), top_n)
+
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Tasks belong to the loop that created them, so only coalesce within a loop
+    inflight_key = (asyncio.get_running_loop(), key)
+    task = _search_inflight.get(inflight_key)
+    if task is None:
+        task = asyncio.ensure_future(fetch_search(sear_xng_url, query, top_n))
+        _search_inflight[inflight_key] = task
+        task.add_done_callback(lambda _: _search_inflight.pop(inflight_key, None))
+
+    # Shielded so one caller going away doesn't cancel the search for the others
+    result = await asyncio.shield(task)
+    if result is not None:
+        search_cache.set(key, result)
+    return result
+
+
+async def fetch_search(sear_xng_url: str, query: str, top_n: int):
+    """
+    Query searxng
+
+    Args:
+        sear_xng_url (str): searxng url
+        query (str): user's query
+        top_n (int): The amount of search results to return
+
     Returns:
         json: search results
         or
@@ -516,7 +1557,8 @@ def web_search(sear_xng_url: str, query: str, top_n: int = 5):
     """
     params = {"q": query, "format": "json"}
     try:
-        response = requests.get(f"{sear_xng_url}/search", params=params, timeout=25)
+        client = get_client(sear_xng_url)
+        response = await client.get("/search", params=params, timeout=25)
         response.raise_for_status()
         data = response.json()
         results = data.get("results", [])[:top_n]
@@ -530,6 +1572,7 @@ def web_search(sear_xng_url: str, query: str, top_n: int = 5):
             for r in results
         ]
         return json.dumps(simplified, indent=2)
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(e)
+        metrics.upstream_error("searxng", metrics.label_upstream(sear_xng_url), e)
         return None
@@ -7,6 +7,11 @@ echo "Starting entrypoint: applying migrations and collecting static files"
 
 python _server/manage.py migrate --noinput
 
+# Metrics files of the previous run's worker processes (see METRICS_DIR)
+if [ -n "${METRICS_DIR}" ]; then
+	rm -f "${METRICS_DIR}"/*.json
+fi
+
 # Collect static files (may be a no-op depending on settings)
 python _server/manage.py collectstatic --noinput || true
 
@@ -14,20 +19,32 @@ echo "Starting Gunicorn..."
 # Configurable Gunicorn options (set via env vars if desired):
 #  GUNICORN_TIMEOUT (seconds) - default 120
 #  GUNICORN_WORKERS - default 3
-#  GUNICORN_WORKER_CLASS - default gthread (no extra deps)
+#  GUNICORN_WORKER_CLASS - default uvicorn_worker.UvicornWorker (ASGI, async views)
 #  GUNICORN_THREADS - default 4 (only used with threaded workers)
+#  GUNICORN_APP - default _server.asgi:application (use _server.wsgi:application with gthread)
+#  GUNICORN_PRELOAD - default 1: load the app and the RAG stack (PRELOAD_RAG) once
+#    in the master before forking, so the workers share it (set to 0 to disable)
 
 GUNICORN_TIMEOUT=${GUNICORN_TIMEOUT:-600}
 GUNICORN_WORKERS=${GUNICORN_WORKERS:-3}
-GUNICORN_WORKER_CLASS=${GUNICORN_WORKER_CLASS:-gthread}
+GUNICORN_WORKER_CLASS=${GUNICORN_WORKER_CLASS:-uvicorn_worker.UvicornWorker}
 GUNICORN_THREADS=${GUNICORN_THREADS:-4}
+GUNICORN_APP=${GUNICORN_APP:-_server.asgi:application}
+GUNICORN_PRELOAD=${GUNICORN_PRELOAD:-1}
+
+GUNICORN_PRELOAD_FLAG=""
+if [ "${GUNICORN_PRELOAD}" = "1" ]; then
+	GUNICORN_PRELOAD_FLAG="--preload"
+	export PRELOAD_RAG=${PRELOAD_RAG:-1}
+fi
 
-echo "gunicorn settings: timeout=${GUNICORN_TIMEOUT} workers=${GUNICORN_WORKERS} worker_class=${GUNICORN_WORKER_CLASS} threads=${GUNICORN_THREADS}"
+echo "gunicorn settings: timeout=${GUNICORN_TIMEOUT} workers=${GUNICORN_WORKERS} worker_class=${GUNICORN_WORKER_CLASS} threads=${GUNICORN_THREADS} app=${GUNICORN_APP} preload=${GUNICORN_PRELOAD}"
 
-exec gunicorn _server.wsgi:application \
+exec gunicorn ${GUNICORN_APP} \
 	--chdir /app/_server \
 	--bind 0.0.0.0:8000 \
 	--workers ${GUNICORN_WORKERS} \
 	--worker-class ${GUNICORN_WORKER_CLASS} \
 	--threads ${GUNICORN_THREADS} \
-	--timeout ${GUNICORN_TIMEOUT}
+	--timeout ${GUNICORN_TIMEOUT} \
+	${GUNICORN_PRELOAD_FLAG}
@@ -1,6 +1,10 @@
-import { MessageSquare, Plus, Settings, Trash2 } from "lucide-react";
+import { useEffect, useState } from "react";
+import { MessageSquare, Plus, Search, Settings, Trash2 } from "lucide-react";
 import { Button } from "./ui/button";
+import { Input } from "./ui/input";
 import { ScrollArea } from "./ui/scroll-area";
+import { search_chats } from "./chat_functions";
+import type { ChatSearchHit } from "./chat_functions";
 
 interface Chat {
   id: string;
@@ -15,6 +19,8 @@ interface ChatHistoryProps {
   onNewChat: () => void;
   onOpenSettings: () => void;
   onDeleteChat: (id: string) => void;
+  has_more_chats: boolean;
+  onLoadMoreChats: () => void;
 }
 
 export function ChatHistory({
@@ -24,7 +30,24 @@ export function ChatHistory({
   onNewChat,
   onOpenSettings,
   onDeleteChat,
+  has_more_chats,
+  onLoadMoreChats,
 }: ChatHistoryProps) {
+  const [search_query, set_search_query] = useState("");
+  const [search_hits, set_search_hits] = useState<ChatSearchHit[]>([]);
+
+  useEffect(() => {
+    if (!search_query.trim()) {
+      set_search_hits([]);
+      return;
+    }
+    // Wait for a pause in typing before searching
+    const timer = setTimeout(() => {
+      search_chats(search_query).then(set_search_hits);
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [search_query]);
+
   const handleDelete = (e: React.MouseEvent, chatId: string) => {
     e.stopPropagation();
     onDeleteChat(chatId);
@@ -53,8 +76,43 @@ export function ChatHistory({
         </Button>
       </div>
 
+      {/* Search */}
+      <div className="p-2 border-b relative">
+        <Search className="absolute left-4 top-1/2 -translate-y-1/2 h-4 w-4 text-muted-foreground" />
+        <Input
+          value={search_query}
+          onChange={(e) => set_search_query(e.target.value)}
+          placeholder="Search chats"
+          className="pl-8 h-8 text-sm"
+        />
+      </div>
+
+      {/* Search Results */}
+      {search_query.trim() && (
+        <ScrollArea className="flex-1">
+          <div className="p-2 space-y-1">
+            {search_hits.map((hit) => (
+              <Button
+                key={`${hit.chat_id}-${hit.message_id}`}
+                onClick={() => onSelectChat(hit.chat_id)}
+                variant={current_chat_id === hit.chat_id ? "secondary" : "ghost"}
+                className="w-full justify-start text-left h-auto py-2 px-3 flex-col items-start"
+              >
+                <span className="truncate text-sm w-full">{hit.title}</span>
+                <span className="text-xs text-muted-foreground whitespace-normal line-clamp-2">
+                  {hit.snippet}
+                </span>
+              </Button>
+            ))}
+            {search_hits.length === 0 && (
+              <p className="text-xs text-muted-foreground px-3 py-2">No matches</p>
+            )}
+          </div>
+        </ScrollArea>
+      )}
+
       {/* Chat List */}
-      <ScrollArea className="flex-1">
+      <ScrollArea className={search_query.trim() ? "hidden" : "flex-1"}>
         <div className="p-2 space-y-1">
           {chats.map((chat) => (
             <div
@@ -80,6 +138,16 @@ export function ChatHistory({
               </Button>
             </div>
           ))}
+          {has_more_chats && (
+            <Button
+              onClick={onLoadMoreChats}
+              variant="ghost"
+              size="sm"
+              className="w-full text-muted-foreground"
+            >
+              Load more
+            </Button>
+          )}
         </div>
       </ScrollArea>
     </div>
@@ -1,5 +1,5 @@
 import { useState, KeyboardEvent, useRef } from "react";
-import { Send, Globe, Paperclip, X } from "lucide-react";
+import { Send, Globe, Paperclip, Square, X } from "lucide-react";
 import { Textarea } from "./ui/textarea";
 import { Button } from "./ui/button";
 import {
@@ -9,6 +9,7 @@ import {
   TooltipTrigger,
 } from "./ui/tooltip";
 import { Attachment } from "../data/Message";
+import { upload_file } from "./chat_functions";
 
 interface ChatInputProps {
   onSendMessage: (message: string, attachments?: Attachment[]) => void;
@@ -16,7 +17,9 @@ interface ChatInputProps {
   web_search: boolean;
   onWebSearchChange: (enabled: boolean) => void;
   selected_model: string;
-  api_url: string
+  api_url: string;
+  is_generating?: boolean;
+  onStop?: () => void;
 }
 
 export function ChatInput({
@@ -25,7 +28,9 @@ export function ChatInput({
   web_search,
   onWebSearchChange,
   selected_model,
-  api_url
+  api_url,
+  is_generating,
+  onStop,
 }: ChatInputProps) {
   const [message, setMessage] = useState("");
   const [attachments, setAttachments] = useState<Attachment[]>([]);
@@ -52,17 +57,23 @@ export function ChatInput({
     const files = e.target.files;
     if (!files) return;
 
-    const newAttachments: Attachment[] = await Promise.all(Array.from(files).map(async (file) => {
-      const file_buffer = await file.arrayBuffer();
-      const uint8Array = new Uint8Array(file_buffer);
-      const base64String = btoa(String.fromCharCode(...uint8Array));
-      return {
-      id: Math.random().toString(36).substring(7),
-      name: file.name,
-      file: base64String,
-      size: file.size,
-      };
-    }));
+    const uploads = await Promise.all(
+      Array.from(files).map(async (file) => {
+        const upload = await upload_file(file);
+        if (!upload) {
+          return null;
+        }
+        return {
+          id: Math.random().toString(36).substring(7),
+          name: file.name,
+          handle: upload["handle"],
+          size: file.size,
+        };
+      })
+    );
+    const newAttachments = uploads.filter(
+      (attachment): attachment is Attachment => attachment !== null
+    );
 
     setAttachments((prev) => [...prev, ...newAttachments]);
     if (fileInputRef.current) {
@@ -159,16 +170,28 @@ export function ChatInput({
                 </TooltipContent>
               </Tooltip>
             </TooltipProvider>
-            <Button
-              onClick={handleSend}
-              disabled={
-                selected_model === "" ? true : selected_model !== "" ? (!message.trim() && attachments.length === 0) : disabled
-              }
-              size="icon"
-              className="h-[44px] w-[44px]"
-            >
-              <Send className="h-4 w-4" />
-            </Button>
+            {is_generating ? (
+              <Button
+                onClick={onStop}
+                size="icon"
+                variant="outline"
+                className="h-[44px] w-[44px]"
+                aria-label="Stop generating"
+              >
+                <Square className="h-4 w-4" />
+              </Button>
+            ) : (
+              <Button
+                onClick={handleSend}
+                disabled={
+                  selected_model === "" ? true : selected_model !== "" ? (!message.trim() && attachments.length === 0) : disabled
+                }
+                size="icon"
+                className="h-[44px] w-[44px]"
+              >
+                <Send className="h-4 w-4" />
+              </Button>
+            )}
           </div>
         </div>
       </div>
@@ -9,6 +9,7 @@ import { Label } from "./ui/label";
 import { Input } from "./ui/input";
 import { Button } from "./ui/button";
 import { Save, Sunrise, Sunset } from "lucide-react";
+import type { Model } from "./chat_functions";
 import {
   Tooltip,
   TooltipContent,
@@ -23,9 +24,9 @@ interface SettingsDialogProps {
   onollama_httpChange: (url: string) => void;
   api_url: string;
   on_api_url_change: (url: string) => void;
-  save_settings: (url_1: string, url_2: string, style: string) => void;
-  set_models: (value: Array<String>) => void;
-  get_models: (value_1: string, value_2: (value: Array<String>) => void) => void;
+  save_settings: (url_1: string, url_2: string, style: string) => Promise<void>;
+  set_models: (value: Model[]) => void;
+  get_models: (value_1: string, value_2: (value: Model[]) => void) => void;
   style: "dark" | "light";
   set_style: (value: "dark" | "light") => void;
 }
@@ -109,8 +110,10 @@ export function SettingsDialog({
                 <TooltipTrigger asChild>
                   <Button
                     onClick={() => {
-                      save_settings(ollama_http, api_url, style);
-                      get_models(ollama_http, set_models);
+                      // The server lists the models of the saved ollama url
+                      save_settings(ollama_http, api_url, style).then(() =>
+                        get_models(ollama_http, set_models)
+                      );
                     }}
                     className="h-[44px] w-[44px]"
                     size="icon"
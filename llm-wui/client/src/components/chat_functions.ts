@@ -1,11 +1,16 @@
 import { toast } from "react-toastify";
+import cookies from "js-cookie";
 import { use_fetch } from "../hooks/useFetch";
 import { Message } from "../data/Message";
 import { Chat } from "../data/Chat";
 
 interface Model {
-  id: string;
   name: string;
+  size?: number;
+  family?: string;
+  parameter_size?: string;
+  quantization_level?: string;
+  modified_at?: string;
 }
 
 async function send_chat(
@@ -18,7 +23,9 @@ async function send_chat(
   selected_model: string,
   set_message_counter: (value: number) => void,
   set_messages: (value: Message[]) => void,
-  setIsLoading: (value: boolean) => void
+  setIsLoading: (value: boolean) => void,
+  generation_id: string,
+  signal: AbortSignal
 ) {
 
   try {
@@ -35,36 +42,126 @@ async function send_chat(
       search_web_url: api_url,
       model_name: selected_model,
       message: user_message,
+      stream: true,
+      generation_id: generation_id,
     };
 
-    response = await make_request(target_uri, "POST", body);
+    response = await make_request(target_uri, "POST", body, undefined, signal);
 
-    if (response.ok) {
-      const response_data = await response.json();
+    if (response.ok && response.body) {
       set_message_counter(message_counter + 2);
 
-      if (response_data["response"] === "Error getting response") {
-        toast.error("Error searching web");
-      } else if (response_data["response"] === "Error creating new chat") {
-        toast.error("Error creating new chat");
-      }
+      const model_response_id = Date.now().toString();
+      set_messages((prev) => [
+        ...prev,
+        { id: model_response_id, role: "assistant", content: "" },
+      ]);
 
-      const model_response = {
-        id: Date.now().toString(),
-        role: "assistant",
-        content: response_data["response"],
+      const update_model_response = (content: string) => {
+        set_messages((prev) =>
+          prev.map((message) =>
+            message.id === model_response_id ? { ...message, content } : message
+          )
+        );
       };
-      set_messages((prev) => [...prev, model_response]);
+
+      // Response is NDJSON, one {"response"}, {"done"} or {"error"} object per line
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let output = "";
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+          break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        const lines = buffer.split("\n");
+        buffer = lines.pop() || "";
+
+        for (const line of lines) {
+          if (!line.trim()) {
+            continue;
+          }
+          const data = JSON.parse(line);
+          if (data["generation_id"]) {
+            continue;
+          } else if (data["error"]) {
+            toast.error(data["error"]);
+          } else if (data["queued"]) {
+            update_model_response(
+              `_Waiting in queue (position ${data["position"]}, about ${Math.ceil(data["estimated_wait"])}s)_`
+            );
+            continue;
+          } else if (data["done"]) {
+            output = data["response"];
+          } else {
+            output += data["response"];
+          }
+          update_model_response(output);
+          setIsLoading(false);
+        }
+      }
+    } else if (response.status === 429) {
+      toast.error("Too many requests, please wait for your other chats to finish");
     } else {
       toast.error("Error Talking with Model");
     }
     setIsLoading(false);
   } catch (error) {
+    // Aborted by stop_chat, the server keeps what was generated
+    if (error instanceof DOMException && error.name === "AbortError") {
+      setIsLoading(false);
+      return;
+    }
     console.error("Error in send_chat:", error);
     toast.error("An unexpected error occurred.");
   }
 }
 
+async function stop_chat(generation_id: string, controller: AbortController) {
+  const make_request = use_fetch();
+  const response = await make_request("stop_generation", "POST", {
+    generation_id: generation_id,
+  });
+  const temp = await response.json().catch(() => ({ response: "Failed" }));
+  // The generation may be running in another server process, closing
+  // the request stops it there
+  if (temp["response"] !== "Success") {
+    controller.abort();
+  }
+}
+
+async function upload_file(file: File) {
+  // Multipart, so the server can stream the file to disk instead of decoding base64
+  const form_data = new FormData();
+  form_data.append("file", file);
+
+  const response = await fetch("upload_file", {
+    method: "POST",
+    credentials: "same-origin",
+    headers: {
+      "X-CSRFToken": cookies.get("csrftoken"),
+      Accept: "application/json",
+    },
+    body: form_data,
+  });
+
+  const temp = await response.json().catch(() => ({ response: "Error" }));
+  const response_result = temp["response"];
+  if (!response.ok || typeof response_result === "string") {
+    toast.error(
+      response_result === "File too large"
+        ? `${file.name} is too large`
+        : `Error uploading ${file.name}`
+    );
+    return null;
+  }
+  return response_result;
+}
+
 async function delete_chat(chat_id: string) {
   const make_request = use_fetch();
   const response = await make_request("delete_chat", "DELETE", {
@@ -98,9 +195,15 @@ function get_first_four_words(str: string) {
   return final_string + "...";
 }
 
-async function get_chats(set_chats: (value: Chat[]) => void) {
+async function get_chats(
+  set_chats: (value: Chat[]) => void,
+  cursor: string | null = null
+): Promise<string | null> {
   const make_request = use_fetch();
-  const response = await make_request("get_chats", "GET", "");
+  const target_uri = cursor
+    ? `get_chats?cursor=${encodeURIComponent(cursor)}`
+    : "get_chats";
+  const response = await make_request(target_uri, "GET", "");
 
   if (response.ok) {
     const temp = await response.json();
@@ -115,21 +218,30 @@ async function get_chats(set_chats: (value: Chat[]) => void) {
         timestamp: chat["time_stamp"],
       }));
 
-      set_chats((prev) => [...new_chats, ...prev]);
+      // Later pages are older chats, so they go at the end
+      if (cursor) {
+        set_chats((prev) => [...prev, ...new_chats]);
+      } else {
+        set_chats((prev) => [...new_chats, ...prev]);
+      }
+      return response_result["next_cursor"];
     }
   }
+  return null;
 }
 
 async function load_chat(
   chat_id: string,
   chats: Chat[],
   set_messages: (value: Message[]) => void,
-  set_message_counter: (value: number) => void
-) {
+  set_message_counter: (value: number) => void,
+  before: number | null = null
+): Promise<number | null> {
   if (chats.length > 0) {
     const make_request = use_fetch();
     const body = {
       chat_id: chat_id,
+      before: before,
     };
     const response = await make_request("load_chat", "POST", body);
     if (response.ok) {
@@ -138,18 +250,54 @@ async function load_chat(
       if (response_result === "Error") {
         toast.error("Error loading chat");
       } else {
-        for (const message of response_result["content"]["messages"]) {
-          set_messages((prev) => [...prev, message]);
-          set_message_counter(message["id"] + 1);
+        const loaded = response_result["content"]["messages"];
+        if (before !== null) {
+          // Older messages go above the ones already shown
+          set_messages((prev) => [...loaded, ...prev]);
+        } else {
+          set_messages((prev) => [...prev, ...loaded]);
+          if (loaded.length > 0) {
+            set_message_counter(loaded[loaded.length - 1]["id"] + 1);
+          }
         }
+        return response_result["next_cursor"];
       }
     }
   }
+  return null;
+}
+
+interface ChatSearchHit {
+  chat_id: string;
+  title: string;
+  message_id: number;
+  role: string;
+  snippet: string;
+  score: number;
+}
+
+async function search_chats(query: string): Promise<ChatSearchHit[]> {
+  const make_request = use_fetch();
+  const response = await make_request(
+    `search_chats?q=${encodeURIComponent(query)}`,
+    "GET",
+    ""
+  );
+  if (response.ok) {
+    const temp = await response.json();
+    const response_result = temp["response"];
+    if (response_result === "Error") {
+      toast.error("Error searching chats");
+    } else {
+      return response_result["messages"];
+    }
+  }
+  return [];
 }
 
 async function get_models(
   ollama_http: string,
-  set_models: (value: Array<String>) => void
+  set_models: (value: Model[]) => void
 ) {
   const make_request = use_fetch();
   const target_uri = "get_models";
@@ -167,4 +315,15 @@ async function get_models(
   }
 }
 
-export { send_chat, delete_chat, get_chats, load_chat, get_models, get_first_four_words };
+export type { Model, ChatSearchHit };
+export {
+  send_chat,
+  stop_chat,
+  upload_file,
+  delete_chat,
+  get_chats,
+  load_chat,
+  search_chats,
+  get_models,
+  get_first_four_words,
+};
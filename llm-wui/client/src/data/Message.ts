@@ -1,7 +1,8 @@
 export interface Attachment {
   id: string;
   name: string;
-  file: string;
+  handle?: string;
+  file?: string;
   size?: number;
 }
 
@@ -8,9 +8,10 @@ export function use_fetch() {
       "Content-Type": "application/json",
       "X-CSRFToken": cookies.get("csrftoken"),
       "Accept": "application/json",
-    }
+    },
+    signal = undefined
   ) {
-    const options = { method, credentials: "same-origin", headers, };
+    const options = { method, credentials: "same-origin", headers, signal, };
     if (body) {
       options.body = JSON.stringify(body || {});
     }
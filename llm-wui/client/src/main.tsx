@@ -5,17 +5,20 @@ import { ChatHeader } from "./components/ChatHeader";
 import { ChatHistory } from "./components/ChatHistory";
 import { SettingsDialog } from "./components/SettingsDialog";
 import { ScrollArea } from "./components/ui/scroll-area";
+import { Button } from "./components/ui/button";
 import { Message, Attachment } from "./data/Message";
 import { Chat } from "./data/Chat";
 import { ToastContainer, toast } from "react-toastify";
 import {
   send_chat,
+  stop_chat,
   delete_chat,
   get_chats,
   load_chat,
   get_models,
   get_first_four_words,
 } from "./components/chat_functions";
+import type { Model } from "./components/chat_functions";
 import {
   update_settings,
   load_settings,
@@ -23,11 +26,15 @@ import {
 
 export default function App() {
   const [messages, set_messages] = useState<Message[]>([]);
+  const [messages_cursor, set_messages_cursor] = useState<number | null>(null);
   const [isLoading, setIsLoading] = useState(false);
+  const [is_generating, set_is_generating] = useState(false);
+  const generation = useRef<{ id: string; controller: AbortController } | null>(null);
   const [selected_model, set_selected_model] = useState("");
   const [web_search, set_web_search] = useState(false);
   const [current_chat_id, set_current_chat_id] = useState("0");
   const [chats, set_chats] = useState<Chat[]>([]);
+  const [chats_cursor, set_chats_cursor] = useState<string | null>(null);
   const [settings_open, set_settings_open] = useState(false);
   const [ollama_http, set_ollama_http] = useState("http://127.0.0.1:11434");
   const [api_url, set_api_url] = useState("");
@@ -36,7 +43,7 @@ export default function App() {
   const [selected_style, set_selected_style] = useState<"dark" | "light">("light");
   const html = document.documentElement;
   const scrollRef = useRef<HTMLDivElement>(null);
-  const [models, set_models] = useState<Array<String>>([]);
+  const [models, set_models] = useState<Model[]>([]);
   const [model_list, set_model_list] = useState<
     { label: String; value: String }[]
   >([{ label: "", value: "" }]);
@@ -65,7 +72,8 @@ export default function App() {
         behavior: "smooth",
       });
     }
-  }, [messages]);
+    // Only follow new messages, not older ones loaded above
+  }, [messages[messages.length - 1]]);
 
   const handle_new_chat = () => {
     const newChat = {
@@ -76,13 +84,35 @@ export default function App() {
     set_chats((prev) => [newChat, ...prev]);
     set_current_chat_id(newChat.id);
     set_messages([]);
+    set_messages_cursor(null);
     set_message_counter(0);
   };
 
   const handle_select_chat = (chat_id: string) => {
     set_current_chat_id(chat_id);
     set_messages([]);
-    load_chat(chat_id, chats, set_messages, set_message_counter);
+    set_messages_cursor(null);
+    load_chat(chat_id, chats, set_messages, set_message_counter).then(
+      set_messages_cursor
+    );
+  };
+
+  const handle_stop = () => {
+    if (generation.current) {
+      stop_chat(generation.current.id, generation.current.controller);
+    }
+  };
+
+  const handle_load_earlier_messages = () => {
+    if (messages_cursor !== null) {
+      load_chat(
+        current_chat_id,
+        chats,
+        set_messages,
+        set_message_counter,
+        messages_cursor
+      ).then(set_messages_cursor);
+    }
   };
 
   const handle_delete_chat = (chat_id: string) => {
@@ -98,6 +128,12 @@ export default function App() {
     }
   };
 
+  const handle_load_more_chats = () => {
+    if (chats_cursor) {
+      get_chats(set_chats, chats_cursor).then(set_chats_cursor);
+    }
+  };
+
   const handle_send_message = (content: string, attachments?: Attachment[]) => {
     const user_message = {
       id: message_counter,
@@ -107,6 +143,12 @@ export default function App() {
     };
     set_messages((prev) => [...prev, user_message]);
     setIsLoading(true);
+    set_is_generating(true);
+    const current_generation = {
+      id: crypto.randomUUID().replace(/-/g, ""),
+      controller: new AbortController(),
+    };
+    generation.current = current_generation;
     send_chat(
       user_message,
       web_search,
@@ -117,8 +159,15 @@ export default function App() {
       selected_model,
       set_message_counter,
       set_messages,
-      setIsLoading
-    );
+      setIsLoading,
+      current_generation.id,
+      current_generation.controller.signal
+    ).finally(() => {
+      if (generation.current === current_generation) {
+        generation.current = null;
+        set_is_generating(false);
+      }
+    });
     set_chats((prev_chats) =>
       prev_chats.map((chat) => {
         if (chat.id === current_chat_id && chat.title === "New Chat") {
@@ -133,7 +182,7 @@ export default function App() {
   useEffect(() => {
     if (settings_loaded === false) {
       html.classList.add(selected_style);
-      get_chats(set_chats);
+      get_chats(set_chats).then(set_chats_cursor);
       load_settings(set_ollama_http, set_api_url, set_selected_style, initial_settings).then(() => {
         set_settings_loaded(true);
       });
@@ -149,7 +198,11 @@ export default function App() {
   useEffect(() => {
     let temp_list = [];
     for (const model of models) {
-      temp_list.push({ label: model, value: model });
+      const details = [model.parameter_size, model.quantization_level]
+        .filter(Boolean)
+        .join(" ");
+      const label = details ? `${model.name} (${details})` : model.name;
+      temp_list.push({ label: label, value: model.name });
     }
     set_model_list(temp_list);
   }, [models]);
@@ -180,6 +233,8 @@ export default function App() {
           onNewChat={handle_new_chat}
           onOpenSettings={() => set_settings_open(true)}
           onDeleteChat={handle_delete_chat}
+          has_more_chats={chats_cursor !== null}
+          onLoadMoreChats={handle_load_more_chats}
         />
       </div>
 
@@ -199,6 +254,16 @@ export default function App() {
           view_port_ref={scrollRef}
         >
           <div className="min-h-full">
+            {messages_cursor !== null && (
+              <Button
+                onClick={handle_load_earlier_messages}
+                variant="ghost"
+                size="sm"
+                className="w-full text-muted-foreground"
+              >
+                Load earlier messages
+              </Button>
+            )}
             {messages.map((message) => (
               <div className={`min-h-full chat-bubble `}>
                 <ChatMessage
@@ -217,6 +282,8 @@ export default function App() {
         <ChatInput
           onSendMessage={handle_send_message}
           disabled={isLoading}
+          is_generating={is_generating}
+          onStop={handle_stop}
           web_search={web_search}
           onWebSearchChange={set_web_search}
           selected_model={selected_model}